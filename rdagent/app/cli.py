@@ -25,6 +25,7 @@ from rdagent.app.kaggle.loop import main as kaggle_main
 from rdagent.app.qlib_rd_loop.factor import main as fin_factor
 from rdagent.app.qlib_rd_loop.factor_from_report import main as fin_factor_report
 from rdagent.app.qlib_rd_loop.model import main as fin_model
+from rdagent.app.utils.cache import CacheCLI
 from rdagent.app.utils.health_check import health_check
 from rdagent.app.utils.info import collect_info
 
@@ -56,5 +57,6 @@ def app():
             "health_check": health_check,
             "collect_info": collect_info,
             "kaggle": kaggle_main,
+            "cache": CacheCLI,
         }
     )
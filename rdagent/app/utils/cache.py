@@ -0,0 +1,57 @@
+"""
+Maintain the prompt cache (chat responses, embeddings and session messages) of the LLM backend.
+
+Usage:
+    rdagent cache stats
+    rdagent cache prune --ttl_days 30 --max_bytes 2000000000
+    rdagent cache vacuum
+"""
+
+import json
+from datetime import datetime
+
+from rdagent.log import rdagent_logger as logger
+from rdagent.oai.llm_utils import get_llm_cache
+
+
+def _format_time(timestamp: float | None) -> str | None:
+    return None if timestamp is None else datetime.fromtimestamp(timestamp).isoformat(timespec="seconds")
+
+
+class CacheCLI:
+    """
+    `--cache_path` defaults to `prompt_cache_path` in LLM_SETTINGS; the backend is `prompt_cache_backend`.
+    """
+
+    def stats(self, cache_path: str | None = None) -> None:
+        """show the number of records, the total bytes and the last access time range of each table"""
+        stats = get_llm_cache(cache_path).stats()
+        for table_stats in stats.values():
+            for key in ["oldest_access", "newest_access"]:
+                if key in table_stats:
+                    table_stats[key] = _format_time(table_stats[key])
+        logger.info(json.dumps(stats, indent=2))
+
+    def prune(
+        self,
+        ttl_days: float | None = None,
+        max_bytes: int | None = None,
+        cache_path: str | None = None,
+        vacuum: bool = True,
+    ) -> None:
+        """
+        evict the records not accessed in `ttl_days`, then the least recently used records until the cache is
+        no larger than `max_bytes`; the storage is compacted afterwards unless `--novacuum` is given.
+        """
+        cache = get_llm_cache(cache_path)
+        removed_n = cache.prune(
+            ttl_seconds=None if ttl_days is None else float(ttl_days) * 86400,
+            max_bytes=None if max_bytes is None else int(max_bytes),
+        )
+        logger.info(f"Evicted {removed_n} records from the prompt cache.")
+        if vacuum:
+            cache.vacuum()
+
+    def vacuum(self, cache_path: str | None = None) -> None:
+        """compact the storage so that the space of the evicted records is returned to the file system"""
+        get_llm_cache(cache_path).vacuum()
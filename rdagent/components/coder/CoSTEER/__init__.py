@@ -10,6 +10,7 @@ from rdagent.components.coder.CoSTEER.knowledge_management import (
     CoSTEERRAGStrategyV1,
     CoSTEERRAGStrategyV2,
 )
+from rdagent.components.coder.CoSTEER.knowledge_store import CoSTEERKnowledgeBaseStore
 from rdagent.core.developer import Developer
 from rdagent.core.evaluation import Evaluator
 from rdagent.core.evolving_agent import EvolvingStrategy
@@ -49,6 +50,7 @@ class CoSTEER(Developer[Experiment]):
         self.evolving_version = evolving_version
 
         # init knowledge base
+        self.knowledge_base_store: CoSTEERKnowledgeBaseStore | None = None
         self.knowledge_base = self.load_or_init_knowledge_base(
             former_knowledge_base_path=self.knowledge_base_path,
             component_init_list=[],
@@ -62,7 +64,11 @@ class CoSTEER(Developer[Experiment]):
 
     def load_or_init_knowledge_base(self, former_knowledge_base_path: Path = None, component_init_list: list = []):
         if former_knowledge_base_path is not None and former_knowledge_base_path.exists():
-            knowledge_base = pickle.load(open(former_knowledge_base_path, "rb"))
+            if CoSTEERKnowledgeBaseStore.is_store_path(former_knowledge_base_path):
+                self.knowledge_base_store = CoSTEERKnowledgeBaseStore(former_knowledge_base_path)
+                knowledge_base = self.knowledge_base_store.load()
+            else:
+                knowledge_base = pickle.load(open(former_knowledge_base_path, "rb"))
             if self.evolving_version == 1 and not isinstance(knowledge_base, CoSTEERKnowledgeBaseV1):
                 raise ValueError("The former knowledge base is not compatible with the current version")
             elif self.evolving_version == 2 and not isinstance(
@@ -102,7 +108,15 @@ class CoSTEER(Developer[Experiment]):
 
         # save new knowledge base
         if self.new_knowledge_base_path is not None:
-            pickle.dump(self.knowledge_base, open(self.new_knowledge_base_path, "wb"))
+            if isinstance(self.knowledge_base, CoSTEERKnowledgeBaseV2) and CoSTEERKnowledgeBaseStore.is_store_path(
+                self.new_knowledge_base_path
+            ):
+                # only the changes are appended if the knowledge base was loaded from the same store
+                if self.knowledge_base_store is None or self.knowledge_base_store.path != self.new_knowledge_base_path:
+                    self.knowledge_base_store = CoSTEERKnowledgeBaseStore(self.new_knowledge_base_path)
+                self.knowledge_base_store.save(self.knowledge_base)
+            else:
+                pickle.dump(self.knowledge_base, open(self.new_knowledge_base_path, "wb"))
             logger.info(f"New knowledge base saved to {self.new_knowledge_base_path}")
         exp.sub_workspace_list = experiment.sub_workspace_list
         return exp
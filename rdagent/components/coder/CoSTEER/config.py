@@ -31,7 +31,12 @@ class CoSTEERSettings(ExtendedBaseSettings):
     """Path to the knowledge base"""
 
     new_knowledge_base_path: Union[str, None] = None
-    """Path to the new knowledge base"""
+    """
+    Path to the new knowledge base.
+    A directory (or a path without suffix) is an append-only `CoSTEERKnowledgeBaseStore` of the version 2 knowledge
+    base: only the changes are written after each `develop`, and the implementations are loaded on access.
+    The other paths are pickle files of the whole knowledge base.
+    """
 
     select_threshold: int = 10
 
@@ -8,6 +8,7 @@ from itertools import combinations
 from pathlib import Path
 from typing import Union
 
+import numpy as np
 from jinja2 import Environment, StrictUndefined
 
 from rdagent.components.coder.CoSTEER.config import CoSTEERSettings
@@ -16,6 +17,7 @@ from rdagent.components.knowledge_management.graph import (
     UndirectedGraph,
     UndirectedNode,
 )
+from rdagent.components.knowledge_management.vector_base import VectorIndex
 from rdagent.core.evolving_agent import Feedback
 from rdagent.core.evolving_framework import (
     EvolvableSubjects,
@@ -238,6 +240,7 @@ class CoSTEERRAGStrategyV2(RAGStrategy):
                 evo_step = evolving_trace[trace_index]
                 implementations = evo_step.evolvable_subjects
                 feedback = evo_step.feedback
+                success_task_info_list = []
                 for task_index in range(len(implementations.sub_tasks)):
                     target_task = implementations.sub_tasks[task_index]
                     target_task_information = target_task.get_task_information()
@@ -262,10 +265,8 @@ class CoSTEERRAGStrategyV2(RAGStrategy):
                                 target_task_information,
                                 single_knowledge,
                             )
-                            # Do summary for the last step and update the knowledge graph
-                            self.knowledgebase.update_success_task(
-                                target_task_information,
-                            )
+                            # Do summary for the last step and update the knowledge graph (below, for all the tasks)
+                            success_task_info_list.append(target_task_information)
                         else:
                             # generate error node and store into knowledge base
                             error_analysis_result = []
@@ -285,6 +286,7 @@ class CoSTEERRAGStrategyV2(RAGStrategy):
                             ).append(
                                 error_analysis_result,
                             )  # save to working trace error record, for graph update
+                self.knowledgebase.update_success_tasks(success_task_info_list)
 
             self.current_generated_trace_count = len(evolving_trace)
             return None
@@ -461,6 +463,18 @@ class CoSTEERRAGStrategyV2(RAGStrategy):
         v2_query_component_limit: int = 5,
         knowledge_sampler: float = 1.0,
     ) -> CoSTEERQueriedKnowledge | None:
+        # the similarities to the success tasks of all the target tasks to query, at once
+        query_task_information_list = [
+            target_task.get_task_information()
+            for target_task in evo.sub_tasks
+            if target_task.get_task_information() not in self.knowledgebase.success_task_to_knowledge_dict
+            and target_task.get_task_information() not in queried_knowledge_v2.failed_task_info_set
+        ]
+        knowledge_base_success_task_list, similarity_matrix = self.knowledgebase.calculate_success_task_similarity(
+            query_task_information_list
+        )
+        task_to_similarity = dict(zip(query_task_information_list, similarity_matrix))
+
         for target_task in evo.sub_tasks:
             target_task_information = target_task.get_task_information()
             if (
@@ -525,17 +539,7 @@ class CoSTEERRAGStrategyV2(RAGStrategy):
                             ].append(target_knowledge)
 
                 # finally add embedding related knowledge
-                knowledge_base_success_task_list = list(self.knowledgebase.success_task_to_knowledge_dict)
-
-                similarity = calculate_embedding_distance_between_str_list(
-                    [target_task_information],
-                    knowledge_base_success_task_list,
-                )[0]
-                similar_indexes = sorted(
-                    range(len(similarity)),
-                    key=lambda i: similarity[i],
-                    reverse=True,
-                )
+                similar_indexes = np.argsort(-task_to_similarity[target_task_information], kind="stable")
                 embedding_similar_successful_knowledge = [
                     self.knowledgebase.success_task_to_knowledge_dict[knowledge_base_success_task_list[index]]
                     for index in similar_indexes
@@ -741,6 +745,52 @@ class CoSTEERKnowledgeBaseV2(EvolvingKnowledgeBase):
         # store the task description to component nodes
         self.task_to_component_nodes = {}
 
+        # the normalized embeddings of the keys of `success_task_to_knowledge_dict` (in the same order)
+        self.success_task_embeddings = VectorIndex()
+        self.success_task_embedding_keys: list[str] = []
+
+    def update_success_task_embeddings(self) -> None:
+        """Add the embeddings of the success tasks added since the last update."""
+        if not hasattr(self, "success_task_embedding_keys"):  # the knowledge bases saved before they were added
+            self.success_task_embeddings, self.success_task_embedding_keys = VectorIndex(), []
+        success_tasks = list(self.success_task_to_knowledge_dict)
+        if success_tasks[: len(self.success_task_embedding_keys)] != self.success_task_embedding_keys:
+            self.success_task_embeddings, self.success_task_embedding_keys = VectorIndex(), []
+        new_success_tasks = success_tasks[len(self.success_task_embedding_keys) :]
+        if not new_success_tasks:
+            return
+        # the task description nodes of the success tasks are already embedded
+        embeddings = [
+            None if (node := self.graph.find_node(content=task, label="task_description")) is None else node.embedding
+            for task in new_success_tasks
+        ]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            for i, embedding in zip(
+                missing, APIBackend().create_embedding_array([new_success_tasks[i] for i in missing])
+            ):
+                embeddings[i] = embedding
+        self.success_task_embeddings.add(
+            np.stack([np.asarray(embedding, dtype=np.float32) for embedding in embeddings])
+        )
+        self.success_task_embedding_keys.extend(new_success_tasks)
+
+    def calculate_success_task_similarity(self, task_information_list: list[str]) -> tuple[list[str], np.ndarray]:
+        """
+        The cosine similarities between the tasks and all the success tasks, computed in one matrix product.
+
+        Returns
+        -------
+        the success tasks, and the similarity matrix of shape (len(task_information_list), len(success tasks))
+        """
+        self.update_success_task_embeddings()
+        if not task_information_list or not self.success_task_embedding_keys:
+            return self.success_task_embedding_keys, np.zeros(
+                (len(task_information_list), len(self.success_task_embedding_keys)), dtype=np.float32
+            )
+        queries = VectorIndex(APIBackend().create_embedding_array(task_information_list)).embeddings
+        return self.success_task_embedding_keys, queries @ self.success_task_embeddings.embeddings.T
+
     def get_all_nodes_by_label(self, label: str) -> list[UndirectedNode]:
         return self.graph.get_all_nodes_by_label(label)
 
@@ -748,43 +798,61 @@ class CoSTEERKnowledgeBaseV2(EvolvingKnowledgeBase):
         self,
         success_task_info: str,
     ):  # Transfer the success tasks' working trace to knowledge storage & graph
-        success_task_trace = self.working_trace_knowledge[success_task_info]
-        success_task_error_analysis_record = (
-            self.working_trace_error_analysis[success_task_info]
-            if success_task_info in self.working_trace_error_analysis
-            else []
+        self.update_success_tasks([success_task_info])
+
+    def update_success_tasks(self, success_task_info_list: list[str]) -> None:
+        """
+        `update_success_task` of several tasks; the nodes of all the tasks are embedded and added to the graph at once.
+        """
+        error_analysis_records = {
+            info: self.working_trace_error_analysis.get(info, []) for info in success_task_info_list
+        }
+        # the error nodes of the error contents
+        error_contents = list(
+            dict.fromkeys(
+                error_node
+                for records in error_analysis_records.values()
+                for record in records
+                for error_node in record
+                if isinstance(error_node, str)
+            )
         )
-        task_des_node = UndirectedNode(content=success_task_info, label="task_description")
-        self.graph.add_nodes(
-            node=task_des_node,
-            neighbors=self.task_to_component_nodes[success_task_info],
-        )  # 1st version, we assume that all component nodes are given
-        for index, trace_unit in enumerate(success_task_trace):  # every unit: single_knowledge
-            neighbor_nodes = [task_des_node]
-            if index != len(success_task_trace) - 1:
-                trace_node = UndirectedNode(
-                    content=trace_unit.get_implementation_and_feedback_str(),
-                    label="task_trace",
-                )
-                self.node_to_implementation_knowledge_dict[trace_node.id] = trace_unit
-                for node_index, error_node in enumerate(success_task_error_analysis_record[index]):
-                    if type(error_node).__name__ == "str":
-                        queried_node = self.graph.get_node_by_content(content=error_node)
-                        if queried_node is None:
-                            new_error_node = UndirectedNode(content=error_node, label="error")
-                            self.graph.add_node(node=new_error_node)
-                            success_task_error_analysis_record[index][node_index] = new_error_node
-                        else:
-                            success_task_error_analysis_record[index][node_index] = queried_node
-                neighbor_nodes.extend(success_task_error_analysis_record[index])
-                self.graph.add_nodes(node=trace_node, neighbors=neighbor_nodes)
-            else:
-                success_node = UndirectedNode(
-                    content=trace_unit.get_implementation_and_feedback_str(),
-                    label="task_success_implement",
-                )
-                self.graph.add_nodes(node=success_node, neighbors=neighbor_nodes)
-                self.node_to_implementation_knowledge_dict[success_node.id] = trace_unit
+        error_nodes = {
+            content: UndirectedNode(content=content, label="error") if queried_node is None else queried_node
+            for content, queried_node in zip(error_contents, self.graph.get_nodes_by_contents(error_contents))
+        }
+
+        node_pairs = []
+        for success_task_info in success_task_info_list:
+            success_task_trace = self.working_trace_knowledge[success_task_info]
+            success_task_error_analysis_record = error_analysis_records[success_task_info]
+            task_des_node = UndirectedNode(content=success_task_info, label="task_description")
+            # 1st version, we assume that all component nodes are given
+            component_nodes = self.task_to_component_nodes[success_task_info]
+            node_pairs.extend([(task_des_node, node) for node in component_nodes] or [(task_des_node, None)])
+            for index, trace_unit in enumerate(success_task_trace):  # every unit: single_knowledge
+                neighbor_nodes = [task_des_node]
+                if index != len(success_task_trace) - 1:
+                    trace_node = UndirectedNode(
+                        content=trace_unit.get_implementation_and_feedback_str(),
+                        label="task_trace",
+                    )
+                    self.node_to_implementation_knowledge_dict[trace_node.id] = trace_unit
+                    success_task_error_analysis_record[index] = [
+                        error_nodes[error_node] if isinstance(error_node, str) else error_node
+                        for error_node in success_task_error_analysis_record[index]
+                    ]
+                    neighbor_nodes.extend(success_task_error_analysis_record[index])
+                    node_pairs.extend((trace_node, neighbor_node) for neighbor_node in neighbor_nodes)
+                else:
+                    success_node = UndirectedNode(
+                        content=trace_unit.get_implementation_and_feedback_str(),
+                        label="task_success_implement",
+                    )
+                    node_pairs.extend((success_node, neighbor_node) for neighbor_node in neighbor_nodes)
+                    self.node_to_implementation_knowledge_dict[success_node.id] = trace_unit
+        self.graph.add_nodes_with_edges(node_pairs)
+        self.update_success_task_embeddings()
 
     def query(self):
         pass
@@ -0,0 +1,312 @@
+"""
+An append-only store of `CoSTEERKnowledgeBaseV2`.
+
+Pickling the whole knowledge base after each `CoSTEER.develop` rewrites every implementation and embedding it ever
+collected. The store only appends what changed since it was loaded or last saved. It is a directory of:
+
+- `log.pkl`: the pickled records of the changes, in order: the nodes and the edges of the graph, and the changes
+  of the dicts of the knowledge base (see `KNOWLEDGE_DICTS`);
+- `embeddings.f32`: the float32 embeddings of the nodes, one row per node, memory-mapped when loading;
+- `knowledge.pkl`: the pickled `CoSTEERKnowledge` (implementation code and feedback), only unpickled on access.
+
+The records are appended after the data they refer to, so a partially written record (e.g. the process is killed
+while saving) is dropped when loading. The `CoSTEERKnowledge` are considered immutable once saved.
+"""
+
+from __future__ import annotations
+
+import pickle
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Iterator
+
+import numpy as np
+
+from rdagent.components.coder.CoSTEER.knowledge_management import (
+    CoSTEERKnowledge,
+    CoSTEERKnowledgeBaseV2,
+)
+from rdagent.components.knowledge_management.graph import (
+    UndirectedGraph,
+    UndirectedNode,
+)
+from rdagent.log import rdagent_logger as logger
+
+KNOWLEDGE_DICTS = (
+    "working_trace_knowledge",
+    "working_trace_error_analysis",
+    "success_task_to_knowledge_dict",
+    "node_to_implementation_knowledge_dict",
+    "task_to_component_nodes",
+)
+
+
+class _LazyKnowledgeDict(MutableMapping):
+    """A dict whose values are decoded from the store on their first access; the keys are available at once."""
+
+    def __init__(self, store: CoSTEERKnowledgeBaseStore, encoded: dict, decode: Callable[[Any], Any]) -> None:
+        self.store = store
+        self._data = dict(encoded)
+        self._pending = set(encoded)  # the keys whose value is not decoded yet
+        self._decode = decode
+
+    def __getitem__(self, key: Any) -> Any:
+        value = self._data[key]
+        if key in self._pending:
+            value = self._data[key] = self._decode(value)
+            self._pending.discard(key)
+        return value
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        self._data[key] = value
+        self._pending.discard(key)
+
+    def __delitem__(self, key: Any) -> None:
+        del self._data[key]
+        self._pending.discard(key)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._data
+
+    def __iter__(self) -> Iterator:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def decoded_items(self) -> list[tuple[Any, Any]]:
+        """The items accessed so far; the others cannot have been changed."""
+        return [(key, value) for key, value in self._data.items() if key not in self._pending]
+
+    def __reduce__(self) -> tuple:
+        # pickled as a plain dict, e.g. when the whole session is dumped
+        return dict, (dict(self.items()),)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(keys={list(self._data)})"
+
+
+class CoSTEERKnowledgeBaseStore:
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        # whether the state below mirrors the files; if not, the files are rewritten by the next `save`
+        self._synced = False
+        self._reset()
+
+    def _reset(self) -> None:
+        self._nodes: set[str] = set()
+        self._edges: set[tuple[str, str]] = set()
+        self._dim: int | None = None
+        self._n_embeddings = 0
+        self._knowledge_offsets: list[int] = []
+        # blob index -> knowledge and id(knowledge) -> blob index; the former keeps the ids of the latter valid
+        self._knowledge: dict[int, CoSTEERKnowledge] = {}
+        self._knowledge_index: dict[int, int] = {}
+        # the encoded values of the dicts of the knowledge base, as saved
+        self._dicts: dict[str, dict] = {name: {} for name in KNOWLEDGE_DICTS}
+
+    @staticmethod
+    def is_store_path(path: str | Path) -> bool:
+        """An existing directory, or a path without suffix to create; the other paths are pickle files."""
+        path = Path(path)
+        return path.is_dir() or (not path.exists() and path.suffix == "")
+
+    @property
+    def _log_path(self) -> Path:
+        return self.path / "log.pkl"
+
+    @property
+    def _embedding_path(self) -> Path:
+        return self.path / "embeddings.f32"
+
+    @property
+    def _knowledge_path(self) -> Path:
+        return self.path / "knowledge.pkl"
+
+    def _read_log(self) -> list[tuple]:
+        records: list[tuple] = []
+        if not self._log_path.exists():
+            return records
+        end = 0
+        with self._log_path.open("rb") as f:
+            while True:
+                try:
+                    records.append(pickle.load(f))
+                except EOFError:
+                    break
+                except (pickle.UnpicklingError, ValueError):
+                    break
+                end = f.tell()
+        if end < self._log_path.stat().st_size:
+            logger.warning(f"Dropping the partially written record at the end of {self._log_path}")
+            with self._log_path.open("r+b") as f:
+                f.truncate(end)
+        return records
+
+    def load(self) -> CoSTEERKnowledgeBaseV2:
+        self._reset()
+        nodes: dict[str, tuple[str, str, int | None]] = {}
+        edges: list[tuple[str, str]] = []
+        for record in self._read_log():
+            kind, *args = record
+            if kind == "node":
+                node_id, content, label, row = args
+                nodes[node_id] = (content, label, row)
+            elif kind == "remove_node":
+                nodes.pop(args[0], None)
+            elif kind == "edge":
+                edges.append(tuple(args))
+            elif kind == "dim":
+                self._dim = args[0]
+            elif kind == "knowledge":
+                self._knowledge_offsets.append(args[0])
+            elif kind == "set":
+                name, key, value = args
+                self._dicts[name][key] = value
+            elif kind == "extend":
+                name, key, values = args
+                self._dicts[name][key] = self._dicts[name][key] + values
+            elif kind == "del":
+                name, key = args
+                self._dicts[name].pop(key, None)
+        self._nodes = set(nodes)
+        self._edges = {edge for edge in edges if edge[0] in nodes and edge[1] in nodes}
+
+        embeddings = None
+        if self._embedding_path.exists():
+            size = self._embedding_path.stat().st_size
+            self._n_embeddings = 0 if self._dim is None else size // (4 * self._dim)
+            if size != self._n_embeddings * 4 * (self._dim or 0):  # a partially written row
+                with self._embedding_path.open("r+b") as f:
+                    f.truncate(self._n_embeddings * 4 * (self._dim or 0))
+            if self._n_embeddings > 0:
+                embeddings = np.memmap(
+                    self._embedding_path, dtype=np.float32, mode="r", shape=(self._n_embeddings, self._dim)
+                )
+
+        graph = UndirectedGraph()
+        vector_records = []
+        for node_id, (content, label, row) in nodes.items():
+            node = UndirectedNode(content=content, label=label, embedding=None if row is None else embeddings[row])
+            node.id = node_id
+            graph._insert_node(node)
+            if row is not None:
+                vector_records.append(
+                    {"id": node_id, "label": label, "content": content, "trunk": content, "embedding": node.embedding}
+                )
+        graph.vector_base.add_records(vector_records)
+        for id1, id2 in self._edges:
+            graph.get_node(id1).add_neighbor(graph.get_node(id2))
+
+        knowledge_base = CoSTEERKnowledgeBaseV2.__new__(CoSTEERKnowledgeBaseV2)
+        knowledge_base.graph = graph
+        for name in KNOWLEDGE_DICTS:
+            setattr(
+                knowledge_base,
+                name,
+                _LazyKnowledgeDict(self, self._dicts[name], lambda value: self._decode(value, graph)),
+            )
+        self._synced = True
+        logger.info(f"Knowledge base loaded from {self.path}, graph size={graph.size()}")
+        return knowledge_base
+
+    def _load_knowledge(self, index: int) -> CoSTEERKnowledge:
+        if index not in self._knowledge:
+            with self._knowledge_path.open("rb") as f:
+                f.seek(self._knowledge_offsets[index])
+                knowledge = pickle.load(f)
+            self._knowledge[index] = knowledge
+            self._knowledge_index[id(knowledge)] = index
+        return self._knowledge[index]
+
+    def _decode(self, value: Any, graph: UndirectedGraph) -> Any:
+        if isinstance(value, list):
+            return [self._decode(v, graph) for v in value]
+        if isinstance(value, tuple) and value[0] == "knowledge":
+            return self._load_knowledge(value[1])
+        if isinstance(value, tuple) and value[0] == "node":
+            return graph.get_node(value[1])
+        return value
+
+    def _encode(self, value: Any, log_file: BinaryIO, knowledge_file: BinaryIO) -> Any:
+        if isinstance(value, list):
+            return [self._encode(v, log_file, knowledge_file) for v in value]
+        if isinstance(value, CoSTEERKnowledge):
+            if id(value) not in self._knowledge_index:
+                offset = knowledge_file.tell()
+                pickle.dump(value, knowledge_file)
+                knowledge_file.flush()
+                pickle.dump(("knowledge", offset), log_file)
+                index = len(self._knowledge_offsets)
+                self._knowledge_offsets.append(offset)
+                self._knowledge[index] = value
+                self._knowledge_index[id(value)] = index
+            return ("knowledge", self._knowledge_index[id(value)])
+        if isinstance(value, UndirectedNode):
+            return ("node", value.id)
+        return value
+
+    def save(self, knowledge_base: CoSTEERKnowledgeBaseV2) -> None:
+        """Append the changes of the knowledge base since it was loaded from (or last saved to) the store."""
+        if not self._synced:
+            # a store only appends to the knowledge base it holds
+            for path in (self._log_path, self._embedding_path, self._knowledge_path):
+                path.unlink(missing_ok=True)
+            self._reset()
+            self._synced = True
+        self.path.mkdir(parents=True, exist_ok=True)
+        graph = knowledge_base.graph
+        with (
+            self._log_path.open("ab") as log_file,
+            self._embedding_path.open("ab") as embedding_file,
+            self._knowledge_path.open("ab") as knowledge_file,
+        ):
+            new_nodes = [node for node in graph.nodes.values() if node.id not in self._nodes]
+            for node in new_nodes:
+                row = None
+                if node.embedding is not None:
+                    embedding = np.asarray(node.embedding, dtype=np.float32)
+                    if self._dim is None:
+                        self._dim = embedding.shape[0]
+                        pickle.dump(("dim", self._dim), log_file)
+                    if embedding.shape != (self._dim,):
+                        raise ValueError(f"The embedding of node {node.id} is not of dimension {self._dim}")
+                    embedding_file.write(embedding.tobytes())
+                    row, self._n_embeddings = self._n_embeddings, self._n_embeddings + 1
+                embedding_file.flush()
+                pickle.dump(("node", node.id, node.content, node.label, row), log_file)
+                self._nodes.add(node.id)
+            for node_id in self._nodes - graph.nodes.keys():
+                pickle.dump(("remove_node", node_id), log_file)
+                self._nodes.discard(node_id)
+
+            for node in graph.nodes.values():
+                for neighbor in node.neighbors:
+                    edge = (node.id, neighbor.id) if node.id < neighbor.id else (neighbor.id, node.id)
+                    if edge not in self._edges and neighbor.id in graph.nodes:
+                        pickle.dump(("edge", *edge), log_file)
+                        self._edges.add(edge)
+
+            for name in KNOWLEDGE_DICTS:
+                current, saved = getattr(knowledge_base, name), self._dicts[name]
+                if isinstance(current, _LazyKnowledgeDict) and current.store is self:
+                    items = current.decoded_items()
+                else:
+                    items = list(current.items())
+                for key, value in items:
+                    value = self._encode(value, log_file, knowledge_file)
+                    if key in saved and saved[key] == value:
+                        continue
+                    if (
+                        isinstance(value, list)
+                        and isinstance(saved.get(key), list)
+                        and value[: len(saved[key])] == saved[key]
+                    ):
+                        pickle.dump(("extend", name, key, value[len(saved[key]) :]), log_file)
+                    else:
+                        pickle.dump(("set", name, key, value), log_file)
+                    saved[key] = value
+                for key in saved.keys() - current.keys():
+                    pickle.dump(("del", name, key), log_file)
+                    del saved[key]
+        logger.info(f"Knowledge base saved to {self.path}")
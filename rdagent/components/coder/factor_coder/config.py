@@ -11,6 +11,12 @@ class FactorCoSTEERSettings(CoSTEERSettings):
     data_folder_debug: str = "git_ignore_folder/factor_implementation_source_data_debug"
     """Path to the folder containing partial financial data (for debugging)"""
 
+    data_format: str = "h5"
+    """
+    Format of the data in the data folders: "h5" (e.g. `daily_pv.h5`, read with `pd.read_hdf`) or "columnar" (e.g.
+    the `daily_pv` store of `rdagent.utils.frame_store`, memory-mapped and read with `read_frame`)
+    """
+
     simple_background: bool = False
     """Whether to use simple background information for code feedback"""
 
@@ -23,5 +29,17 @@ class FactorCoSTEERSettings(CoSTEERSettings):
     python_bin: str = "python"
     """Path to the Python binary"""
 
+    execution_mode: str = "subprocess"
+    """
+    How the factor implementations are executed: "subprocess" runs `python_bin` on the script for each execution,
+    "worker_pool" runs them in long-lived workers of the current interpreter (see `factor_worker_pool.py`)
+    """
+
+    worker_pool_size: int = 4
+    """Number of workers of the "worker_pool" execution mode"""
+
+    worker_memory_limit: int | None = None
+    """Limit of the address space of each worker in bytes (None for no limit)"""
+
 
 FACTOR_COSTEER_SETTINGS = FactorCoSTEERSettings()
@@ -1,6 +1,7 @@
 import io
 import json
 from abc import abstractmethod
+from functools import cached_property
 from pathlib import Path
 from typing import Tuple
 
@@ -11,12 +12,57 @@ from rdagent.components.coder.factor_coder.config import FACTOR_COSTEER_SETTINGS
 from rdagent.components.coder.factor_coder.factor import FactorTask
 from rdagent.core.experiment import Task, Workspace
 from rdagent.core.prompts import Prompts
-from rdagent.oai.llm_conf import LLM_SETTINGS
 from rdagent.oai.llm_utils import APIBackend
+from rdagent.utils.cross_section import corr_by_group
 
 evaluate_prompts = Prompts(file_path=Path(__file__).parent / "prompts.yaml")
 
 
+class FactorEvaluationContext:
+    """
+    The factor values of an implementation and of its ground truth, shared by the evaluators of a single evaluation
+    (see `FactorValueEvaluator`).
+
+    Each value is executed, converted to a dataframe and sorted only once, when it is first used; so are the values
+    derived from both of them (e.g. the aligned values).
+    """
+
+    def __init__(self, implementation: Workspace, gt_implementation: Workspace | None = None) -> None:
+        self.implementation = implementation
+        self.gt_implementation = gt_implementation
+
+    @staticmethod
+    def _load_df(implementation: Workspace | None, series_name: str) -> pd.DataFrame | None:
+        if implementation is None:
+            return None
+        _, df = implementation.execute()
+        if isinstance(df, pd.Series):
+            df = df.to_frame(series_name)
+        if isinstance(df, pd.DataFrame) and not df.index.is_monotonic_increasing:
+            df = df.sort_index()  # sorting a sorted frame would still copy it
+        return df
+
+    @cached_property
+    def gen_df(self) -> pd.DataFrame | None:
+        return self._load_df(self.implementation, "source_factor")
+
+    @cached_property
+    def gt_df(self) -> pd.DataFrame | None:
+        return self._load_df(self.gt_implementation, "gt_factor")
+
+    @cached_property
+    def aligned_dfs(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """The generated and the ground truth values aligned on the union of their indexes."""
+        return self.gen_df.align(self.gt_df, join="outer", axis=0)
+
+    @cached_property
+    def index_similarity(self) -> float:
+        """The number of shared indices divided by the number of the union indices."""
+        gen_index, gt_index = self.gen_df.index.unique(), self.gt_df.index.unique()
+        shared_count = len(gen_index.intersection(gt_index))
+        return shared_count / (len(gen_index) + len(gt_index) - shared_count)
+
+
 class FactorEvaluator:
     """Although the init method is same to Evaluator, but we want to emphasize they are different"""
 
@@ -47,22 +93,18 @@ class FactorEvaluator:
         """
         raise NotImplementedError("Please implement the `evaluator` method")
 
-    def _get_df(self, gt_implementation: Workspace, implementation: Workspace):
-        if gt_implementation is not None:
-            _, gt_df = gt_implementation.execute()
-            if isinstance(gt_df, pd.Series):
-                gt_df = gt_df.to_frame("gt_factor")
-            if isinstance(gt_df, pd.DataFrame):
-                gt_df = gt_df.sort_index()
-        else:
-            gt_df = None
+    @staticmethod
+    def _get_context(
+        gt_implementation: Workspace, implementation: Workspace, context: FactorEvaluationContext | None = None
+    ) -> FactorEvaluationContext:
+        """The context shared with the other evaluators if any, otherwise a context of this evaluation only."""
+        return context if context is not None else FactorEvaluationContext(implementation, gt_implementation)
 
-        _, gen_df = implementation.execute()
-        if isinstance(gen_df, pd.Series):
-            gen_df = gen_df.to_frame("source_factor")
-        if isinstance(gen_df, pd.DataFrame):
-            gen_df = gen_df.sort_index()
-        return gt_df, gen_df
+    def _get_df(
+        self, gt_implementation: Workspace, implementation: Workspace, context: FactorEvaluationContext | None = None
+    ):
+        context = self._get_context(gt_implementation, implementation, context)
+        return context.gt_df, context.gen_df
 
     def __str__(self) -> str:
         return self.__class__.__name__
@@ -97,31 +139,20 @@ class FactorCodeEvaluator(FactorEvaluator):
             )
         )
 
-        execution_feedback_to_render = execution_feedback
-        for _ in range(10):  # 10 times to split the content is enough
-            user_prompt = (
-                Environment(undefined=StrictUndefined)
-                .from_string(
-                    evaluate_prompts["evaluator_code_feedback_v1_user"],
-                )
-                .render(
-                    factor_information=factor_information,
-                    code=code,
-                    execution_feedback=execution_feedback_to_render,
-                    value_feedback=value_feedback,
-                    gt_code=gt_implementation.code if gt_implementation else None,
-                )
-            )
-            if (
-                APIBackend().build_messages_and_calculate_token(
-                    user_prompt=user_prompt,
-                    system_prompt=system_prompt,
-                )
-                > LLM_SETTINGS.chat_token_limit
-            ):
-                execution_feedback_to_render = execution_feedback_to_render[len(execution_feedback_to_render) // 2 :]
-            else:
-                break
+        user_prompt_template = Environment(undefined=StrictUndefined).from_string(
+            evaluate_prompts["evaluator_code_feedback_v1_user"],
+        )
+        _, user_prompt = APIBackend().build_messages_and_truncate_to_token_limit(
+            content=execution_feedback,
+            build_user_prompt=lambda execution_feedback_to_render: user_prompt_template.render(
+                factor_information=factor_information,
+                code=code,
+                execution_feedback=execution_feedback_to_render,
+                value_feedback=value_feedback,
+                gt_code=gt_implementation.code if gt_implementation else None,
+            ),
+            system_prompt=system_prompt,
+        )
         critic_response = APIBackend().build_messages_and_create_chat_completion(
             user_prompt=user_prompt,
             system_prompt=system_prompt,
@@ -136,8 +167,9 @@ class FactorInfEvaluator(FactorEvaluator):
         self,
         implementation: Workspace,
         gt_implementation: Workspace,
+        context: FactorEvaluationContext | None = None,
     ) -> Tuple[str, object]:
-        _, gen_df = self._get_df(gt_implementation, implementation)
+        _, gen_df = self._get_df(gt_implementation, implementation, context)
         if gen_df is None:
             return (
                 "The source dataframe is None. Please check the implementation.",
@@ -158,8 +190,9 @@ class FactorSingleColumnEvaluator(FactorEvaluator):
         self,
         implementation: Workspace,
         gt_implementation: Workspace,
+        context: FactorEvaluationContext | None = None,
     ) -> Tuple[str, object]:
-        _, gen_df = self._get_df(gt_implementation, implementation)
+        _, gen_df = self._get_df(gt_implementation, implementation, context)
         if gen_df is None:
             return (
                 "The source dataframe is None. Please check the implementation.",
@@ -179,8 +212,9 @@ class FactorOutputFormatEvaluator(FactorEvaluator):
         self,
         implementation: Workspace,
         gt_implementation: Workspace,
+        context: FactorEvaluationContext | None = None,
     ) -> Tuple[str, object]:
-        gt_df, gen_df = self._get_df(gt_implementation, implementation)
+        gt_df, gen_df = self._get_df(gt_implementation, implementation, context)
         if gen_df is None:
             return (
                 "The source dataframe is None. Skip the evaluation of the output format.",
@@ -236,8 +270,9 @@ class FactorDatetimeDailyEvaluator(FactorEvaluator):
         self,
         implementation: Workspace,
         gt_implementation: Workspace,
+        context: FactorEvaluationContext | None = None,
     ) -> Tuple[str | object]:
-        _, gen_df = self._get_df(gt_implementation, implementation)
+        _, gen_df = self._get_df(gt_implementation, implementation, context)
         if gen_df is None:
             return "The source dataframe is None. Skip the evaluation of the datetime format.", False
 
@@ -245,14 +280,14 @@ class FactorDatetimeDailyEvaluator(FactorEvaluator):
             return "The source dataframe does not have a datetime index. Please check the implementation.", False
 
         try:
-            pd.to_datetime(gen_df.index.get_level_values("datetime"))
+            datetime_index = pd.to_datetime(gen_df.index.get_level_values("datetime"))
         except Exception:
             return (
                 f"The source dataframe has a datetime index but it is not in the correct format (maybe a regular string or other objects). Please check the implementation.\n The head of the output dataframe is: \n{gen_df.head()}",
                 False,
             )
 
-        time_diff = pd.to_datetime(gen_df.index.get_level_values("datetime")).to_series().diff().dropna().unique()
+        time_diff = datetime_index.to_series().diff().dropna().unique()
         if pd.Timedelta(minutes=1) in time_diff:
             return (
                 "The generated dataframe is not daily. The implementation is definitely wrong. Please check the implementation.",
@@ -266,8 +301,9 @@ class FactorRowCountEvaluator(FactorEvaluator):
         self,
         implementation: Workspace,
         gt_implementation: Workspace,
+        context: FactorEvaluationContext | None = None,
     ) -> Tuple[str, object]:
-        gt_df, gen_df = self._get_df(gt_implementation, implementation)
+        gt_df, gen_df = self._get_df(gt_implementation, implementation, context)
         if gen_df is None:
             return (
                 "The source dataframe is None. Please check the implementation.",
@@ -290,15 +326,15 @@ class FactorIndexEvaluator(FactorEvaluator):
         self,
         implementation: Workspace,
         gt_implementation: Workspace,
+        context: FactorEvaluationContext | None = None,
     ) -> Tuple[str, object]:
-        gt_df, gen_df = self._get_df(gt_implementation, implementation)
-        if gen_df is None:
+        context = self._get_context(gt_implementation, implementation, context)
+        if context.gen_df is None:
             return (
                 "The source dataframe is None. Please check the implementation.",
                 False,
             )
-        gen_index_set, gt_index_set = set(gen_df.index), set(gt_df.index)
-        similarity = len(gen_index_set.intersection(gt_index_set)) / len(gen_index_set.union(gt_index_set))
+        similarity = context.index_similarity
         return (
             (
                 f"The source dataframe and the ground truth dataframe have different index with a similarity of {similarity:.2%}. The similarity is calculated by the number of shared indices divided by the union indices. "
@@ -315,18 +351,20 @@ class FactorMissingValuesEvaluator(FactorEvaluator):
         self,
         implementation: Workspace,
         gt_implementation: Workspace,
+        context: FactorEvaluationContext | None = None,
     ) -> Tuple[str, object]:
-        gt_df, gen_df = self._get_df(gt_implementation, implementation)
+        gt_df, gen_df = self._get_df(gt_implementation, implementation, context)
         if gen_df is None:
             return (
                 "The source dataframe is None. Please check the implementation.",
                 False,
             )
-        if gen_df.isna().sum().sum() == gt_df.isna().sum().sum():
+        gen_na_count, gt_na_count = gen_df.isna().sum().sum(), gt_df.isna().sum().sum()
+        if gen_na_count == gt_na_count:
             return "Both dataframes have the same missing values.", True
         else:
             return (
-                f"The dataframes do not have the same missing values. The source dataframe has {gen_df.isna().sum().sum()} missing values, while the ground truth dataframe has {gt_df.isna().sum().sum()} missing values. Please check the implementation.",
+                f"The dataframes do not have the same missing values. The source dataframe has {gen_na_count} missing values, while the ground truth dataframe has {gt_na_count} missing values. Please check the implementation.",
                 False,
             )
 
@@ -336,15 +374,18 @@ class FactorEqualValueRatioEvaluator(FactorEvaluator):
         self,
         implementation: Workspace,
         gt_implementation: Workspace,
+        context: FactorEvaluationContext | None = None,
     ) -> Tuple[str, object]:
-        gt_df, gen_df = self._get_df(gt_implementation, implementation)
+        context = self._get_context(gt_implementation, implementation, context)
+        gen_df = context.gen_df
         if gen_df is None:
             return (
                 "The source dataframe is None. Please check the implementation.",
                 -1,
             )
         try:
-            close_values = gen_df.sub(gt_df).abs().lt(1e-6)
+            aligned_gen_df, aligned_gt_df = context.aligned_dfs
+            close_values = aligned_gen_df.sub(aligned_gt_df).abs().lt(1e-6)
             result_int = close_values.astype(int)
             pos_num = result_int.sum().sum()
             acc_rate = pos_num / close_values.size
@@ -371,22 +412,18 @@ class FactorCorrelationEvaluator(FactorEvaluator):
         self,
         implementation: Workspace,
         gt_implementation: Workspace,
+        context: FactorEvaluationContext | None = None,
     ) -> Tuple[str, object]:
-        gt_df, gen_df = self._get_df(gt_implementation, implementation)
-        if gen_df is None:
+        context = self._get_context(gt_implementation, implementation, context)
+        if context.gen_df is None:
             return (
                 "The source dataframe is None. Please check the implementation.",
                 False,
             )
-        concat_df = pd.concat([gen_df, gt_df], axis=1)
-        concat_df.columns = ["source", "gt"]
-        ic = concat_df.groupby("datetime").apply(lambda df: df["source"].corr(df["gt"])).dropna().mean()
-        ric = (
-            concat_df.groupby("datetime")
-            .apply(lambda df: df["source"].corr(df["gt"], method="spearman"))
-            .dropna()
-            .mean()
-        )
+        aligned_gen_df, aligned_gt_df = context.aligned_dfs
+        source, gt = aligned_gen_df.iloc[:, 0], aligned_gt_df.iloc[:, 0]
+        ic = corr_by_group(source, gt, "datetime").iloc[:, 0].dropna().mean()
+        ric = corr_by_group(source, gt, "datetime", method="spearman").iloc[:, 0].dropna().mean()
 
         if self.hard_check:
             if ic > 0.99 and ric > 0.99:
@@ -421,27 +458,35 @@ class FactorValueEvaluator(FactorEvaluator):
         high_correlation_result = False
         row_result = None
 
+        # The factor values are loaded, sorted and aligned once for all the evaluators below
+        context = FactorEvaluationContext(implementation, gt_implementation)
+
         # Check if both dataframe has only one columns Mute this since factor task might generate more than one columns now
         if version == 1:
-            feedback_str, _ = FactorSingleColumnEvaluator(self.scen).evaluate(implementation, gt_implementation)
+            feedback_str, _ = FactorSingleColumnEvaluator(self.scen).evaluate(
+                implementation, gt_implementation, context=context
+            )
             conclusions.append(feedback_str)
         elif version == 2:
             input_shape = self.scen.input_shape
-            _, gen_df = self._get_df(gt_implementation, implementation)
-            if gen_df.shape[-1] > input_shape[-1]:
+            if context.gen_df is not None and context.gen_df.shape[-1] > input_shape[-1]:
                 conclusions.append(
                     "Output dataframe has more columns than input feature which is not acceptable in feature processing tasks. Please check the implementation to avoid generating too many columns. Consider this implementation as a failure."
                 )
 
-        feedback_str, inf_evaluate_res = FactorInfEvaluator(self.scen).evaluate(implementation, gt_implementation)
+        feedback_str, inf_evaluate_res = FactorInfEvaluator(self.scen).evaluate(
+            implementation, gt_implementation, context=context
+        )
         conclusions.append(feedback_str)
 
         # Check if the index of the dataframe is ("datetime", "instrument")
-        feedback_str, _ = FactorOutputFormatEvaluator(self.scen).evaluate(implementation, gt_implementation)
+        feedback_str, _ = FactorOutputFormatEvaluator(self.scen).evaluate(
+            implementation, gt_implementation, context=context
+        )
         conclusions.append(feedback_str)
         if version == 1:
             feedback_str, daily_check_result = FactorDatetimeDailyEvaluator(self.scen).evaluate(
-                implementation, gt_implementation
+                implementation, gt_implementation, context=context
             )
             conclusions.append(feedback_str)
         else:
@@ -449,26 +494,30 @@ class FactorValueEvaluator(FactorEvaluator):
 
         # Check dataframe format
         if gt_implementation is not None:
-            feedback_str, row_result = FactorRowCountEvaluator(self.scen).evaluate(implementation, gt_implementation)
+            feedback_str, row_result = FactorRowCountEvaluator(self.scen).evaluate(
+                implementation, gt_implementation, context=context
+            )
             conclusions.append(feedback_str)
 
-            feedback_str, index_result = FactorIndexEvaluator(self.scen).evaluate(implementation, gt_implementation)
+            feedback_str, index_result = FactorIndexEvaluator(self.scen).evaluate(
+                implementation, gt_implementation, context=context
+            )
             conclusions.append(feedback_str)
 
             feedback_str, output_format_result = FactorMissingValuesEvaluator(self.scen).evaluate(
-                implementation, gt_implementation
+                implementation, gt_implementation, context=context
             )
             conclusions.append(feedback_str)
 
             feedback_str, equal_value_ratio_result = FactorEqualValueRatioEvaluator(self.scen).evaluate(
-                implementation, gt_implementation
+                implementation, gt_implementation, context=context
             )
             conclusions.append(feedback_str)
 
             if index_result > 0.99:
                 feedback_str, high_correlation_result = FactorCorrelationEvaluator(
                     hard_check=True, scen=self.scen
-                ).evaluate(implementation, gt_implementation)
+                ).evaluate(implementation, gt_implementation, context=context)
             else:
                 high_correlation_result = False
                 feedback_str = "The source dataframe and the ground truth dataframe have different index. Give up comparing the values and correlation because it's useless"
@@ -512,35 +561,23 @@ class FactorFinalDecisionEvaluator(FactorEvaluator):
                 )
             )
         )
-        execution_feedback_to_render = execution_feedback
-
-        for _ in range(10):  # 10 times to split the content is enough
-            user_prompt = (
-                Environment(undefined=StrictUndefined)
-                .from_string(
-                    evaluate_prompts["evaluator_final_decision_v1_user"],
-                )
-                .render(
-                    factor_information=target_task.get_task_information(),
-                    execution_feedback=execution_feedback_to_render,
-                    code_feedback=code_feedback,
-                    value_feedback=(
-                        value_feedback
-                        if value_feedback is not None
-                        else "No Ground Truth Value provided, so no evaluation on value is performed."
-                    ),
-                )
-            )
-            if (
-                APIBackend().build_messages_and_calculate_token(
-                    user_prompt=user_prompt,
-                    system_prompt=system_prompt,
-                )
-                > LLM_SETTINGS.chat_token_limit
-            ):
-                execution_feedback_to_render = execution_feedback_to_render[len(execution_feedback_to_render) // 2 :]
-            else:
-                break
+        user_prompt_template = Environment(undefined=StrictUndefined).from_string(
+            evaluate_prompts["evaluator_final_decision_v1_user"],
+        )
+        _, user_prompt = APIBackend().build_messages_and_truncate_to_token_limit(
+            content=execution_feedback,
+            build_user_prompt=lambda execution_feedback_to_render: user_prompt_template.render(
+                factor_information=target_task.get_task_information(),
+                execution_feedback=execution_feedback_to_render,
+                code_feedback=code_feedback,
+                value_feedback=(
+                    value_feedback
+                    if value_feedback is not None
+                    else "No Ground Truth Value provided, so no evaluation on value is performed."
+                ),
+            ),
+            system_prompt=system_prompt,
+        )
 
         # TODO:  with retry_context(retry_n=3, except_list=[KeyError]):
         final_evaluation_dict = None
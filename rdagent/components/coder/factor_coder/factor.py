@@ -1,6 +1,8 @@
 from __future__ import annotations
 
+import multiprocessing as mp
 import subprocess
+import threading
 import uuid
 from pathlib import Path
 from typing import Tuple, Union
@@ -11,10 +13,18 @@ from filelock import FileLock
 from rdagent.app.kaggle.conf import KAGGLE_IMPLEMENT_SETTING
 from rdagent.components.coder.CoSTEER.task import CoSTEERTask
 from rdagent.components.coder.factor_coder.config import FACTOR_COSTEER_SETTINGS
+from rdagent.components.coder.factor_coder.factor_worker_pool import (
+    get_factor_worker_pool,
+)
+from rdagent.core.conf import RD_AGENT_SETTINGS
 from rdagent.core.exception import CodeFormatError, CustomRuntimeError, NoOutputError
 from rdagent.core.experiment import Experiment, FBWorkspace
 from rdagent.core.utils import cache_with_pickle
 from rdagent.oai.llm_utils import md5_hash
+from rdagent.utils.frame_store import dump_frame, is_frame_store, load_frame
+
+# PyTables is not thread-safe, and the factors may be executed from several threads (e.g. in the "worker_pool" mode)
+_HDF_LOCK = threading.Lock()
 
 
 class FactorTask(CoSTEERTask):
@@ -93,8 +103,49 @@ class FactorFBWorkspace(FBWorkspace):
             else None
         )
 
-    @cache_with_pickle(hash_func)
+    def value_store_path(self, data_type: str = "Debug") -> Path:
+        """
+        The store of the factor value (see `rdagent.utils.frame_store`).
+        It lives aside the pickle cache when the execution is cached, and in the workspace otherwise.
+        """
+        hash_key = self.hash_func(data_type)
+        if RD_AGENT_SETTINGS.cache_with_pickle and hash_key is not None:
+            return Path(RD_AGENT_SETTINGS.pickle_cache_folder_path_str) / "factor_values" / f"{data_type}_{hash_key}"
+        return self.workspace_path / f"result_{data_type}"
+
     def execute(self, data_type: str = "Debug") -> Tuple[str, pd.DataFrame]:
+        """
+        Execute the implementation and get the factor value (see `_execute`).
+
+        The factor value is loaded from its store: the values are memory-mapped copy-on-write by every call (e.g. by
+        each evaluator), instead of being unpickled into a new copy each time.
+        """
+        execution_feedback, value_path = self.execute_to_store(data_type)
+        return execution_feedback, None if value_path is None else load_frame(value_path)
+
+    def execute_to_store(self, data_type: str = "Debug") -> Tuple[str, Path | None]:
+        """
+        Execute the implementation like `execute`, but return the path of the factor value store instead of the
+        value, e.g. so that a worker process passes the value to its parent by path rather than by pickling it.
+        """
+        execution_feedback, value_path = self._execute(data_type)
+        # the stores in the pickle cache are recorded relative to it, so the cache can be moved
+        return execution_feedback, None if value_path is None else self._cache_folder() / value_path
+
+    @staticmethod
+    def _cache_folder() -> Path:
+        return Path(RD_AGENT_SETTINGS.pickle_cache_folder_path_str)
+
+    def _cached_value_exists(self, data_type: str = "Debug", *, cached_res: Tuple[str, Path | None]) -> bool:
+        # the cached execution is stale if its store was removed (e.g. with the `factor_values` folder), or if it was
+        # cached with the value itself before the stores
+        value_path = cached_res[1]
+        if value_path is None:
+            return True
+        return isinstance(value_path, Path) and is_frame_store(self._cache_folder() / value_path)
+
+    @cache_with_pickle(hash_func, validate_func=_cached_value_exists)
+    def _execute(self, data_type: str = "Debug") -> Tuple[str, Path | None]:
         """
         execute the implementation and get the factor value by the following steps:
         1. make the directory in workspace path
@@ -104,13 +155,15 @@ class FactorFBWorkspace(FBWorkspace):
             4. execute the code
         else:
             4. generate a script from template to import the factor.py dump get the factor value to result.h5
-        5. read the factor value from the output file in the workspace path folder
-        returns the execution feedback as a string and the factor value as a pandas dataframe
+        5. read the factor value from the output file in the workspace path folder and dump it to its store
+        returns the execution feedback as a string and the path of the factor value store (None if no factor value)
 
 
         Regarding the cache mechanism:
         1. We will store the function's return value to ensure it behaves as expected.
-        - The cached information will include a tuple with the following: (execution_feedback, executed_factor_value_dataframe, Optional[Exception])
+        - The cached information will include a tuple with the following: (execution_feedback, factor_value_store_path)
+          where the path is relative to the pickle cache folder when the store lives there.
+        - The factor value itself is only stored once, in its store; the cached result is dropped if the store is gone.
 
         """
         super().execute()
@@ -150,13 +203,23 @@ class FactorFBWorkspace(FBWorkspace):
                 execution_code_path.write_text((Path(__file__).parent / "factor_execution_template.txt").read_text())
 
             try:
-                subprocess.check_output(
-                    f"{FACTOR_COSTEER_SETTINGS.python_bin} {execution_code_path}",
-                    shell=True,
-                    cwd=self.workspace_path,
-                    stderr=subprocess.STDOUT,
-                    timeout=FACTOR_COSTEER_SETTINGS.file_based_execution_timeout,
-                )
+                # the daemonic workers of a multiprocessing pool can't start the worker pool, they run a subprocess
+                if FACTOR_COSTEER_SETTINGS.execution_mode == "worker_pool" and not mp.current_process().daemon:
+                    success, output = get_factor_worker_pool().run(
+                        execution_code_path,
+                        self.workspace_path,
+                        timeout=FACTOR_COSTEER_SETTINGS.file_based_execution_timeout,
+                    )
+                    if not success:
+                        raise subprocess.CalledProcessError(1, str(execution_code_path), output=output.encode())
+                else:
+                    subprocess.check_output(
+                        f"{FACTOR_COSTEER_SETTINGS.python_bin} {execution_code_path}",
+                        shell=True,
+                        cwd=self.workspace_path,
+                        stderr=subprocess.STDOUT,
+                        timeout=FACTOR_COSTEER_SETTINGS.file_based_execution_timeout,
+                    )
                 execution_success = True
             except subprocess.CalledProcessError as e:
                 import site
@@ -184,7 +247,8 @@ class FactorFBWorkspace(FBWorkspace):
             workspace_output_file_path = self.workspace_path / "result.h5"
             if workspace_output_file_path.exists() and execution_success:
                 try:
-                    executed_factor_value_dataframe = pd.read_hdf(workspace_output_file_path)
+                    with _HDF_LOCK:
+                        executed_factor_value_dataframe = pd.read_hdf(workspace_output_file_path)
                     execution_feedback += self.FB_OUTPUT_FILE_FOUND
                 except Exception as e:
                     execution_feedback += f"Error found when reading hdf file: {e}"[:1000]
@@ -197,7 +261,19 @@ class FactorFBWorkspace(FBWorkspace):
                 else:
                     execution_error = NoOutputError(execution_feedback)
 
-        return execution_feedback, executed_factor_value_dataframe
+            value_path = None
+            if executed_factor_value_dataframe is not None:
+                # sorted once here rather than by each evaluator; the loaded values are then shared as is
+                try:
+                    executed_factor_value_dataframe = executed_factor_value_dataframe.sort_index()
+                except TypeError:  # e.g. an index mixing types, which the evaluators report
+                    pass
+                value_path = self.value_store_path(data_type)
+                dump_frame(executed_factor_value_dataframe, value_path)
+                if value_path.is_relative_to(self._cache_folder()):
+                    value_path = value_path.relative_to(self._cache_folder())
+
+        return execution_feedback, value_path
 
     def __str__(self) -> str:
         # NOTE:
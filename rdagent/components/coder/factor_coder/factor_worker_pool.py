@@ -0,0 +1,205 @@
+"""
+A pool of long-lived worker processes executing the factor implementations (e.g. `factor.py`) in-process.
+
+Executing `python factor.py` in a new interpreter pays for starting Python, importing pandas and parsing the
+source data (e.g. `daily_pv.h5`) on each execution. A worker imports them once, then runs each script in a fresh
+namespace, from its workspace (like `python factor.py` does), and keeps the source data loaded:
+
+- the `pd.read_hdf` of a whole file (e.g. `pd.read_hdf("daily_pv.h5", key="data")`) is served from a frame store
+  (see `rdagent.utils.frame_store`) converted once from the file. The store is memory-mapped, so all the workers
+  share the data through the page cache; each read returns a copy, which the script is free to modify.
+- a script running longer than the timeout is stopped by killing its worker, which is replaced.
+- the address space of the workers can be limited, so a script using too much memory fails with a `MemoryError`
+  (the limit covers the memory a worker inherits from the process starting it).
+
+The scripts still write the factor value to `result.h5`, which `FactorFBWorkspace` reads as before.
+"""
+
+from __future__ import annotations
+
+import atexit
+import builtins
+import contextlib
+import functools
+import hashlib
+import importlib
+import io
+import multiprocessing as mp
+import os
+import queue
+import subprocess
+import sys
+import threading
+import traceback
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import Tuple
+
+import pandas as pd
+from filelock import FileLock
+
+from rdagent.components.coder.factor_coder.config import FACTOR_COSTEER_SETTINGS
+from rdagent.core.conf import RD_AGENT_SETTINGS
+from rdagent.utils.frame_store import dump_frame, is_frame_store, load_frame
+
+
+def _patch_read_hdf(cache_folder: Path) -> None:
+    """Serve the `pd.read_hdf` of whole files from their frame stores in `cache_folder`."""
+    read_hdf = pd.read_hdf
+
+    @functools.wraps(read_hdf)
+    def cached_read_hdf(path_or_buf, key=None, *args, **kwargs):
+        # only the reads of a whole file are cached; the others (e.g. with a `where` query) are not changed
+        if args or kwargs or not isinstance(path_or_buf, (str, os.PathLike)) or not Path(path_or_buf).is_file():
+            return read_hdf(path_or_buf, key, *args, **kwargs)
+        path = Path(path_or_buf).resolve()
+        stat = path.stat()
+        store_name = hashlib.md5(f"{path}:{stat.st_mtime_ns}:{stat.st_size}:{key}".encode()).hexdigest()
+        store_path = cache_folder / store_name
+        if not is_frame_store(store_path):
+            cache_folder.mkdir(parents=True, exist_ok=True)
+            with FileLock(cache_folder / f"{store_name}.lock"):  # converted by one worker only
+                if not is_frame_store(store_path):
+                    dump_frame(read_hdf(path, key), store_path)
+        return load_frame(store_path).copy()
+
+    pd.read_hdf = cached_read_hdf
+
+
+def _run_script(code_path: str, cwd: str) -> Tuple[bool, str]:
+    """
+    Run the script like `python <code_path>` from `cwd`, in a fresh namespace of the current interpreter.
+
+    The modules the script imports from its workspace (e.g. `factor` in the template of the version 2 tasks) are
+    removed after the run, so a script never gets the modules of another workspace run before by the same worker;
+    the other modules (e.g. the libraries) stay imported.
+
+    Returns whether it succeeded, and its output (stdout and stderr), followed by the traceback of its error if any.
+    """
+    output = io.StringIO()
+    success = True
+    previous_cwd, previous_sys_path, previous_argv = os.getcwd(), list(sys.path), sys.argv
+    previous_modules = set(sys.modules)
+    try:
+        os.chdir(cwd)
+        sys.path.insert(0, cwd)
+        sys.argv = [code_path]
+        namespace = {"__name__": "__main__", "__file__": code_path, "__builtins__": builtins}
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            try:
+                exec(compile(Path(code_path).read_text(), code_path, "exec"), namespace)
+            except SystemExit as e:
+                success = e.code is None or e.code == 0
+                if isinstance(e.code, str):
+                    output.write(e.code)
+            except Exception as e:
+                success = False
+                # without the frame of this function, like the traceback printed by `python <code_path>`
+                output.write("".join(traceback.format_exception(type(e), e, e.__traceback__.tb_next)))
+    finally:
+        os.chdir(previous_cwd)
+        sys.path[:], sys.argv = previous_sys_path, previous_argv
+        workspace_path = Path(cwd).resolve()
+        for name in set(sys.modules) - previous_modules:
+            module_file = getattr(sys.modules[name], "__file__", None)
+            if module_file is not None and Path(module_file).resolve().is_relative_to(workspace_path):
+                del sys.modules[name]
+        importlib.invalidate_caches()
+    return success, output.getvalue()
+
+
+def _worker_main(conn: Connection, cache_folder: str, memory_limit: int | None) -> None:
+    if memory_limit is not None:
+        import resource
+
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    _patch_read_hdf(Path(cache_folder))
+    while True:
+        try:
+            code_path, cwd = conn.recv()
+        except EOFError:  # the pool is closed
+            return
+        conn.send(_run_script(code_path, cwd))
+
+
+class FactorWorkerPool:
+    """
+    Run the scripts of the factor implementations in `n_workers` long-lived worker processes.
+
+    The workers are started on demand and `run` may be called from several threads; each call waits for an idle
+    worker.
+    """
+
+    def __init__(self, n_workers: int, cache_folder: str | Path, memory_limit: int | None = None) -> None:
+        self.cache_folder = Path(cache_folder)
+        self.memory_limit = memory_limit
+        # the default start method, like `multiprocessing_wrapper`; forked workers start with pandas already imported
+        self._context = mp.get_context()
+        self._idle: queue.Queue[Tuple[mp.process.BaseProcess, Connection] | None] = queue.Queue()
+        for _ in range(n_workers):
+            self._idle.put(None)  # a worker not started yet
+        self._pid = os.getpid()
+
+    def _start_worker(self) -> Tuple[mp.process.BaseProcess, Connection]:
+        conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main, args=(child_conn, str(self.cache_folder), self.memory_limit), daemon=True
+        )
+        process.start()
+        child_conn.close()
+        return process, conn
+
+    def run(self, code_path: str | Path, cwd: str | Path, timeout: float | None = None) -> Tuple[bool, str]:
+        """
+        Run the script `code_path` from `cwd` in a worker; see `_run_script` for the result.
+
+        Raises `subprocess.TimeoutExpired` when the script runs longer than `timeout` seconds, like `subprocess.run`.
+        """
+        worker = self._idle.get()
+        try:
+            if worker is None or not worker[0].is_alive():
+                worker = self._start_worker()
+            process, conn = worker
+            conn.send((str(code_path), str(cwd)))
+            if not conn.poll(timeout):
+                process.kill()
+                process.join()
+                worker = None
+                raise subprocess.TimeoutExpired(str(code_path), timeout)
+            try:
+                return conn.recv()
+            except (EOFError, OSError):  # the worker died while running the script (e.g. killed by the OS)
+                process.join()
+                worker = None
+                return False, f"The worker running the script exited unexpectedly with code {process.exitcode}."
+        finally:
+            self._idle.put(worker)
+
+    def close(self) -> None:
+        while not self._idle.empty():
+            worker = self._idle.get()
+            if worker is not None:
+                process, conn = worker
+                conn.close()  # the worker returns when its connection is closed
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.kill()
+
+
+_POOL: FactorWorkerPool | None = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_factor_worker_pool() -> FactorWorkerPool:
+    """The worker pool of the process, configured by `FACTOR_COSTEER_SETTINGS`."""
+    global _POOL
+    with _POOL_LOCK:
+        # a forked process doesn't share the workers of its parent
+        if _POOL is None or _POOL._pid != os.getpid():
+            _POOL = FactorWorkerPool(
+                FACTOR_COSTEER_SETTINGS.worker_pool_size,
+                Path(RD_AGENT_SETTINGS.pickle_cache_folder_path_str) / "factor_source_data",
+                FACTOR_COSTEER_SETTINGS.worker_memory_limit,
+            )
+            atexit.register(_POOL.close)
+        return _POOL
@@ -9,7 +9,6 @@ from rdagent.components.coder.model_coder.model import ModelFBWorkspace, ModelTa
 from rdagent.core.evaluation import Evaluator
 from rdagent.core.experiment import Task, Workspace
 from rdagent.core.prompts import Prompts
-from rdagent.oai.llm_conf import LLM_SETTINGS
 from rdagent.oai.llm_utils import APIBackend
 
 evaluate_prompts = Prompts(file_path=Path(__file__).parent / "prompts.yaml")
@@ -81,31 +80,20 @@ class ModelCodeEvaluator(Evaluator):
             )
         )
 
-        execution_feedback_to_render = model_execution_feedback
-        for _ in range(10):  # 10 times to split the content is enough
-            user_prompt = (
-                Environment(undefined=StrictUndefined)
-                .from_string(
-                    evaluate_prompts["evaluator_code_feedback"]["user"],
-                )
-                .render(
-                    model_information=model_task_information,
-                    code=code,
-                    model_execution_feedback=execution_feedback_to_render,
-                    model_value_feedback=model_value_feedback,
-                    gt_code=gt_implementation.code if gt_implementation else None,
-                )
-            )
-            if (
-                APIBackend().build_messages_and_calculate_token(
-                    user_prompt=user_prompt,
-                    system_prompt=system_prompt,
-                )
-                > LLM_SETTINGS.chat_token_limit
-            ):
-                execution_feedback_to_render = execution_feedback_to_render[len(execution_feedback_to_render) // 2 :]
-            else:
-                break
+        user_prompt_template = Environment(undefined=StrictUndefined).from_string(
+            evaluate_prompts["evaluator_code_feedback"]["user"],
+        )
+        _, user_prompt = APIBackend().build_messages_and_truncate_to_token_limit(
+            content=model_execution_feedback,
+            build_user_prompt=lambda execution_feedback_to_render: user_prompt_template.render(
+                model_information=model_task_information,
+                code=code,
+                model_execution_feedback=execution_feedback_to_render,
+                model_value_feedback=model_value_feedback,
+                gt_code=gt_implementation.code if gt_implementation else None,
+            ),
+            system_prompt=system_prompt,
+        )
 
         critic_response = APIBackend().build_messages_and_create_chat_completion(
             user_prompt=user_prompt,
@@ -144,32 +132,20 @@ class ModelFinalEvaluator(Evaluator):
             )
         )
 
-        execution_feedback_to_render = model_execution_feedback
-
-        for _ in range(10):  # 10 times to split the content is enough
-            user_prompt = (
-                Environment(undefined=StrictUndefined)
-                .from_string(
-                    evaluate_prompts["evaluator_final_feedback"]["user"],
-                )
-                .render(
-                    model_information=target_task.get_task_information(),
-                    model_execution_feedback=execution_feedback_to_render,
-                    model_shape_feedback=model_shape_feedback,
-                    model_code_feedback=model_code_feedback,
-                    model_value_feedback=model_value_feedback,
-                )
-            )
-            if (
-                APIBackend().build_messages_and_calculate_token(
-                    user_prompt=user_prompt,
-                    system_prompt=system_prompt,
-                )
-                > LLM_SETTINGS.chat_token_limit
-            ):
-                execution_feedback_to_render = execution_feedback_to_render[len(execution_feedback_to_render) // 2 :]
-            else:
-                break
+        user_prompt_template = Environment(undefined=StrictUndefined).from_string(
+            evaluate_prompts["evaluator_final_feedback"]["user"],
+        )
+        _, user_prompt = APIBackend().build_messages_and_truncate_to_token_limit(
+            content=model_execution_feedback,
+            build_user_prompt=lambda execution_feedback_to_render: user_prompt_template.render(
+                model_information=target_task.get_task_information(),
+                model_execution_feedback=execution_feedback_to_render,
+                model_shape_feedback=model_shape_feedback,
+                model_code_feedback=model_code_feedback,
+                model_value_feedback=model_value_feedback,
+            ),
+            system_prompt=system_prompt,
+        )
 
         final_evaluation_dict = json.loads(
             APIBackend().build_messages_and_create_chat_completion(
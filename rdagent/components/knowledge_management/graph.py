@@ -2,10 +2,11 @@ from __future__ import annotations
 
 import pickle
 import random
-from collections import deque
 from pathlib import Path
 from typing import Any, NoReturn
 
+import numpy as np
+
 from rdagent.components.knowledge_management.vector_base import (
     KnowledgeMetaData,
     PDVectorBase,
@@ -56,8 +57,52 @@ class Graph(KnowledgeBase):
 
     def __init__(self, path: str | Path | None = None) -> None:
         self.nodes = {}
+        # the indexes of the nodes by (content, label) and by label, maintained by `_insert_node` and `remove_node`
+        # node id -> insertion order, to merge the nodes of several labels in the order of `self.nodes`
+        self._content_index: dict[tuple[str, str], dict[str, Node]] = {}
+        self._label_index: dict[str, dict[str, Node]] = {}
+        self._node_order: dict[str, int] = {}
+        self._next_order = 0
         super().__init__(path=path)
 
+    def load(self) -> None:
+        super().load()
+        self._rebuild_index()  # the graphs dumped before the indexes were added
+
+    def __setstate__(self, state: dict) -> None:
+        # the graphs pickled as a whole (e.g. in a CoSTEER knowledge base), including those pickled before the
+        # indexes were added
+        self.__dict__.update(state)
+        self._rebuild_index()
+
+    def _rebuild_index(self) -> None:
+        self._content_index, self._label_index, self._node_order, self._next_order = {}, {}, {}, 0
+        for node in self.nodes.values():
+            self._index_node(node)
+
+    def _index_node(self, node: Node) -> None:
+        self._content_index.setdefault((node.content, node.label), {})[node.id] = node
+        self._label_index.setdefault(node.label, {})[node.id] = node
+        self._node_order[node.id] = self._next_order
+        self._next_order += 1
+
+    def _insert_node(self, node: Node) -> None:
+        if node.id in self.nodes:
+            self.remove_node(node.id)
+        self.nodes[node.id] = node
+        self._index_node(node)
+
+    def remove_node(self, node_id: str) -> Node | None:
+        node = self.nodes.pop(node_id, None)
+        if node is None:
+            return None
+        for index, key in ((self._content_index, (node.content, node.label)), (self._label_index, node.label)):
+            index[key].pop(node_id)
+            if not index[key]:
+                del index[key]
+        del self._node_order[node_id]
+        return node
+
     def size(self) -> int:
         return len(self.nodes)
 
@@ -71,24 +116,20 @@ class Graph(KnowledgeBase):
         return list(self.nodes.values())
 
     def get_all_nodes_by_label_list(self, label_list: list[str]) -> list[Node]:
-        return [node for node in self.nodes.values() if node.label in label_list]
+        nodes = [node for label in dict.fromkeys(label_list) for node in self._label_index.get(label, {}).values()]
+        if len(label_list) > 1:
+            nodes.sort(key=lambda node: self._node_order[node.id])
+        return nodes
 
     def find_node(self, content: str, label: str) -> Node | None:
-        for node in self.nodes.values():
-            if node.content == content and node.label == label:
-                return node
-        return None
+        return next(iter(self._content_index.get((content, label), {}).values()), None)
 
     @staticmethod
     def batch_embedding(nodes: list[Node]) -> list[Node]:
-        contents = [node.content for node in nodes]
-        # openai create embedding API input's max length is 16
-        size = 16
-        embeddings = []
-        for i in range(0, len(contents), size):
-            embeddings.extend(
-                APIBackend().create_embedding(input_content=contents[i : i + size]),
-            )
+        if not nodes:
+            return nodes
+        # `create_embedding` sends the contents in batches of `LLM_SETTINGS.embedding_max_str_num`
+        embeddings = APIBackend().create_embedding(input_content=[node.content for node in nodes])
 
         assert len(nodes) == len(embeddings), "nodes' length must equals embeddings' length"
         for node, embedding in zip(nodes, embeddings):
@@ -99,6 +140,65 @@ class Graph(KnowledgeBase):
         return f"Graph(nodes={self.nodes})"
 
 
+class _CSRAdjacency:
+    """
+    A snapshot of the edges of an `UndirectedGraph` as integer arrays, for the traversals.
+    - the nodes are numbered in the order of `graph.nodes`; `labels` is the code of each node's label.
+    - the neighbours of node i are `indices[indptr[i]:indptr[i + 1]]`, sorted by content (then by number) so the
+      traversals are deterministic.
+    """
+
+    def __init__(self, nodes: dict[str, UndirectedNode]) -> None:
+        self.nodes = list(nodes.values())
+        self.node_index = {node_id: i for i, node_id in enumerate(nodes)}
+        self.label_codes: dict[str, int] = {}
+        self.labels = np.array(
+            [self.label_codes.setdefault(node.label, len(self.label_codes)) for node in self.nodes], dtype=np.int64
+        )
+        edges = [
+            (i, self.node_index[neighbor.id])
+            for i, node in enumerate(self.nodes)
+            for neighbor in node.neighbors
+            if neighbor.id in self.node_index
+        ]
+        src, dst = np.array(edges, dtype=np.int64).reshape(-1, 2).T
+        content_rank = np.empty(len(self.nodes), dtype=np.int64)
+        content_rank[sorted(range(len(self.nodes)), key=lambda i: self.nodes[i].content)] = np.arange(len(self.nodes))
+        order = np.lexsort((content_rank[dst], src))
+        self.indices = dst[order]
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(src, minlength=len(self.nodes)))])
+
+    def label_mask(self, labels: list[str] | None) -> np.ndarray | None:
+        """The nodes with the labels (None means all)."""
+        if labels is None:
+            return None
+        return np.isin(self.labels, [self.label_codes[label] for label in labels if label in self.label_codes])
+
+    def bfs(self, start: int, steps: int, mask: np.ndarray | None = None) -> np.ndarray:
+        """
+        The nodes within `steps` hops of `start` (included) in breadth-first order, expanded level by level.
+        Only the nodes in `mask` are passed through if given.
+        """
+        visited = np.zeros(len(self.nodes), dtype=bool)
+        visited[start] = True
+        levels = [frontier := np.array([start], dtype=np.int64)]
+        for _ in range(steps):
+            lengths = self.indptr[frontier + 1] - self.indptr[frontier]
+            # the concatenated neighbours of the frontier, in the order of the frontier
+            offsets = np.repeat(self.indptr[frontier] - np.cumsum(lengths) + lengths, lengths)
+            candidates = self.indices[offsets + np.arange(offsets.shape[0])]
+            candidates = candidates[~visited[candidates]]
+            if mask is not None:
+                candidates = candidates[mask[candidates]]
+            _, first = np.unique(candidates, return_index=True)
+            frontier = candidates[np.sort(first)]
+            if frontier.shape[0] == 0:
+                break
+            visited[frontier] = True
+            levels.append(frontier)
+        return np.concatenate(levels)
+
+
 class UndirectedGraph(Graph):
     """
     Undirected Graph which edges have no relationship
@@ -106,8 +206,31 @@ class UndirectedGraph(Graph):
 
     def __init__(self, path: str | Path | None = None) -> None:
         self.vector_base: VectorBase = PDVectorBase()
+        # built lazily and dropped whenever the nodes or the edges change
+        self._adjacency: _CSRAdjacency | None = None
+        self._within_steps_cache: dict[tuple, np.ndarray] = {}
         super().__init__(path=path)
 
+    def _invalidate_adjacency(self) -> None:
+        self._adjacency = None
+        self._within_steps_cache = {}
+
+    def _insert_node(self, node: UndirectedNode) -> None:
+        super()._insert_node(node)
+        self._invalidate_adjacency()
+
+    def load(self) -> None:
+        super().load()
+        self._invalidate_adjacency()
+
+    def __setstate__(self, state: dict) -> None:
+        super().__setstate__(state)
+        self._invalidate_adjacency()  # not pickled before the adjacency was added
+
+    def dump(self) -> None:
+        self._invalidate_adjacency()
+        super().dump()
+
     def __str__(self) -> str:
         return f"UndirectedGraph(nodes={self.nodes})"
 
@@ -130,46 +253,65 @@ class UndirectedGraph(Graph):
         -------
 
         """
-        if self.get_node(node.id):
-            node = self.get_node(node.id)
-        elif self.find_node(content=node.content, label=node.label):
-            node = self.find_node(content=node.content, label=node.label)
-        else:
-            # same_node = self.semantic_search(node=node.content, similarity_threshold=same_node_threshold, topk_k=1)
-            # if len(same_node):
-            #     node = same_node[0]
-            # else:
-            node.create_embedding()
-            self.vector_base.add(document=node)
-            self.nodes.update({node.id: node})
-
-        if neighbor is not None:
-            if self.get_node(neighbor.id):
-                neighbor = self.get_node(neighbor.id)
-            elif self.find_node(content=neighbor.content, label=node.label):
-                neighbor = self.find_node(content=neighbor.content, label=node.label)
-            else:
-                # same_node = self.semantic_search(node=neighbor.content,
-                #                                  similarity_threshold=same_node_threshold, topk_k=1)
-                # if len(same_node):
-                #     neighbor = same_node[0]
-                # else:
-                neighbor.create_embedding()
-                self.vector_base.add(document=neighbor)
-                self.nodes.update({neighbor.id: neighbor})
-
-            node.add_neighbor(neighbor)
+        self.add_nodes_with_edges([(node, neighbor)])
 
     def add_nodes(self, node: UndirectedNode, neighbors: list[UndirectedNode]) -> None:
-        if not neighbors:
-            self.add_node(node)
-        else:
-            for neighbor in neighbors:
-                self.add_node(node, neighbor=neighbor)
+        self.add_nodes_with_edges([(node, neighbor) for neighbor in neighbors] or [(node, None)])
+
+    def add_nodes_with_edges(
+        self, node_pairs: list[tuple[UndirectedNode, UndirectedNode | None]]
+    ) -> list[tuple[UndirectedNode, UndirectedNode | None]]:
+        """
+        Add the nodes of the pairs and an edge between the nodes of each pair (a pair without neighbor only adds its
+        node), like calling `add_node` on each pair. But the new nodes are deduplicated, embedded in as few requests
+        as possible and added to the vector base at once.
+
+        Returns
+        -------
+        the pairs, with the nodes already in the graph in place of the given ones
+        """
+        new_nodes: dict[str, UndirectedNode] = {}
+        new_nodes_by_content: dict[tuple[str, str], UndirectedNode] = {}
+
+        def _resolve(node: UndirectedNode) -> UndirectedNode:
+            # a neighbor is matched by its own label (`add_node` used to match it with the label of the node)
+            same_node = (
+                self.get_node(node.id)
+                or new_nodes.get(node.id)
+                or self.find_node(content=node.content, label=node.label)
+                or new_nodes_by_content.get((node.content, node.label))
+            )
+            if same_node is not None:
+                return same_node
+            new_nodes[node.id] = new_nodes_by_content[(node.content, node.label)] = node
+            return node
+
+        if not node_pairs:
+            return []
+        resolved_pairs = [
+            (_resolve(node), None if neighbor is None else _resolve(neighbor)) for node, neighbor in node_pairs
+        ]
+        self.batch_embedding([node for node in new_nodes.values() if node.embedding is None])
+        self.vector_base.add(document=list(new_nodes.values()))
+        for node in new_nodes.values():
+            self._insert_node(node)
+        for node, neighbor in resolved_pairs:
+            if neighbor is not None:
+                node.add_neighbor(neighbor)
+        self._invalidate_adjacency()
+        return resolved_pairs
 
     def get_node(self, node_id: str) -> UndirectedNode:
         return self.nodes.get(node_id)
 
+    def remove_node(self, node_id: str) -> UndirectedNode | None:
+        node = super().remove_node(node_id)
+        if node is not None:
+            for neighbor in list(node.neighbors):
+                node.remove_neighbor(neighbor)
+            self._invalidate_adjacency()
+        return node
+
     def get_node_by_content(self, content: str) -> UndirectedNode | None:
         """
         Get node by semantic distance
@@ -181,12 +323,16 @@ class UndirectedGraph(Graph):
         -------
 
         """
-        if content == "Model":
-            pass
-        match = self.semantic_search(node=content, similarity_threshold=0.999)
-        if match:
-            return match[0]
-        return None
+        return self.get_nodes_by_contents([content])[0]
+
+    def get_nodes_by_contents(self, contents: list[str]) -> list[UndirectedNode | None]:
+        """
+        `get_node_by_content` of several contents, whose embeddings are created in one request
+        """
+        if not contents:
+            return []
+        results = self.vector_base.batch_search(contents, topk_k=5, similarity_threshold=0.999)
+        return [next((self.get_node(doc.id) for doc in docs if doc.id in self.nodes), None) for docs, _ in results]
 
     def get_nodes_within_steps(
         self,
@@ -199,32 +345,19 @@ class UndirectedGraph(Graph):
         """
         Returns the nodes in the graph whose distance from node is less than or equal to step
         """
-        visited = set()
-        queue = deque([(start_node, 0)])
-        result = []
-
-        while queue:
-            node, current_steps = queue.popleft()
-
-            if current_steps > steps:
-                break
-
-            if node not in visited:
-                visited.add(node)
-                result.append(node)
-
-                for neighbor in sorted(
-                    self.get_node(node.id).neighbors,
-                    key=lambda x: x.content,
-                ):  # to make sure the result is deterministic
-                    if neighbor not in visited and not (block and neighbor.label not in constraint_labels):
-                        queue.append((neighbor, current_steps + 1))
-
-        if constraint_labels:
-            result = [node for node in result if node.label in constraint_labels]
-        if start_node in result:
-            result.remove(start_node)
-        return result
+        if self._adjacency is None:
+            self._adjacency = _CSRAdjacency(self.nodes)
+        adjacency = self._adjacency
+        if start_node.id not in adjacency.node_index:
+            return []
+        key = (start_node.id, steps, None if constraint_labels is None else tuple(constraint_labels), block)
+        if key not in self._within_steps_cache:
+            start = adjacency.node_index[start_node.id]
+            result = adjacency.bfs(start, steps, adjacency.label_mask(constraint_labels) if block else None)[1:]
+            if constraint_labels:
+                result = result[adjacency.label_mask(constraint_labels)[result]]
+            self._within_steps_cache[key] = result
+        return [adjacency.nodes[i] for i in self._within_steps_cache[key]]
 
     def get_nodes_intersection(
         self,
@@ -256,6 +389,7 @@ class UndirectedGraph(Graph):
                     steps=steps,
                     constraint_labels=constraint_labels,
                 )
+                continue
             intersection = self.intersection(
                 nodes1=intersection,
                 nodes2=self.get_nodes_within_steps(
@@ -293,10 +427,13 @@ class UndirectedGraph(Graph):
             topk_k=topk_k,
             similarity_threshold=similarity_threshold,
         )
-        return [self.get_node(doc.id) for doc in docs]
+        # the removed nodes are still in the vector base
+        return [self.get_node(doc.id) for doc in docs if doc.id in self.nodes]
 
     def clear(self) -> None:
         self.nodes.clear()
+        self._rebuild_index()
+        self._invalidate_adjacency()
         self.vector_base: VectorBase = PDVectorBase()
 
     def query_by_node(
@@ -412,6 +549,7 @@ class UndirectedGraph(Graph):
 
     @staticmethod
     def intersection(nodes1: list[UndirectedNode], nodes2: list[UndirectedNode]) -> list[UndirectedNode]:
+        nodes2 = set(nodes2)
         return [node for node in nodes1 if node in nodes2]
 
     @staticmethod
@@ -1,10 +1,14 @@
+from __future__ import annotations
+
+import os
 import uuid
 from pathlib import Path
-from typing import List, Tuple, Union
+from typing import Any, List, Tuple, Union
 
+import numpy as np
 import pandas as pd
-from scipy.spatial.distance import cosine
 
+from rdagent.core.conf import RD_AGENT_SETTINGS
 from rdagent.core.knowledge_base import KnowledgeBase
 from rdagent.log import rdagent_logger as logger
 from rdagent.oai.llm_utils import APIBackend
@@ -103,18 +107,282 @@ class VectorBase(KnowledgeBase):
         pass
 
 
+class VectorIndex:
+    """
+    The embeddings are stored L2-normalized in a contiguous float32 matrix, so the cosine similarities between the
+    queries and all the embeddings are a single matrix product.
+    The capacity of the matrix grows geometrically, so appending is amortized O(1).
+    """
+
+    def __init__(self, embeddings: np.ndarray | None = None) -> None:
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._size = 0
+        if embeddings is not None:
+            self.add(embeddings)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """The normalized embeddings (a view of the matrix), one row per added embedding."""
+        return self._matrix[: self._size]
+
+    @staticmethod
+    def _normalize(embeddings: Any) -> np.ndarray:
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, np.finfo(np.float32).tiny)  # zero vectors stay zero (similarity 0)
+
+    def add(self, embeddings: Any) -> None:
+        """Append one embedding or a matrix of embeddings (one per row)."""
+        embeddings = self._normalize(embeddings)
+        if embeddings.shape[0] == 0:
+            return
+        if self._size == 0 and self._matrix.shape[1] != embeddings.shape[1]:
+            self._matrix = np.empty((0, embeddings.shape[1]), dtype=np.float32)
+        if embeddings.shape[1] != self._matrix.shape[1]:
+            raise ValueError(f"The dimension of the embeddings should be {self._matrix.shape[1]}.")
+        new_size = self._size + embeddings.shape[0]
+        if new_size > self._matrix.shape[0] or not self._matrix.flags.writeable:  # e.g. a loaded memory-mapped file
+            matrix = np.empty((max(new_size, 2 * self._matrix.shape[0], 16), self._matrix.shape[1]), dtype=np.float32)
+            matrix[: self._size] = self._matrix[: self._size]
+            self._matrix = matrix
+        self._matrix[self._size : new_size] = embeddings
+        self._size = new_size
+
+    def search(
+        self, queries: Any, topk_k: int = 5, similarity_threshold: float = 0
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        """
+        Find the topk_k most similar embeddings (with similarity > similarity_threshold) of every query.
+
+        Returns
+        -------
+        list[tuple[np.ndarray, np.ndarray]]
+            the row indices and the cosine similarities of the results of every query, in descending similarity.
+        """
+        queries = self._normalize(queries)
+        if self._size == 0 or topk_k <= 0:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in range(queries.shape[0])]
+        similarities = queries @ self.embeddings.T  # (n_queries, n_embeddings)
+        return [
+            self._select(query_similarities, None, topk_k, similarity_threshold) for query_similarities in similarities
+        ]
+
+    @staticmethod
+    def _select(
+        similarities: np.ndarray, candidates: np.ndarray | None, topk_k: int, similarity_threshold: float
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """The top-k of the similarities to the candidates (all the embeddings if None) above the threshold."""
+        k = min(topk_k, similarities.shape[0])
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top], kind="stable")]
+        top = top[similarities[top] > similarity_threshold]
+        return (top if candidates is None else candidates[top]), similarities[top]
+
+    def save(self, path: str | Path) -> None:
+        """
+        Save the embeddings to a temporary file which then replaces `path`, so the embeddings may be a memory-mapped
+        file of `path` itself (e.g. a loaded index saved again without an append).
+        """
+        path = Path(path)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with tmp_path.open("wb") as f:
+            np.save(f, self.embeddings)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str | Path, mmap: bool = True) -> VectorIndex:
+        """Memory-map the saved embeddings (read only); they are copied into memory on the first append."""
+        index = cls()
+        index._matrix = np.load(path, mmap_mode="r" if mmap else None)
+        index._size = index._matrix.shape[0]
+        return index
+
+    def __getstate__(self) -> dict:
+        return {"embeddings": np.ascontiguousarray(self.embeddings)}  # don't pickle the unused capacity
+
+    def __setstate__(self, state: dict) -> None:
+        self._matrix = state["embeddings"]
+        self._size = self._matrix.shape[0]
+
+
+class IVFVectorIndex(VectorIndex):
+    """
+    Approximate search by an inverted file index: the embeddings are clustered by spherical k-means into about
+    sqrt(n) lists, and a query only scans the lists of its `nprobe` most similar centroids.
+
+    - The search is exact until there are `min_train_size` embeddings.
+    - The clusters are trained on the first search and retrained once the number of embeddings doubles;
+      the embeddings added in between are appended to the list of their nearest centroid.
+    """
+
+    def __init__(
+        self, embeddings: np.ndarray | None = None, nprobe: int | None = None, min_train_size: int = 4096
+    ) -> None:
+        self.nprobe = RD_AGENT_SETTINGS.vector_index_ivf_nprobe if nprobe is None else nprobe
+        self.min_train_size = min_train_size
+        self._centroids: np.ndarray | None = None
+        self._lists: list[np.ndarray] = []
+        self._trained_size = 0
+        super().__init__(embeddings)
+
+    def add(self, embeddings: Any) -> None:
+        start = self._size
+        super().add(embeddings)
+        if self._centroids is None:
+            return
+        if self._size >= 2 * self._trained_size:
+            self._centroids = None  # retrained on the next search
+            return
+        assignment = self._assign(self.embeddings[start:])
+        for list_id in np.unique(assignment):
+            new_ids = start + np.flatnonzero(assignment == list_id)
+            self._lists[list_id] = np.concatenate([self._lists[list_id], new_ids])
+
+    def _assign(self, embeddings: np.ndarray, chunk_size: int = 65536) -> np.ndarray:
+        return np.concatenate(
+            [
+                np.argmax(embeddings[i : i + chunk_size] @ self._centroids.T, axis=1)
+                for i in range(0, embeddings.shape[0], chunk_size)
+            ]
+        )
+
+    def train(self, n_iter: int = 10, sample_per_list: int = 64, seed: int = 0) -> None:
+        n_lists = max(1, int(np.sqrt(self._size)))
+        rng = np.random.default_rng(seed)
+        sample = self.embeddings[np.sort(rng.choice(self._size, min(self._size, n_lists * sample_per_list), False))]
+        centroids = sample[rng.choice(sample.shape[0], n_lists, replace=False)]
+        for _ in range(n_iter):
+            self._centroids = centroids
+            assignment = self._assign(sample)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=n_lists)
+            centroids = np.where(counts[:, None] > 0, self._normalize(sums), centroids)  # keep the empty ones
+        self._centroids = centroids
+        assignment = self._assign(self.embeddings)
+        order = np.argsort(assignment, kind="stable")
+        self._lists = np.split(order, np.cumsum(np.bincount(assignment, minlength=n_lists))[:-1])
+        self._trained_size = self._size
+
+    def search(
+        self, queries: Any, topk_k: int = 5, similarity_threshold: float = 0
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        if self._size < self.min_train_size:
+            return super().search(queries, topk_k, similarity_threshold)
+        if self._centroids is None:
+            self.train()
+        queries = self._normalize(queries)
+        nprobe = min(self.nprobe, self._centroids.shape[0])
+        probes = np.argpartition(-(queries @ self._centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        results = []
+        for query, query_probes in zip(queries, probes):
+            candidates = np.concatenate([self._lists[list_id] for list_id in query_probes])
+            results.append(self._select(self.embeddings[candidates] @ query, candidates, topk_k, similarity_threshold))
+        return results
+
+    def __getstate__(self) -> dict:
+        return {
+            **super().__getstate__(),
+            "nprobe": self.nprobe,
+            "min_train_size": self.min_train_size,
+            "centroids": self._centroids,
+            "lists": self._lists,
+            "trained_size": self._trained_size,
+        }
+
+    def __setstate__(self, state: dict) -> None:
+        super().__setstate__(state)
+        self.nprobe, self.min_train_size = state["nprobe"], state["min_train_size"]
+        self._centroids, self._lists, self._trained_size = state["centroids"], state["lists"], state["trained_size"]
+
+
+VECTOR_INDEX_TYPES: dict[str, type[VectorIndex]] = {"exact": VectorIndex, "ivf": IVFVectorIndex}
+
+
 class PDVectorBase(VectorBase):
     """
     Implement of VectorBase using Pandas
+
+    The rows (one for the document and one for each of its trunks) are kept in `records`, and their embeddings in a
+    `VectorIndex`; `vector_df` presents them as a DataFrame.
+    When dumped, the embeddings are saved to `<path>.npy` which is memory-mapped when loaded.
     """
 
-    def __init__(self, path: Union[str, Path] = None):
-        self.vector_df = pd.DataFrame(columns=["id", "label", "content", "embedding"])
+    def __init__(self, path: Union[str, Path] = None, index_type: str | None = None):
+        """
+        index_type: the type of the index in `VECTOR_INDEX_TYPES`; `RD_AGENT_SETTINGS.vector_index` by default
+        """
+        self.index_type = RD_AGENT_SETTINGS.vector_index if index_type is None else index_type
+        self.records: list[dict] = []
+        self.index = VECTOR_INDEX_TYPES[self.index_type]()
+        self._vector_df: pd.DataFrame | None = None
         super().__init__(path)
 
+    @property
+    def vector_df(self) -> pd.DataFrame:
+        if self._vector_df is None:
+            self._vector_df = pd.DataFrame(self.records)
+            self._vector_df["embedding"] = list(self.index.embeddings)
+        return self._vector_df
+
+    @vector_df.setter
+    def vector_df(self, vector_df: pd.DataFrame) -> None:
+        self.records = vector_df.drop(columns="embedding").to_dict("records")
+        self.index = VECTOR_INDEX_TYPES[self.index_type](
+            np.stack(vector_df["embedding"].to_list()) if len(vector_df) else None
+        )
+        self._vector_df = None
+
+    @property
+    def _embedding_path(self) -> Path:
+        return self.path.with_name(self.path.name + ".npy")
+
+    def _migrate_vector_df(self) -> None:
+        if "vector_df" in self.__dict__:  # pickled before the embeddings were kept in the index
+            self.vector_df = self.__dict__.pop("vector_df")
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.__dict__.setdefault("index_type", "exact")
+        self._migrate_vector_df()
+
+    def load(self) -> None:
+        super().load()
+        self._migrate_vector_df()
+        if self.index is None:
+            index_cls = VECTOR_INDEX_TYPES[self.index_type]
+            self.index = index_cls.load(self._embedding_path) if self._embedding_path.exists() else index_cls()
+        self._vector_df = None
+
+    def dump(self) -> None:
+        if self.path is None:
+            super().dump()
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.index.save(self._embedding_path)
+        index, vector_df = self.index, self._vector_df
+        self.index, self._vector_df = None, None
+        try:
+            super().dump()
+        finally:
+            self.index, self._vector_df = index, vector_df
+
     def shape(self):
         return self.vector_df.shape
 
+    def add_records(self, records: list[dict]) -> None:
+        """Append the rows; the "embedding" of every row is moved to the index."""
+        if not records:
+            return
+        self.index.add(np.stack([np.asarray(record["embedding"], dtype=np.float32) for record in records]))
+        self.records.extend({k: v for k, v in record.items() if k != "embedding"} for record in records)
+        self._vector_df = None
+
     def add(self, document: Union[Document, List[Document]]):
         """
         add new node to vector_df
@@ -126,10 +394,12 @@ class PDVectorBase(VectorBase):
         -------
 
         """
-        if isinstance(document, Document):
+        documents = [document] if isinstance(document, Document) else document
+        docs = []
+        for document in documents:
             if document.embedding is None:
                 document.create_embedding()
-            docs = [
+            docs.append(
                 {
                     "id": document.id,
                     "label": document.label,
@@ -137,7 +407,7 @@ class PDVectorBase(VectorBase):
                     "trunk": document.content,
                     "embedding": document.embedding,
                 }
-            ]
+            )
             docs.extend(
                 [
                     {
@@ -150,10 +420,7 @@ class PDVectorBase(VectorBase):
                     for trunk, embedding in zip(document.trunks, document.trunks_embedding)
                 ]
             )
-            self.vector_df = pd.concat([self.vector_df, pd.DataFrame(docs)], ignore_index=True)
-        else:
-            for doc in document:
-                self.add(document=doc)
+        self.add_records(docs)
 
     def search(self, content: str, topk_k: int = 5, similarity_threshold: float = 0) -> Tuple[List[Document], List]:
         """
@@ -168,16 +435,28 @@ class PDVectorBase(VectorBase):
         -------
 
         """
-        if not self.vector_df.shape[0]:
-            return [], []
-        document = Document(content=content)
-        document.create_embedding()
-        similarities = self.vector_df["embedding"].apply(
-            lambda x: 1 - cosine(x, document.embedding)
-        )  # cosine is cosine distance, 1-similarity
-        searched_similarities = similarities[similarities > similarity_threshold].nlargest(topk_k)
-        most_similar_docs = self.vector_df.loc[searched_similarities.index]
-        docs = []
-        for _, similar_docs in most_similar_docs.iterrows():
-            docs.append(Document().from_dict(similar_docs.to_dict()))
-        return docs, searched_similarities.to_list()
+        return self.batch_search([content], topk_k=topk_k, similarity_threshold=similarity_threshold)[0]
+
+    def batch_search(
+        self, contents: List[str], topk_k: int = 5, similarity_threshold: float = 0
+    ) -> List[Tuple[List[Document], List]]:
+        """
+        search the vectors of several contents at once; the embeddings of the contents are created in one call.
+
+        Returns
+        -------
+        the (documents, similarities) of every content, the same as `search`
+        """
+        if not self.records:
+            return [([], []) for _ in contents]
+        embeddings = APIBackend().create_embedding_array(contents)
+        return self.search_by_embeddings(embeddings, topk_k=topk_k, similarity_threshold=similarity_threshold)
+
+    def search_by_embeddings(
+        self, embeddings: Any, topk_k: int = 5, similarity_threshold: float = 0
+    ) -> List[Tuple[List[Document], List]]:
+        results = []
+        for indices, similarities in self.index.search(embeddings, topk_k, similarity_threshold):
+            docs = [Document().from_dict({**self.records[i], "embedding": self.index.embeddings[i]}) for i in indices]
+            results.append((docs, similarities.tolist()))
+        return results
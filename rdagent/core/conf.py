@@ -72,6 +72,15 @@ class RDAgentSettings(ExtendedBaseSettings):
     # multi processing conf
     multi_proc_n: int = 1
 
+    # the budgets of the jobs run concurrently by `rdagent.utils.env.EnvScheduler`
+    env_scheduler_max_jobs: int = 4
+    env_scheduler_cpu_budget: float | None = None  # None means the number of CPUs
+    env_scheduler_memory_budget: str | None = None  # e.g. "64g"; None means the physical memory
+
+    # vector index conf of the knowledge bases (`PDVectorBase`)
+    vector_index: str = "exact"  # "exact", or "ivf" (approximate, for the knowledge bases of 100k+ vectors)
+    vector_index_ivf_nprobe: int = 16  # the number of the nearest clusters scanned by a query of the "ivf" index
+
     # pickle cache conf
     cache_with_pickle: bool = True  # whether to use pickle cache
     pickle_cache_folder_path_str: str = str(
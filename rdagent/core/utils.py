@@ -112,13 +112,29 @@ class CacheSeedGen:
 LLM_CACHE_SEED_GEN = CacheSeedGen()
 
 
+_SUBPROCESS_CALL_HOOKS: list[Callable[[], None]] = []
+
+
+def register_subprocess_call_hook(hook: Callable[[], None]) -> None:
+    """
+    The workers of `multiprocessing_wrapper` are terminated without running the `atexit` handlers.
+    So the hooks that must run before a worker exits (e.g. persisting buffered writes) are registered here,
+    and they are called after every function call in the workers.
+    """
+    _SUBPROCESS_CALL_HOOKS.append(hook)
+
+
 def _subprocess_wrapper(f: Callable, seed: int, args: list) -> Any:
     """
     It is a function wrapper. To ensure the subprocess has a fixed start seed.
     """
 
     LLM_CACHE_SEED_GEN.set_seed(seed)
-    return f(*args)
+    try:
+        return f(*args)
+    finally:
+        for hook in _SUBPROCESS_CALL_HOOKS:
+            hook()
 
 
 def multiprocessing_wrapper(func_calls: list[tuple[Callable, tuple]], n: int) -> list:
@@ -153,7 +169,9 @@ def multiprocessing_wrapper(func_calls: list[tuple[Callable, tuple]], n: int) ->
         return [result.get() for result in results]
 
 
-def cache_with_pickle(hash_func: Callable, post_process_func: Callable | None = None) -> Callable:
+def cache_with_pickle(
+    hash_func: Callable, post_process_func: Callable | None = None, validate_func: Callable | None = None
+) -> Callable:
     """
     This decorator will cache the return value of the function with pickle.
     The cache key is generated by the hash_func. The hash function returns a string or None.
@@ -162,6 +180,8 @@ def cache_with_pickle(hash_func: Callable, post_process_func: Callable | None =
     The post_process_func will be called with the original arguments and the cached result
     to give each caller a chance to process the cached result. The post_process_func should
     return the final result.
+    The validate_func will be called the same way and tells whether the cached result is still
+    valid (e.g. whether the files it refers to still exist); an invalid one is computed and cached again.
     """
 
     def cache_decorator(func: Callable) -> Callable:
@@ -183,7 +203,10 @@ def cache_with_pickle(hash_func: Callable, post_process_func: Callable | None =
             if cache_file.exists():
                 with cache_file.open("rb") as f:
                     cached_res = pickle.load(f)
-                return post_process_func(*args, cached_res=cached_res, **kwargs) if post_process_func else cached_res
+                if validate_func is None or validate_func(*args, cached_res=cached_res, **kwargs):
+                    return (
+                        post_process_func(*args, cached_res=cached_res, **kwargs) if post_process_func else cached_res
+                    )
 
             if RD_AGENT_SETTINGS.use_file_lock:
                 with FileLock(lock_file):
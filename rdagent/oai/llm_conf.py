@@ -19,6 +19,33 @@ class LLMSettings(ExtendedBaseSettings):
     dump_embedding_cache: bool = False
     use_embedding_cache: bool = False
     prompt_cache_path: str = str(Path.cwd() / "prompt_cache.db")
+    prompt_cache_backend: str = "sqlite"
+    """
+    The backend of the prompt cache.
+    - "sqlite": a sqlite database (WAL mode) at `prompt_cache_path`.
+    - "file": a directory-sharded store at `prompt_cache_path`, one file per record.
+    """
+    prompt_cache_commit_batch_size: int = 32
+    prompt_cache_commit_interval: float = 1.0
+    """
+    The sqlite backend buffers the writes in memory and commits them in one transaction once
+    `prompt_cache_commit_batch_size` writes are pending or `prompt_cache_commit_interval` seconds passed.
+    """
+    prompt_cache_ttl_days: float | None = None
+    prompt_cache_max_bytes: int | None = None
+    """
+    The eviction policies applied when the prompt cache is opened (None means disabled).
+    - The records not accessed in `prompt_cache_ttl_days` are evicted.
+    - The least recently used records are evicted until the cache is no larger than `prompt_cache_max_bytes`.
+    They can also be applied manually with `rdagent cache prune`.
+    """
+    chat_single_flight: bool = True
+    chat_single_flight_timeout: float = 600
+    """
+    When both `use_chat_cache` and `dump_chat_cache` are enabled, the identical chat completions requested at the same
+    time by several threads or processes are coalesced: the first one is requested, the others wait for it (at most
+    `chat_single_flight_timeout` seconds) and reuse its response from the cache.
+    """
     max_past_message_include: int = 10
 
     # Behavior of returning answers to the same question when caching is enabled
@@ -92,5 +119,16 @@ class LLMSettings(ExtendedBaseSettings):
 
     chat_model_map: str = "{}"
 
+    # Async chat completion configs
+    async_max_concurrency: int = 16
+    """The maximum number of in-flight requests issued by the async APIs (per event loop)."""
+    async_rate_limit_rpm: float | None = None
+    """Default requests-per-minute limit applied to every model when using the async APIs. None means no limit."""
+    async_rate_limit_map: str = "{}"
+    """
+    A json dict mapping model name to its requests-per-minute limit, e.g. `{"gpt-4o": 500}`.
+    It overrides `async_rate_limit_rpm` for the models (usually the ones in `chat_model_map`) it contains.
+    """
+
 
 LLM_SETTINGS = LLMSettings()
@@ -1,24 +1,37 @@
 from __future__ import annotations
 
+import asyncio
+import atexit
 import hashlib
-import inspect
 import json
 import os
 import random
 import re
 import sqlite3
 import ssl
+import sys
+import threading
 import time
 import urllib.request
 import uuid
+import weakref
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Callable, Iterator
+from contextlib import asynccontextmanager, contextmanager, suppress
+from contextvars import ContextVar
 from copy import deepcopy
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, ClassVar, Optional
 
 import numpy as np
 import tiktoken
+from filelock import FileLock, Timeout
 
-from rdagent.core.utils import LLM_CACHE_SEED_GEN, SingletonBaseClass
+from rdagent.core.utils import (
+    LLM_CACHE_SEED_GEN,
+    SingletonBaseClass,
+    register_subprocess_call_hook,
+)
 from rdagent.log import LogColors
 from rdagent.log import rdagent_logger as logger
 from rdagent.oai.llm_conf import LLM_SETTINGS
@@ -85,93 +98,583 @@ class ConvManager:
         # TODO: reseve line breaks to make it more convient to edit file directly.
 
 
-class SQliteLazyCache(SingletonBaseClass):
+def _encode_embedding(embedding: list[float] | np.ndarray) -> bytes:
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+
+def _decode_embedding(value: bytes | str) -> np.ndarray:
+    if isinstance(value, str):
+        # the embeddings cached before they were stored as float32 blobs are json strings.
+        return np.asarray(json.loads(value), dtype=np.float32)
+    return np.frombuffer(value, dtype=np.float32)
+
+
+def _stack_embeddings(values: list[bytes | str | None]) -> tuple[np.ndarray, np.ndarray]:
+    hit_mask = np.array([value is not None for value in values], dtype=bool)
+    hit_values = [_decode_embedding(value) for value in values if value is not None]
+    embeddings = np.stack(hit_values) if hit_values else np.empty((0, 0), dtype=np.float32)
+    return hit_mask, embeddings
+
+
+class LLMCacheBase:
+    """
+    The interface of the cache of chat responses, embeddings and session messages.
+    The keys of chat and embedding are hashed by md5 before being stored.
+    Embeddings are stored as float32 binaries.
+
+    The last access time of every record is tracked, so the least recently used records can be evicted
+    by `prune` (and automatically on start-up if `prompt_cache_ttl_days` or `prompt_cache_max_bytes` is set).
+    """
+
+    cache_location: str | Path
+
+    def chat_get(self, key: str) -> str | None:
+        raise NotImplementedError
+
+    def embedding_get(self, key: str) -> list | dict | str | None:
+        hit_mask, embeddings = self.embedding_get_many([key])
+        return embeddings[0].tolist() if hit_mask[0] else None
+
+    def embedding_get_many(self, keys: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Look up the embeddings of all the keys at once.
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            - a bool array of len(keys) telling whether each key is cached.
+            - a float32 matrix of the cached embeddings, one row per hit key in the order of `keys`.
+        """
+        raise NotImplementedError
+
+    def chat_set(self, key: str, value: str) -> None:
+        raise NotImplementedError
+
+    def embedding_set(self, content_to_embedding_dict: dict) -> None:
+        raise NotImplementedError
+
+    def message_get(self, conversation_id: str) -> list[str]:
+        raise NotImplementedError
+
+    def message_set(self, conversation_id: str, message_value: list[str]) -> None:
+        raise NotImplementedError
+
+    def message_append(self, conversation_id: str, new_messages: list[str]) -> None:
+        """Append the new messages to the conversation without rewriting the former ones."""
+        self.message_set(conversation_id, self.message_get(conversation_id) + new_messages)
+
+    def flush(self) -> None:
+        """Persist the pending writes. Backends writing through do nothing."""
+
+    def prune(self, ttl_seconds: float | None = None, max_bytes: int | None = None) -> int:
+        """
+        Evict the records which are not accessed in `ttl_seconds`, then evict the least recently used
+        records until the total size of the records is no more than `max_bytes`.
+        A conversation is evicted as a whole.
+
+        Returns
+        -------
+        int
+            the number of evicted records.
+        """
+        raise NotImplementedError
+
+    def vacuum(self) -> None:
+        """Compact the storage so that the space of the evicted records is returned to the file system."""
+        raise NotImplementedError
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        """The number of records, total bytes and the last access time range of each table."""
+        raise NotImplementedError
+
+    def _single_flight_lock(self, key: str) -> tuple[FileLock, Path]:
+        lock_path = Path(f"{self.cache_location}.locks") / f"{md5_hash(key)}.lock"
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        # the lock may be acquired and released in different threads by the async APIs
+        return FileLock(lock_path, thread_local=False), lock_path
+
+    @staticmethod
+    def _release_single_flight_lock(lock: FileLock, lock_path: Path) -> None:
+        lock.release()
+        # The result is already in the cache, so the late comers hit the cache without looking at the lock.
+        with suppress(OSError):
+            lock_path.unlink()
+
+    @contextmanager
+    def single_flight(self, key: str, timeout: float = -1) -> Iterator[None]:
+        """
+        Only let one of the threads and processes sharing the cache run the block of `key` at a time, so the
+        duplicated requests can wait for the first one and read its result from the cache.
+        The pending writes are flushed before the lock is released, so the result is visible to the waiters.
+        If the lock can't be acquired in `timeout` seconds (negative means no timeout), the block is run anyway.
+        """
+        lock, lock_path = self._single_flight_lock(key)
+        try:
+            lock.acquire(timeout=timeout)
+        except Timeout:
+            logger.warning("Timeout waiting for the in-flight request of the same key. Requesting it again.")
+            yield
+            return
+        try:
+            yield
+            self.flush()
+        finally:
+            self._release_single_flight_lock(lock, lock_path)
+
+    @asynccontextmanager
+    async def async_single_flight(self, key: str, timeout: float = -1) -> AsyncIterator[None]:
+        """The async version of `single_flight`; the lock is waited for in a worker thread."""
+        lock, lock_path = self._single_flight_lock(key)
+        try:
+            await asyncio.to_thread(lock.acquire, timeout=timeout)
+        except Timeout:
+            logger.warning("Timeout waiting for the in-flight request of the same key. Requesting it again.")
+            yield
+            return
+        try:
+            yield
+            self.flush()
+        finally:
+            self._release_single_flight_lock(lock, lock_path)
+
+    def _auto_prune(self) -> None:
+        if LLM_SETTINGS.prompt_cache_ttl_days is not None or LLM_SETTINGS.prompt_cache_max_bytes is not None:
+            removed_n = self.prune(
+                ttl_seconds=(
+                    None if LLM_SETTINGS.prompt_cache_ttl_days is None else LLM_SETTINGS.prompt_cache_ttl_days * 86400
+                ),
+                max_bytes=LLM_SETTINGS.prompt_cache_max_bytes,
+            )
+            if removed_n > 0:
+                logger.info(f"Evicted {removed_n} records from the prompt cache.")
+
+
+class SQliteLazyCache(LLMCacheBase, SingletonBaseClass):
+    """
+    The sqlite backend of the LLM cache.
+
+    - The database runs in WAL mode, so readers never block the writer.
+    - Connections are created per process and per thread (sqlite3 connections can't be shared across them).
+    - Writes and access time updates are buffered in memory and committed in a single transaction when the buffer
+      is full or `prompt_cache_commit_interval` passed; the lock of the database is only held while committing.
+    - Session messages are stored one row per message, so a new turn only appends rows.
+    """
+
+    _TABLES: ClassVar[dict[str, tuple[str, str]]] = {
+        "chat_cache": ("md5_key", "chat"),
+        "embedding_cache": ("md5_key", "embedding"),
+        # the whole conversation in one row; it is only read (and migrated to `session_message_cache`) now.
+        "message_cache": ("conversation_id", "message"),
+        "session_message_cache": ("conversation_id", "message"),
+    }
+    _MAX_SQL_VARIABLES = 500  # the number of keys looked up by one `IN (...)` query
+
     def __init__(self, cache_location: str) -> None:
+        if getattr(self, "_initialized", False):
+            # the singleton is re-initialized on every call; keep the connections and the pending writes.
+            return
         super().__init__()
         self.cache_location = cache_location
-        db_file_exist = Path(cache_location).exists()
-        # TODO: sqlite3 does not support multiprocessing.
-        self.conn = sqlite3.connect(cache_location, timeout=20)
-        self.c = self.conn.cursor()
-        if not db_file_exist:
-            self.c.execute(
-                """
-                CREATE TABLE chat_cache (
-                    md5_key TEXT PRIMARY KEY,
-                    chat TEXT
-                )
-                """,
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._reset_pending()
+        self._init_tables()
+        atexit.register(self.flush)
+        register_subprocess_call_hook(self.flush)
+        self._initialized = True
+        self._auto_prune()
+
+    def _init_tables(self) -> None:
+        conn = self.conn
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")  # avoid migrating the tables in several processes at the same time
+            for table, (key_col, value_col) in self._TABLES.items():
+                if table == "session_message_cache":
+                    conn.execute(
+                        f"CREATE TABLE IF NOT EXISTS {table} ({key_col} TEXT, idx INTEGER, {value_col} TEXT, "
+                        f"last_access REAL, PRIMARY KEY ({key_col}, idx))"
+                    )
+                else:
+                    conn.execute(
+                        f"CREATE TABLE IF NOT EXISTS {table} ({key_col} TEXT PRIMARY KEY, {value_col} TEXT, "
+                        "last_access REAL)"
+                    )
+                if "last_access" not in [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]:
+                    # the tables created before the access time was tracked
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN last_access REAL")
+                    conn.execute(f"UPDATE {table} SET last_access=?", (time.time(),))  # noqa: S608
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_last_access ON {table} (last_access)")
+
+    def _reset_pending(self) -> None:
+        self._pid = os.getpid()
+        self._pending: dict[str, dict[str, str | bytes]] = {table: {} for table in self._TABLES}
+        self._pending_access: dict[str, dict[str, float]] = {table: {} for table in self._TABLES}
+        self._pending_n = 0
+        self._last_flush_time = time.monotonic()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            # A forked child inherits the pending writes of the parent, which are committed by the parent.
+            self._reset_pending()
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.cache_location, timeout=20)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _touch(self, table: str, keys: list[str]) -> None:
+        """Record the access time of the keys; it is written to the database with the next commit."""
+        now = time.time()
+        with self._lock:
+            self._pending_access[table].update(dict.fromkeys(keys, now))
+            self._pending_n += len(keys)
+            self._maybe_flush()
+
+    def _get(self, table: str, key: str) -> str | None:
+        conn = self.conn
+        with self._lock:
+            if key in self._pending[table]:
+                return self._pending[table][key]
+        key_col, value_col = self._TABLES[table]
+        result = conn.execute(f"SELECT {value_col} FROM {table} WHERE {key_col}=?", (key,)).fetchone()  # noqa: S608
+        if result is None:
+            return None
+        self._touch(table, [key])
+        return result[0]
+
+    def _get_many(self, table: str, keys: list[str]) -> dict[str, str | bytes]:
+        conn = self.conn
+        with self._lock:
+            found = {key: self._pending[table][key] for key in keys if key in self._pending[table]}
+        key_col, value_col = self._TABLES[table]
+        missing_keys = list({key for key in keys if key not in found})
+        for i in range(0, len(missing_keys), self._MAX_SQL_VARIABLES):
+            sliced_keys = missing_keys[i : i + self._MAX_SQL_VARIABLES]
+            sliced_found = conn.execute(
+                f"SELECT {key_col}, {value_col} FROM {table} "  # noqa: S608
+                f"WHERE {key_col} IN ({','.join('?' * len(sliced_keys))})",
+                sliced_keys,
+            ).fetchall()
+            self._touch(table, [key for key, _ in sliced_found])
+            found.update(sliced_found)
+        return found
+
+    def _set(self, table: str, items: dict[str, str | bytes]) -> None:
+        self.conn  # noqa: B018 make sure the pending writes belong to the current process
+        with self._lock:
+            self._pending[table].update(items)
+            self._pending_n += len(items)
+            self._maybe_flush()
+
+    def _maybe_flush(self) -> None:
+        if (
+            self._pending_n >= LLM_SETTINGS.prompt_cache_commit_batch_size
+            or time.monotonic() - self._last_flush_time >= LLM_SETTINGS.prompt_cache_commit_interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            # the pending writes inherited by a forked child are committed by the parent.
+            if self._pid == os.getpid() and self._pending_n > 0:
+                now = time.time()
+                conn = self.conn
+                with conn:  # commit all the pending writes in one transaction
+                    for table, items in self._pending.items():
+                        key_col, value_col = self._TABLES[table]
+                        conn.executemany(
+                            f"INSERT OR REPLACE INTO {table} ({key_col}, {value_col}, last_access) "  # noqa: S608
+                            "VALUES (?, ?, ?)",
+                            [(key, value, now) for key, value in items.items()],
+                        )
+                        items.clear()
+                    for table, accessed in self._pending_access.items():
+                        conn.executemany(
+                            f"UPDATE {table} SET last_access=? WHERE {self._TABLES[table][0]}=?",  # noqa: S608
+                            [(access_time, key) for key, access_time in accessed.items()],
+                        )
+                        accessed.clear()
+                self._pending_n = 0
+            self._last_flush_time = time.monotonic()
+
+    def chat_get(self, key: str) -> str | None:
+        return self._get("chat_cache", md5_hash(key))
+
+    def embedding_get_many(self, keys: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        md5_keys = [md5_hash(key) for key in keys]
+        found = self._get_many("embedding_cache", md5_keys)
+        return _stack_embeddings([found.get(md5_key) for md5_key in md5_keys])
+
+    def chat_set(self, key: str, value: str) -> None:
+        self._set("chat_cache", {md5_hash(key): value})
+
+    def embedding_set(self, content_to_embedding_dict: dict) -> None:
+        self._set(
+            "embedding_cache",
+            {md5_hash(key): _encode_embedding(value) for key, value in content_to_embedding_dict.items()},
+        )
+
+    def _migrate_legacy_messages(self, conn: sqlite3.Connection, conversation_id: str) -> None:
+        """Move the conversation stored as a whole in `message_cache` to `session_message_cache`."""
+        result = conn.execute(
+            "SELECT message FROM message_cache WHERE conversation_id=?", (conversation_id,)
+        ).fetchone()
+        if result is not None:
+            conn.executemany(
+                "INSERT OR REPLACE INTO session_message_cache (conversation_id, idx, message, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                [(conversation_id, idx, json.dumps(m), time.time()) for idx, m in enumerate(json.loads(result[0]))],
             )
-            self.c.execute(
-                """
-                CREATE TABLE embedding_cache (
-                    md5_key TEXT PRIMARY KEY,
-                    embedding TEXT
-                )
-                """,
+            conn.execute("DELETE FROM message_cache WHERE conversation_id=?", (conversation_id,))
+
+    def message_get(self, conversation_id: str) -> list[str]:
+        conn = self.conn
+        with conn:
+            self._migrate_legacy_messages(conn, conversation_id)
+        rows = conn.execute(
+            "SELECT message FROM session_message_cache WHERE conversation_id=? ORDER BY idx", (conversation_id,)
+        ).fetchall()
+        if rows:
+            self._touch("session_message_cache", [conversation_id])
+        return [json.loads(row[0]) for row in rows]
+
+    def message_set(self, conversation_id: str, message_value: list[str]) -> None:
+        conn = self.conn
+        with conn:
+            conn.execute("DELETE FROM message_cache WHERE conversation_id=?", (conversation_id,))
+            conn.execute("DELETE FROM session_message_cache WHERE conversation_id=?", (conversation_id,))
+            conn.executemany(
+                "INSERT INTO session_message_cache (conversation_id, idx, message, last_access) VALUES (?, ?, ?, ?)",
+                [(conversation_id, idx, json.dumps(m), time.time()) for idx, m in enumerate(message_value)],
             )
-            self.c.execute(
-                """
-                CREATE TABLE message_cache (
-                    conversation_id TEXT PRIMARY KEY,
-                    message TEXT
+
+    def message_append(self, conversation_id: str, new_messages: list[str]) -> None:
+        conn = self.conn
+        with conn:
+            self._migrate_legacy_messages(conn, conversation_id)
+            start_idx = conn.execute(
+                "SELECT COALESCE(MAX(idx) + 1, 0) FROM session_message_cache WHERE conversation_id=?",
+                (conversation_id,),
+            ).fetchone()[0]
+            conn.executemany(
+                "INSERT INTO session_message_cache (conversation_id, idx, message, last_access) VALUES (?, ?, ?, ?)",
+                [(conversation_id, start_idx + i, json.dumps(m), time.time()) for i, m in enumerate(new_messages)],
+            )
+
+    def _size_query(self, table: str) -> str:
+        """The query of (key, bytes, last_access) of the records; a conversation is a record as a whole."""
+        key_col, value_col = self._TABLES[table]
+        return (
+            f"SELECT '{table}', {key_col}, SUM(LENGTH(CAST({value_col} AS BLOB))), MAX(last_access) "  # noqa: S608
+            f"FROM {table} GROUP BY {key_col}"
+        )
+
+    def prune(self, ttl_seconds: float | None = None, max_bytes: int | None = None) -> int:
+        self.flush()
+        conn = self.conn
+        removed_n = 0
+        with conn:
+            if ttl_seconds is not None:
+                expire_time = time.time() - ttl_seconds
+                for table, (key_col, _) in self._TABLES.items():
+                    removed_n += conn.execute(
+                        f"DELETE FROM {table} WHERE {key_col} IN "  # noqa: S608
+                        f"(SELECT {key_col} FROM {table} GROUP BY {key_col} HAVING MAX(last_access) < ?)",
+                        (expire_time,),
+                    ).rowcount
+            if max_bytes is not None:
+                # keep the most recently used records within the budget
+                records = conn.execute(
+                    " UNION ALL ".join(self._size_query(table) for table in self._TABLES) + " ORDER BY 4 DESC"
                 )
-                """,
+                total_bytes = 0
+                to_remove: dict[str, list[tuple[str]]] = {table: [] for table in self._TABLES}
+                for table, key, size, _ in records:
+                    total_bytes += size or 0
+                    if total_bytes > max_bytes:
+                        to_remove[table].append((key,))
+                for table, keys in to_remove.items():
+                    conn.executemany(f"DELETE FROM {table} WHERE {self._TABLES[table][0]}=?", keys)  # noqa: S608
+                    removed_n += len(keys)
+        return removed_n
+
+    def vacuum(self) -> None:
+        self.flush()
+        conn = self.conn
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("VACUUM")
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        self.flush()
+        conn = self.conn
+        stats = {}
+        for table, (key_col, value_col) in self._TABLES.items():
+            count, total_bytes, oldest, newest = conn.execute(
+                f"SELECT COUNT(DISTINCT {key_col}), SUM(LENGTH(CAST({value_col} AS BLOB))), "  # noqa: S608
+                f"MIN(last_access), MAX(last_access) FROM {table}"
+            ).fetchone()
+            stats[table] = {
+                "count": count,
+                "bytes": total_bytes or 0,
+                "oldest_access": oldest,
+                "newest_access": newest,
+            }
+        stats["file"] = {
+            "bytes": sum(
+                Path(f"{self.cache_location}{suffix}").stat().st_size
+                for suffix in ["", "-wal", "-shm"]
+                if Path(f"{self.cache_location}{suffix}").exists()
             )
-            self.conn.commit()
+        }
+        return stats
 
-    def chat_get(self, key: str) -> str | None:
-        md5_key = md5_hash(key)
-        self.c.execute("SELECT chat FROM chat_cache WHERE md5_key=?", (md5_key,))
-        result = self.c.fetchone()
-        if result is None:
-            return None
-        return result[0]
 
-    def embedding_get(self, key: str) -> list | dict | str | None:
-        md5_key = md5_hash(key)
-        self.c.execute("SELECT embedding FROM embedding_cache WHERE md5_key=?", (md5_key,))
-        result = self.c.fetchone()
-        if result is None:
+class FileLazyCache(LLMCacheBase, SingletonBaseClass):
+    """
+    The directory-sharded backend of the LLM cache.
+
+    Every record is a file at `<cache_location>/<table>/<key[:2]>/<key>`.
+    A record is written to a temporary file and renamed, which is atomic, so any number of
+    processes can read and write the cache without locking.
+    The modification time of a record is refreshed when it is read, so it is the last access time.
+    A conversation is a json lines file and new messages are appended to it.
+    """
+
+    _TABLES = ("chat_cache", "embedding_cache", "message_cache")
+
+    def __init__(self, cache_location: str) -> None:
+        if getattr(self, "_initialized", False):
+            return
+        super().__init__()
+        self.cache_location = Path(cache_location)
+        self._initialized = True
+        self._auto_prune()
+
+    def _path(self, table: str, key: str) -> Path:
+        return self.cache_location / table / key[:2] / key
+
+    def _get(self, table: str, key: str) -> bytes | None:
+        path = self._path(table, key)
+        try:
+            value = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
             return None
-        return json.loads(result[0])
+        return value
+
+    def _set(self, table: str, key: str, value: bytes) -> None:
+        path = self._path(table, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(value)
+        tmp_path.replace(path)
+
+    def chat_get(self, key: str) -> str | None:
+        result = self._get("chat_cache", md5_hash(key))
+        return None if result is None else result.decode("utf-8")
+
+    def embedding_get_many(self, keys: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        return _stack_embeddings([self._get("embedding_cache", md5_hash(key)) for key in keys])
 
     def chat_set(self, key: str, value: str) -> None:
-        md5_key = md5_hash(key)
-        self.c.execute(
-            "INSERT OR REPLACE INTO chat_cache (md5_key, chat) VALUES (?, ?)",
-            (md5_key, value),
-        )
-        self.conn.commit()
+        self._set("chat_cache", md5_hash(key), value.encode("utf-8"))
 
     def embedding_set(self, content_to_embedding_dict: dict) -> None:
         for key, value in content_to_embedding_dict.items():
-            md5_key = md5_hash(key)
-            self.c.execute(
-                "INSERT OR REPLACE INTO embedding_cache (md5_key, embedding) VALUES (?, ?)",
-                (md5_key, json.dumps(value)),
-            )
-        self.conn.commit()
+            self._set("embedding_cache", md5_hash(key), _encode_embedding(value))
 
     def message_get(self, conversation_id: str) -> list[str]:
-        self.c.execute("SELECT message FROM message_cache WHERE conversation_id=?", (conversation_id,))
-        result = self.c.fetchone()
-        if result is None:
-            return []
-        return json.loads(result[0])
+        result = self._get("message_cache", conversation_id)
+        return [] if result is None else [json.loads(line) for line in result.decode("utf-8").splitlines()]
 
     def message_set(self, conversation_id: str, message_value: list[str]) -> None:
-        self.c.execute(
-            "INSERT OR REPLACE INTO message_cache (conversation_id, message) VALUES (?, ?)",
-            (conversation_id, json.dumps(message_value)),
+        self._set(
+            "message_cache",
+            conversation_id,
+            "".join(json.dumps(m) + "\n" for m in message_value).encode("utf-8"),
+        )
+
+    def message_append(self, conversation_id: str, new_messages: list[str]) -> None:
+        path = self._path("message_cache", conversation_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(m) + "\n" for m in new_messages))
+
+    def _records(self, table: str) -> list[os.DirEntry]:
+        table_path = self.cache_location / table
+        if not table_path.exists():
+            return []
+        return [
+            entry
+            for shard in os.scandir(table_path)
+            if shard.is_dir()
+            for entry in os.scandir(shard.path)
+            if entry.is_file() and not entry.name.endswith(".tmp")
+        ]
+
+    def prune(self, ttl_seconds: float | None = None, max_bytes: int | None = None) -> int:
+        records = sorted(
+            (
+                (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                for t in self._TABLES
+                for entry in self._records(t)
+            ),
+            reverse=True,
         )
-        self.conn.commit()
+        expire_time = -np.inf if ttl_seconds is None else time.time() - ttl_seconds
+        total_bytes = 0
+        removed_n = 0
+        for mtime, size, path in records:
+            total_bytes += size
+            if mtime < expire_time or (max_bytes is not None and total_bytes > max_bytes):
+                Path(path).unlink(missing_ok=True)
+                removed_n += 1
+        return removed_n
+
+    def vacuum(self) -> None:
+        """Remove the temporary files left by crashed writers and the empty shard folders."""
+        for table in self._TABLES:
+            table_path = self.cache_location / table
+            if not table_path.exists():
+                continue
+            for shard in table_path.iterdir():
+                for tmp_path in shard.glob("*.tmp"):
+                    if time.time() - tmp_path.stat().st_mtime > 3600:  # noqa: PLR2004
+                        tmp_path.unlink(missing_ok=True)
+                if not any(shard.iterdir()):
+                    shard.rmdir()
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        stats = {}
+        for table in self._TABLES:
+            entry_stats = [entry.stat() for entry in self._records(table)]
+            stats[table] = {
+                "count": len(entry_stats),
+                "bytes": sum(s.st_size for s in entry_stats),
+                "oldest_access": min((s.st_mtime for s in entry_stats), default=None),
+                "newest_access": max((s.st_mtime for s in entry_stats), default=None),
+            }
+        return stats
+
+
+def get_llm_cache(cache_location: str | None = None) -> LLMCacheBase:
+    """Get the LLM cache of the backend selected by `LLM_SETTINGS.prompt_cache_backend`."""
+    cache_location = LLM_SETTINGS.prompt_cache_path if cache_location is None else cache_location
+    if LLM_SETTINGS.prompt_cache_backend == "sqlite":
+        return SQliteLazyCache(cache_location=cache_location)
+    if LLM_SETTINGS.prompt_cache_backend == "file":
+        return FileLazyCache(cache_location=cache_location)
+    error_message = f"Invalid prompt_cache_backend: {LLM_SETTINGS.prompt_cache_backend}"
+    raise ValueError(error_message)
 
 
 class SessionChatHistoryCache(SingletonBaseClass):
     def __init__(self) -> None:
         """load all history conversation json file from self.session_cache_location"""
-        self.cache = SQliteLazyCache(cache_location=LLM_SETTINGS.prompt_cache_path)
+        self.cache = get_llm_cache()
 
     def message_get(self, conversation_id: str) -> list[str]:
         return self.cache.message_get(conversation_id)
@@ -179,6 +682,9 @@ class SessionChatHistoryCache(SingletonBaseClass):
     def message_set(self, conversation_id: str, message_value: list[str]) -> None:
         self.cache.message_set(conversation_id, message_value)
 
+    def message_append(self, conversation_id: str, new_messages: list[str]) -> None:
+        self.cache.message_append(conversation_id, new_messages)
+
 
 class ChatSession:
     def __init__(self, api_backend: Any, conversation_id: str | None = None, system_prompt: str | None = None) -> None:
@@ -186,8 +692,10 @@ class ChatSession:
         self.system_prompt = system_prompt if system_prompt is not None else LLM_SETTINGS.default_system_prompt
         self.api_backend = api_backend
 
-    def build_chat_completion_message(self, user_prompt: str) -> list[dict[str, Any]]:
+    def _build_chat_completion_message(self, user_prompt: str) -> tuple[list[dict[str, Any]], int]:
+        """Build the messages and return the number of messages already stored in the history as well."""
         history_message = SessionChatHistoryCache().message_get(self.conversation_id)
+        history_len = len(history_message)
         messages = history_message
         if not messages:
             messages.append({"role": "system", "content": self.system_prompt})
@@ -197,7 +705,10 @@ class ChatSession:
                 "content": user_prompt,
             },
         )
-        return messages
+        return messages, history_len
+
+    def build_chat_completion_message(self, user_prompt: str) -> list[dict[str, Any]]:
+        return self._build_chat_completion_message(user_prompt)[0]
 
     def build_chat_completion_message_and_calculate_token(self, user_prompt: str) -> Any:
         messages = self.build_chat_completion_message(user_prompt)
@@ -208,7 +719,7 @@ class ChatSession:
         this function is to build the session messages
         user prompt should always be provided
         """
-        messages = self.build_chat_completion_message(user_prompt)
+        messages, history_len = self._build_chat_completion_message(user_prompt)
 
         with logger.tag(f"session_{self.conversation_id}"):
             response = self.api_backend._try_create_chat_completion_or_embedding(  # noqa: SLF001
@@ -223,7 +734,7 @@ class ChatSession:
                 "content": response,
             },
         )
-        SessionChatHistoryCache().message_set(self.conversation_id, messages)
+        SessionChatHistoryCache().message_append(self.conversation_id, messages[history_len:])
         return response
 
     def get_conversation_id(self) -> str:
@@ -234,6 +745,241 @@ class ChatSession:
         pass
 
 
+_CHAT_MODEL_TAG: ContextVar[str | None] = ContextVar("chat_model_tag", default=None)
+
+
+@contextmanager
+def chat_model_tag(tag: str) -> Iterator[None]:
+    """
+    Route the chat completions created in the context to the model of `tag` in `chat_model_map`.
+
+    .. code-block:: python
+
+        with chat_model_tag("FactorCodeEvaluator"):
+            APIBackend().build_messages_and_create_chat_completion(...)
+
+    It is based on ContextVar, so it also applies to the asyncio tasks created in the context.
+    """
+    token = _CHAT_MODEL_TAG.set(tag)
+    try:
+        yield
+    finally:
+        _CHAT_MODEL_TAG.reset(token)
+
+
+def _get_caller_tag(depth: int) -> str | None:
+    """
+    The class name (or the function name if it is not a method) of the frame `depth` levels above the caller.
+    `sys._getframe` only walks the frame chain, while `inspect.stack()` reads the source context of every frame.
+    """
+    try:
+        frame = sys._getframe(depth + 1)  # noqa: SLF001
+    except ValueError:  # the call stack is not deep enough
+        return None
+    caller_self = frame.f_locals.get("self")
+    return frame.f_code.co_name if caller_self is None else caller_self.__class__.__name__
+
+
+class _TokenizerCache:
+    """
+    The tokenizer states shared by all the `APIBackend` instances of the process.
+    - The encoder of each model is only loaded once.
+    - The token counts are cached by the md5 hash of the content, so the segments repeated across the calls
+      (e.g. the system prompt and the former messages) are only tokenized once.
+    """
+
+    max_cached_counts: int = 4096
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.encoders: dict[str, tiktoken.Encoding] = {}
+        self._counts: OrderedDict[tuple[str, str], int] = OrderedDict()
+
+    def count(self, encoder: tiktoken.Encoding, content: str) -> int:
+        key = (encoder.name, md5_hash(content))
+        with self._lock:
+            if key in self._counts:
+                self._counts.move_to_end(key)
+                return self._counts[key]
+        num_tokens = len(encoder.encode(content))
+        with self._lock:
+            self._counts[key] = num_tokens
+            if len(self._counts) > self.max_cached_counts:
+                self._counts.popitem(last=False)
+        return num_tokens
+
+
+_TOKENIZER_CACHE = _TokenizerCache()
+
+
+class _IncrementalJSONParser:
+    """
+    Parse a json document chunk by chunk while it is streamed.
+    It only tracks the strings and the nesting of the containers, so it is cheap enough to be fed every chunk;
+    the complete document is validated by `json.loads`.
+    """
+
+    def __init__(self) -> None:
+        self._chunks: list[str] = []
+        self._stack: list[str] = []
+        self._in_string = False
+        self._escape = False
+        self.complete = False
+
+    @property
+    def doc(self) -> str:
+        return "".join(self._chunks)
+
+    def _error(self, msg: str, offset: int) -> json.JSONDecodeError:
+        doc = self.doc
+        return json.JSONDecodeError(msg, doc, len(doc) - offset)
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Returns True once the document is complete.
+        Raises json.JSONDecodeError as soon as the received text can't be the prefix of a json object or array.
+        """
+        self._chunks.append(chunk)
+        for i, char in enumerate(chunk):
+            if self.complete:
+                if not char.isspace():
+                    raise self._error("Extra data", len(chunk) - i)
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char in "{[":
+                self._stack.append("}" if char == "{" else "]")
+            elif char in "}]":
+                if not self._stack or self._stack.pop() != char:
+                    raise self._error(f"Unexpected {char!r}", len(chunk) - i)
+                if not self._stack:
+                    doc = self.doc
+                    json.loads(doc[: len(doc) - len(chunk) + i + 1])
+                    self.complete = True
+            elif not self._stack:
+                if not char.isspace():
+                    raise self._error("Expecting an object or an array", len(chunk) - i)
+            elif char == '"':
+                self._in_string = True
+        return self.complete
+
+
+class _ChatStream:
+    """
+    The state of a streamed chat completion.
+    - `stop(response received so far)` aborts the stream once it is True (e.g. a complete code block is received).
+    - In json mode, the response is parsed incrementally, so a malformed response fails (and can be retried) as soon
+      as it goes wrong, and the stream ends once the json document is complete.
+    """
+
+    def __init__(self, *, json_mode: bool = False, stop: Callable[[str], bool] | None = None) -> None:
+        self.resp = ""
+        self.finish_reason: str | None = None
+        self.stopped = False
+        self._stop = stop
+        self._json_parser = _IncrementalJSONParser() if json_mode else None
+
+    def feed(self, content: str, finish_reason: str | None) -> bool:
+        """Returns True if the rest of the stream should be dropped."""
+        self.resp += content
+        if finish_reason is not None:
+            self.finish_reason = finish_reason
+        if self._json_parser is not None and self._json_parser.feed(content):
+            self.finish_reason = "stop"
+            return True
+        if self._stop is not None and self._stop(self.resp):
+            self.finish_reason = "stop"
+            self.stopped = True
+            return True
+        return False
+
+    def validate(self) -> None:
+        """Raise json.JSONDecodeError if the complete response is not a json document in json mode."""
+        if self._json_parser is not None and not self.stopped and not self._json_parser.complete:
+            json.loads(self.resp)
+
+
+class _TokenBucket:
+    """
+    A token bucket limiting the request rate of a model in the async APIs.
+    It holds no asyncio primitive, so the same bucket is shared by all the event loops in the process.
+    """
+
+    def __init__(self, rpm: float) -> None:
+        self.rate = rpm / 60.0  # tokens per second
+        self.capacity = max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _try_acquire(self) -> float:
+        """Take a token and return 0, or return the seconds to wait until a token is available."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    async def acquire(self) -> None:
+        while (wait_seconds := self._try_acquire()) > 0:
+            await asyncio.sleep(wait_seconds)
+
+
+class _AsyncLLMRuntime:
+    """
+    The states shared by all the async requests issued from one event loop.
+    - A semaphore capping the number of in-flight requests (`async_max_concurrency`).
+    - The async clients, which are reused instead of being created for every `APIBackend()`.
+
+    asyncio primitives and http connections are bound to a loop, so a runtime is kept per loop.
+    The rate limiters are process-wide.
+    """
+
+    _runtimes: ClassVar[weakref.WeakKeyDictionary] = weakref.WeakKeyDictionary()
+    _buckets: ClassVar[dict[str, _TokenBucket | None]] = {}
+    _buckets_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    def __init__(self) -> None:
+        self.semaphore = asyncio.Semaphore(LLM_SETTINGS.async_max_concurrency)
+        self.clients: dict[tuple, Any] = {}
+
+    @classmethod
+    def get(cls) -> _AsyncLLMRuntime:
+        loop = asyncio.get_running_loop()
+        if loop not in cls._runtimes:
+            cls._runtimes[loop] = cls()
+        return cls._runtimes[loop]
+
+    @classmethod
+    def get_bucket(cls, model: str) -> _TokenBucket | None:
+        with cls._buckets_lock:
+            if model not in cls._buckets:
+                rpm = json.loads(LLM_SETTINGS.async_rate_limit_map).get(model, LLM_SETTINGS.async_rate_limit_rpm)
+                cls._buckets[model] = None if rpm is None else _TokenBucket(rpm)
+            return cls._buckets[model]
+
+    def get_client(self, key: tuple, client_factory: Callable[[], Any]) -> Any:
+        if key not in self.clients:
+            self.clients[key] = client_factory()
+        return self.clients[key]
+
+    @asynccontextmanager
+    async def slot(self, model: str) -> AsyncIterator[None]:
+        """Wait for both a free concurrency slot and a rate limit token of `model`."""
+        bucket = self.get_bucket(model)
+        async with self.semaphore:
+            if bucket is not None:
+                await bucket.acquire()
+            yield
+
+
 class APIBackend:
     """
     This is a unified interface for different backends.
@@ -356,33 +1102,37 @@ class APIBackend:
                         "https://cognitiveservices.azure.com/.default",
                     )
                 if self.chat_use_azure_token_provider:
-                    self.chat_client = openai.AzureOpenAI(
-                        azure_ad_token_provider=token_provider,
-                        api_version=self.chat_api_version,
-                        azure_endpoint=self.chat_api_base,
-                    )
+                    self.chat_client_kwargs = {
+                        "azure_ad_token_provider": token_provider,
+                        "api_version": self.chat_api_version,
+                        "azure_endpoint": self.chat_api_base,
+                    }
                 else:
-                    self.chat_client = openai.AzureOpenAI(
-                        api_key=self.chat_api_key,
-                        api_version=self.chat_api_version,
-                        azure_endpoint=self.chat_api_base,
-                    )
+                    self.chat_client_kwargs = {
+                        "api_key": self.chat_api_key,
+                        "api_version": self.chat_api_version,
+                        "azure_endpoint": self.chat_api_base,
+                    }
 
                 if self.embedding_use_azure_token_provider:
-                    self.embedding_client = openai.AzureOpenAI(
-                        azure_ad_token_provider=token_provider,
-                        api_version=self.embedding_api_version,
-                        azure_endpoint=self.embedding_api_base,
-                    )
+                    self.embedding_client_kwargs = {
+                        "azure_ad_token_provider": token_provider,
+                        "api_version": self.embedding_api_version,
+                        "azure_endpoint": self.embedding_api_base,
+                    }
                 else:
-                    self.embedding_client = openai.AzureOpenAI(
-                        api_key=self.embedding_api_key,
-                        api_version=self.embedding_api_version,
-                        azure_endpoint=self.embedding_api_base,
-                    )
+                    self.embedding_client_kwargs = {
+                        "api_key": self.embedding_api_key,
+                        "api_version": self.embedding_api_version,
+                        "azure_endpoint": self.embedding_api_base,
+                    }
+                self.chat_client = openai.AzureOpenAI(**self.chat_client_kwargs)
+                self.embedding_client = openai.AzureOpenAI(**self.embedding_client_kwargs)
             else:
-                self.chat_client = openai.OpenAI(api_key=self.chat_api_key)
-                self.embedding_client = openai.OpenAI(api_key=self.embedding_api_key)
+                self.chat_client_kwargs = {"api_key": self.chat_api_key}
+                self.embedding_client_kwargs = {"api_key": self.embedding_api_key}
+                self.chat_client = openai.OpenAI(**self.chat_client_kwargs)
+                self.embedding_client = openai.OpenAI(**self.embedding_client_kwargs)
 
         self.dump_chat_cache = LLM_SETTINGS.dump_chat_cache if dump_chat_cache is None else dump_chat_cache
         self.use_chat_cache = LLM_SETTINGS.use_chat_cache if use_chat_cache is None else use_chat_cache
@@ -394,7 +1144,7 @@ class APIBackend:
         )
         if self.dump_chat_cache or self.use_chat_cache or self.dump_embedding_cache or self.use_embedding_cache:
             self.cache_file_location = LLM_SETTINGS.prompt_cache_path
-            self.cache = SQliteLazyCache(cache_location=self.cache_file_location)
+            self.cache = get_llm_cache(self.cache_file_location)
 
         # transfer the config to the class if the config is not supposed to change during the runtime
         self.use_llama2 = LLM_SETTINGS.use_llama2
@@ -417,16 +1167,20 @@ class APIBackend:
             return model.replace("_", "-")
 
         model = self.chat_model
+        if model in _TOKENIZER_CACHE.encoders:
+            return _TOKENIZER_CACHE.encoders[model]
         try:
-            return tiktoken.encoding_for_model(model)
+            encoder = tiktoken.encoding_for_model(model)
         except KeyError:
             logger.warning(f"Failed to get encoder. Trying to patch the model name")
             for patch_func in [_azure_patch]:
                 try:
-                    return tiktoken.encoding_for_model(patch_func(model))
+                    encoder = tiktoken.encoding_for_model(patch_func(model))
                 except KeyError:
                     logger.error(f"Failed to get encoder even after patching with {patch_func.__name__}")
                     raise
+        _TOKENIZER_CACHE.encoders[model] = encoder
+        return encoder
 
     def build_chat_session(
         self,
@@ -508,6 +1262,67 @@ class APIBackend:
             embedding=True,
             **kwargs,
         )
+        resp = [embedding.tolist() if isinstance(embedding, np.ndarray) else embedding for embedding in resp]
+        if isinstance(input_content, str):
+            return resp[0]
+        return resp
+
+    def create_embedding_array(self, input_content_list: list[str], **kwargs: Any) -> np.ndarray:
+        """
+        Create the embeddings of `input_content_list` as a float32 matrix (one row per content).
+        The cached embeddings are fetched in bulk and kept as arrays instead of being converted to lists.
+        """
+        if not input_content_list:
+            return np.empty((0, 0), dtype=np.float32)
+        resp = self._try_create_chat_completion_or_embedding(
+            input_content_list=input_content_list,
+            embedding=True,
+            **kwargs,
+        )
+        return np.asarray(resp, dtype=np.float32)
+
+    async def async_build_messages_and_create_chat_completion(
+        self,
+        user_prompt: str,
+        system_prompt: str | None = None,
+        former_messages: list | None = None,
+        chat_cache_prefix: str = "",
+        *,
+        shrink_multiple_break: bool = False,
+        **kwargs: Any,
+    ) -> str:
+        """
+        The async version of `build_messages_and_create_chat_completion`.
+
+        Many completions can be drafted concurrently from one process, e.g.
+        `await asyncio.gather(*[api.async_build_messages_and_create_chat_completion(p) for p in prompts])`.
+        The number of in-flight requests and the request rate of each model are limited by
+        `async_max_concurrency`, `async_rate_limit_rpm` and `async_rate_limit_map` in LLM_SETTINGS.
+        """
+        if former_messages is None:
+            former_messages = []
+        messages = self.build_messages(
+            user_prompt,
+            system_prompt,
+            former_messages,
+            shrink_multiple_break=shrink_multiple_break,
+        )
+        return await self._async_try_create_chat_completion_or_embedding(
+            messages=messages,
+            chat_completion=True,
+            chat_cache_prefix=chat_cache_prefix,
+            **kwargs,
+        )
+
+    async def async_create_embedding(self, input_content: str | list[str], **kwargs: Any) -> list[Any] | Any:
+        """The async version of `create_embedding`. The batches of a long input list are requested concurrently."""
+        input_content_list = [input_content] if isinstance(input_content, str) else input_content
+        resp = await self._async_try_create_chat_completion_or_embedding(
+            input_content_list=input_content_list,
+            embedding=True,
+            **kwargs,
+        )
+        resp = [embedding.tolist() if isinstance(embedding, np.ndarray) else embedding for embedding in resp]
         if isinstance(input_content, str):
             return resp[0]
         return resp
@@ -520,18 +1335,43 @@ class APIBackend:
         response, finish_reason = self._create_chat_completion_inner_function(messages=messages, **kwargs)
 
         if finish_reason == "length":
-            new_message = deepcopy(messages)
-            new_message.append({"role": "assistant", "content": response})
-            new_message.append(
-                {
-                    "role": "user",
-                    "content": "continue the former output with no overlap",
-                },
-            )
+            new_message = self._build_continue_messages(messages, response)
             new_response, finish_reason = self._create_chat_completion_inner_function(messages=new_message, **kwargs)
             return response + new_response
         return response
 
+    async def _async_create_chat_completion_auto_continue(self, messages: list, **kwargs: dict) -> str:
+        response, finish_reason = await self._async_create_chat_completion_inner_function(messages=messages, **kwargs)
+
+        if finish_reason == "length":
+            new_message = self._build_continue_messages(messages, response)
+            new_response, finish_reason = await self._async_create_chat_completion_inner_function(
+                messages=new_message, **kwargs
+            )
+            return response + new_response
+        return response
+
+    @staticmethod
+    def _build_continue_messages(messages: list, response: str) -> list:
+        new_message = deepcopy(messages)
+        new_message.append({"role": "assistant", "content": response})
+        new_message.append(
+            {
+                "role": "user",
+                "content": "continue the former output with no overlap",
+            },
+        )
+        return new_message
+
+    def _handle_bad_request_error(self, e: Exception, kwargs: dict, *, embedding: bool) -> None:
+        """Adjust the kwargs of the next retry according to the BadRequestError."""
+        if "'messages' must contain the word 'json' in some form" in e.message:
+            kwargs["add_json_in_prompt"] = True
+        elif embedding and "maximum context length" in e.message:
+            kwargs["input_content_list"] = [
+                content[: len(content) // 2] for content in kwargs.get("input_content_list", [])
+            ]
+
     def _try_create_chat_completion_or_embedding(
         self,
         max_retry: int = 10,
@@ -551,12 +1391,7 @@ class APIBackend:
             except openai.BadRequestError as e:  # noqa: PERF203
                 logger.warning(e)
                 logger.warning(f"Retrying {i+1}th time...")
-                if "'messages' must contain the word 'json' in some form" in e.message:
-                    kwargs["add_json_in_prompt"] = True
-                elif embedding and "maximum context length" in e.message:
-                    kwargs["input_content_list"] = [
-                        content[: len(content) // 2] for content in kwargs.get("input_content_list", [])
-                    ]
+                self._handle_bad_request_error(e, kwargs, embedding=embedding)
             except Exception as e:  # noqa: BLE001
                 logger.warning(e)
                 logger.warning(f"Retrying {i+1}th time...")
@@ -564,43 +1399,115 @@ class APIBackend:
         error_message = f"Failed to create chat completion after {max_retry} retries."
         raise RuntimeError(error_message)
 
-    def _create_embedding_inner_function(
-        self, input_content_list: list[str], **kwargs: Any
-    ) -> list[Any]:  # noqa: ARG002
+    async def _async_try_create_chat_completion_or_embedding(
+        self,
+        max_retry: int = 10,
+        *,
+        chat_completion: bool = False,
+        embedding: bool = False,
+        **kwargs: Any,
+    ) -> Any:
+        assert not (chat_completion and embedding), "chat_completion and embedding cannot be True at the same time"
+        max_retry = LLM_SETTINGS.max_retry if LLM_SETTINGS.max_retry is not None else max_retry
+        for i in range(max_retry):
+            try:
+                if embedding:
+                    return await self._async_create_embedding_inner_function(**kwargs)
+                if chat_completion:
+                    return await self._async_create_chat_completion_auto_continue(**kwargs)
+            except openai.BadRequestError as e:  # noqa: PERF203
+                logger.warning(e)
+                logger.warning(f"Retrying {i+1}th time...")
+                self._handle_bad_request_error(e, kwargs, embedding=embedding)
+            except Exception as e:  # noqa: BLE001
+                logger.warning(e)
+                logger.warning(f"Retrying {i+1}th time...")
+                await asyncio.sleep(self.retry_wait_seconds)
+        error_message = f"Failed to create chat completion after {max_retry} retries."
+        raise RuntimeError(error_message)
+
+    def _split_embedding_input(self, input_content_list: list[str]) -> tuple[dict, list[list[str]]]:
+        """
+        Look up the embedding cache and split the contents that are not cached into batches.
+
+        Returns
+        -------
+        tuple[dict, list[list[str]]]
+            the cached content to embedding (float32 array) dict, and the batches to request.
+        """
         content_to_embedding_dict = {}
         filtered_input_content_list = []
         if self.use_embedding_cache:
-            for content in input_content_list:
-                cache_result = self.cache.embedding_get(content)
-                if cache_result is not None:
-                    content_to_embedding_dict[content] = cache_result
-                else:
-                    filtered_input_content_list.append(content)
+            hit_mask, cached_embeddings = self.cache.embedding_get_many(input_content_list)
+            hit_contents = [content for content, hit in zip(input_content_list, hit_mask) if hit]
+            content_to_embedding_dict = dict(zip(hit_contents, cached_embeddings))
+            filtered_input_content_list = [content for content, hit in zip(input_content_list, hit_mask) if not hit]
         else:
             filtered_input_content_list = input_content_list
+        return content_to_embedding_dict, [
+            filtered_input_content_list[i : i + LLM_SETTINGS.embedding_max_str_num]
+            for i in range(0, len(filtered_input_content_list), LLM_SETTINGS.embedding_max_str_num)
+        ]
 
-        if len(filtered_input_content_list) > 0:
-            for sliced_filtered_input_content_list in [
-                filtered_input_content_list[i : i + LLM_SETTINGS.embedding_max_str_num]
-                for i in range(0, len(filtered_input_content_list), LLM_SETTINGS.embedding_max_str_num)
-            ]:
-                if self.use_azure:
-                    response = self.embedding_client.embeddings.create(
-                        model=self.embedding_model,
-                        input=sliced_filtered_input_content_list,
-                    )
-                else:
-                    response = self.embedding_client.embeddings.create(
-                        model=self.embedding_model,
-                        input=sliced_filtered_input_content_list,
-                    )
-                for index, data in enumerate(response.data):
-                    content_to_embedding_dict[sliced_filtered_input_content_list[index]] = data.embedding
+    def _create_embedding_inner_function(
+        self, input_content_list: list[str], **kwargs: Any
+    ) -> list[Any]:  # noqa: ARG002
+        content_to_embedding_dict, sliced_input_content_lists = self._split_embedding_input(input_content_list)
+
+        for sliced_filtered_input_content_list in sliced_input_content_lists:
+            response = self.embedding_client.embeddings.create(
+                model=self.embedding_model,
+                input=sliced_filtered_input_content_list,
+            )
+            new_content_to_embedding_dict = {
+                sliced_filtered_input_content_list[index]: data.embedding for index, data in enumerate(response.data)
+            }
+            content_to_embedding_dict.update(new_content_to_embedding_dict)
+
+            if self.dump_embedding_cache:
+                self.cache.embedding_set(new_content_to_embedding_dict)
+        return [content_to_embedding_dict[content] for content in input_content_list]
 
-                if self.dump_embedding_cache:
-                    self.cache.embedding_set(content_to_embedding_dict)
+    async def _async_create_embedding_inner_function(
+        self, input_content_list: list[str], **kwargs: Any
+    ) -> list[Any]:  # noqa: ARG002
+        content_to_embedding_dict, sliced_input_content_lists = self._split_embedding_input(input_content_list)
+        runtime = _AsyncLLMRuntime.get()
+        client = runtime.get_client(
+            self._async_client_key("embedding", self.embedding_client_kwargs),
+            lambda: self._build_async_client(self.embedding_client_kwargs),
+        )
+
+        new_content_to_embedding_dict = {}
+
+        async def _embed(sliced_filtered_input_content_list: list[str]) -> None:
+            async with runtime.slot(self.embedding_model):
+                response = await client.embeddings.create(
+                    model=self.embedding_model,
+                    input=sliced_filtered_input_content_list,
+                )
+            for index, data in enumerate(response.data):
+                new_content_to_embedding_dict[sliced_filtered_input_content_list[index]] = data.embedding
+
+        await asyncio.gather(*[_embed(sliced) for sliced in sliced_input_content_lists])
+        content_to_embedding_dict.update(new_content_to_embedding_dict)
+        if new_content_to_embedding_dict and self.dump_embedding_cache:
+            self.cache.embedding_set(new_content_to_embedding_dict)
         return [content_to_embedding_dict[content] for content in input_content_list]
 
+    def _async_client_key(self, client_type: str, client_kwargs: dict) -> tuple:
+        # the token provider is decided by the settings, so it is excluded from the key.
+        return (
+            client_type,
+            self.use_azure,
+            *sorted((k, v) for k, v in client_kwargs.items() if k != "azure_ad_token_provider"),
+        )
+
+    def _build_async_client(self, client_kwargs: dict) -> Any:
+        if self.use_azure:
+            return openai.AsyncAzureOpenAI(**client_kwargs)
+        return openai.AsyncOpenAI(**client_kwargs)
+
     def _build_log_messages(self, messages: list[dict]) -> str:
         log_messages = ""
         for m in messages:
@@ -612,6 +1519,134 @@ class APIBackend:
             )
         return log_messages
 
+    def _prepare_chat_completion(
+        self, messages: list[dict], chat_cache_prefix: str, seed: Optional[int]
+    ) -> tuple[str, str | None]:
+        """
+        Log the messages and look up the chat cache.
+
+        Returns
+        -------
+        tuple[str, str | None]
+            the cache key of the messages, and the cached response (None if it is not cached).
+        """
+        if seed is None and LLM_SETTINGS.use_auto_chat_cache_seed_gen:
+            seed = LLM_CACHE_SEED_GEN.get_next_seed()
+
+        # TODO: we can add this function back to avoid so much `self.cfg.log_llm_chat_content`
+        if LLM_SETTINGS.log_llm_chat_content:
+            logger.info(self._build_log_messages(messages), tag="llm_messages")
+        # TODO: fail to use loguru adaptor due to stream response
+        input_content_json = json.dumps(messages)
+        input_content_json = (
+            chat_cache_prefix + input_content_json + f"<seed={seed}/>"
+        )  # FIXME this is a hack to make sure the cache represents the round index
+        if self.use_chat_cache:
+            cache_result = self.cache.chat_get(input_content_json)
+            if cache_result is not None:
+                if LLM_SETTINGS.log_llm_chat_content:
+                    logger.info(f"{LogColors.CYAN}Response:{cache_result}{LogColors.END}", tag="llm_messages")
+                return input_content_json, cache_result
+        return input_content_json, None
+
+    def _build_chat_completion_kwargs(
+        self,
+        model: str,
+        messages: list[dict],
+        temperature: float | None,
+        max_tokens: int | None,
+        frequency_penalty: float | None,
+        presence_penalty: float | None,
+        *,
+        json_mode: bool,
+        add_json_in_prompt: bool,
+    ) -> dict:
+        """Build the kwargs of `chat.completions.create` for the OpenAI compatible clients."""
+        kwargs = dict(
+            model=model,
+            messages=messages,
+            max_tokens=LLM_SETTINGS.chat_max_tokens if max_tokens is None else max_tokens,
+            temperature=LLM_SETTINGS.chat_temperature if temperature is None else temperature,
+            stream=self.chat_stream,
+            seed=self.chat_seed,
+            frequency_penalty=(LLM_SETTINGS.chat_frequency_penalty if frequency_penalty is None else frequency_penalty),
+            presence_penalty=LLM_SETTINGS.chat_presence_penalty if presence_penalty is None else presence_penalty,
+        )
+        if json_mode:
+            if add_json_in_prompt:
+                for message in messages[::-1]:
+                    message["content"] = message["content"] + "\nPlease respond in json format."
+                    if message["role"] == "system":
+                        break
+            kwargs["response_format"] = {"type": "json_object"}
+        return kwargs
+
+    @staticmethod
+    def _parse_stream_chunk(chunk: Any) -> tuple[str, str | None]:
+        content = (
+            chunk.choices[0].delta.content
+            if len(chunk.choices) > 0 and chunk.choices[0].delta.content is not None
+            else ""
+        )
+        finish_reason = chunk.choices[0].finish_reason if len(chunk.choices) > 0 else None
+        if LLM_SETTINGS.log_llm_chat_content:
+            logger.info(LogColors.CYAN + content + LogColors.END, raw=True, tag="llm_messages")
+        return content, finish_reason
+
+    @contextmanager
+    def _chat_single_flight(self, input_content_json: str) -> Iterator[str | None]:
+        """
+        Coalesce the identical chat completions in flight in the threads and processes sharing the chat cache.
+        The first one creates the completion, the others wait for it and yield its response read from the cache
+        (None means the caller has to create the completion itself).
+        """
+        if not (LLM_SETTINGS.chat_single_flight and self.use_chat_cache and self.dump_chat_cache):
+            yield None
+            return
+        with self.cache.single_flight(input_content_json, timeout=LLM_SETTINGS.chat_single_flight_timeout):
+            yield self.cache.chat_get(input_content_json)
+
+    @asynccontextmanager
+    async def _async_chat_single_flight(self, input_content_json: str) -> AsyncIterator[str | None]:
+        if not (LLM_SETTINGS.chat_single_flight and self.use_chat_cache and self.dump_chat_cache):
+            yield None
+            return
+        async with self.cache.async_single_flight(input_content_json, timeout=LLM_SETTINGS.chat_single_flight_timeout):
+            yield self.cache.chat_get(input_content_json)
+
+    def _get_chat_model(self, tag: str | None, depth: int = 5) -> tuple[str | None, str]:
+        """
+        Decide the model of a chat completion by `chat_model_map`. The tag is (in order of priority)
+        1) the `tag` passed to the completion APIs,
+        2) the tag of the enclosing `chat_model_tag` context,
+        3) the class name (or function name) of the caller of the completion APIs.
+
+        NOTE: 3) assumes it is called by `_create_chat_completion_inner_function` (or its async version),
+        which is called by `_create_chat_completion_auto_continue` <- `_try_create_chat_completion_or_embedding`
+        <- the API called by the caller. Other call chains have to pass their own `depth`.
+        """
+        if tag is None:
+            tag = _CHAT_MODEL_TAG.get()
+        if tag is None:
+            tag = _get_caller_tag(depth=depth)
+        return tag, self.chat_model_map.get(tag, self.chat_model)
+
+    def _log_chat_response(self, response: Any, resp: str, tag: str | None, model: str) -> None:
+        if LLM_SETTINGS.log_llm_chat_content:
+            logger.info(f"{LogColors.CYAN}Response:{resp}{LogColors.END}", tag="llm_messages")
+            logger.info(
+                json.dumps(
+                    {
+                        "tag": tag,
+                        "total_tokens": response.usage.total_tokens,
+                        "prompt_tokens": response.usage.prompt_tokens,
+                        "completion_tokens": response.usage.completion_tokens,
+                        "model": model,
+                    }
+                ),
+                tag="llm_messages",
+            )
+
     def _create_chat_completion_inner_function(  # noqa: C901, PLR0912, PLR0915
         self,
         messages: list[dict],
@@ -624,143 +1659,284 @@ class APIBackend:
         json_mode: bool = False,
         add_json_in_prompt: bool = False,
         seed: Optional[int] = None,
+        tag: str | None = None,
+        stop: Callable[[str], bool] | None = None,
     ) -> str:
         """
         seed : Optional[int]
             When retrying with cache enabled, it will keep returning the same results.
             To make retries useful, we need to enable a seed.
             This seed is different from `self.chat_seed` for GPT. It is for the local cache mechanism enabled by RD-Agent locally.
+        tag : str | None
+            The tag to route the completion to a model in `chat_model_map`. Please refer to `_get_chat_model`.
+        stop : Callable[[str], bool] | None
+            Only used when `chat_stream` is enabled. The stream is aborted once `stop(response received so far)` is
+            True, and the partial response is returned (and not cached).
         """
-        if seed is None and LLM_SETTINGS.use_auto_chat_cache_seed_gen:
-            seed = LLM_CACHE_SEED_GEN.get_next_seed()
+        input_content_json, cache_result = self._prepare_chat_completion(messages, chat_cache_prefix, seed)
+        if cache_result is not None:
+            return cache_result, None
 
-        # TODO: we can add this function back to avoid so much `self.cfg.log_llm_chat_content`
-        if LLM_SETTINGS.log_llm_chat_content:
-            logger.info(self._build_log_messages(messages), tag="llm_messages")
-        # TODO: fail to use loguru adaptor due to stream response
-        input_content_json = json.dumps(messages)
-        input_content_json = (
-            chat_cache_prefix + input_content_json + f"<seed={seed}/>"
-        )  # FIXME this is a hack to make sure the cache represents the round index
-        if self.use_chat_cache:
-            cache_result = self.cache.chat_get(input_content_json)
+        tag, model = self._get_chat_model(tag)
+
+        with self._chat_single_flight(input_content_json) as cache_result:
             if cache_result is not None:
-                if LLM_SETTINGS.log_llm_chat_content:
-                    logger.info(f"{LogColors.CYAN}Response:{cache_result}{LogColors.END}", tag="llm_messages")
                 return cache_result, None
 
-        if temperature is None:
-            temperature = LLM_SETTINGS.chat_temperature
-        if max_tokens is None:
-            max_tokens = LLM_SETTINGS.chat_max_tokens
-        if frequency_penalty is None:
-            frequency_penalty = LLM_SETTINGS.chat_frequency_penalty
-        if presence_penalty is None:
-            presence_penalty = LLM_SETTINGS.chat_presence_penalty
-
-        # Use index 4 to skip the current function and intermediate calls,
-        # and get the locals of the caller's frame.
-        caller_locals = inspect.stack()[4].frame.f_locals
-        if "self" in caller_locals:
-            tag = caller_locals["self"].__class__.__name__
-        else:
-            tag = inspect.stack()[4].function
-        model = self.chat_model_map.get(tag, self.chat_model)
-
-        finish_reason = None
-        if self.use_llama2:
-            response = self.generator.chat_completion(
-                messages,  # type: ignore
-                max_gen_len=max_tokens,
-                temperature=temperature,
-            )
-            resp = response[0]["generation"]["content"]
-            if LLM_SETTINGS.log_llm_chat_content:
-                logger.info(f"{LogColors.CYAN}Response:{resp}{LogColors.END}", tag="llm_messages")
-        elif self.use_gcr_endpoint:
-            body = str.encode(
-                json.dumps(
-                    {
-                        "input_data": {
-                            "input_string": messages,
-                            "parameters": {
-                                "temperature": self.gcr_endpoint_temperature,
-                                "top_p": self.gcr_endpoint_top_p,
-                                "max_new_tokens": self.gcr_endpoint_max_token,
+            finish_reason = None
+            if self.use_llama2:
+                response = self.generator.chat_completion(
+                    messages,  # type: ignore
+                    max_gen_len=LLM_SETTINGS.chat_max_tokens if max_tokens is None else max_tokens,
+                    temperature=LLM_SETTINGS.chat_temperature if temperature is None else temperature,
+                )
+                resp = response[0]["generation"]["content"]
+                if LLM_SETTINGS.log_llm_chat_content:
+                    logger.info(f"{LogColors.CYAN}Response:{resp}{LogColors.END}", tag="llm_messages")
+            elif self.use_gcr_endpoint:
+                body = str.encode(
+                    json.dumps(
+                        {
+                            "input_data": {
+                                "input_string": messages,
+                                "parameters": {
+                                    "temperature": self.gcr_endpoint_temperature,
+                                    "top_p": self.gcr_endpoint_top_p,
+                                    "max_new_tokens": self.gcr_endpoint_max_token,
+                                },
                             },
                         },
-                    },
-                ),
+                    ),
+                )
+
+                req = urllib.request.Request(self.gcr_endpoint, body, self.headers)  # noqa: S310
+                response = urllib.request.urlopen(req)  # noqa: S310
+                resp = json.loads(response.read().decode())["output"]
+                if LLM_SETTINGS.log_llm_chat_content:
+                    logger.info(f"{LogColors.CYAN}Response:{resp}{LogColors.END}", tag="llm_messages")
+            else:
+                kwargs = self._build_chat_completion_kwargs(
+                    model,
+                    messages,
+                    temperature,
+                    max_tokens,
+                    frequency_penalty,
+                    presence_penalty,
+                    json_mode=json_mode,
+                    add_json_in_prompt=add_json_in_prompt,
+                )
+                response = self.chat_client.chat.completions.create(**kwargs)
+
+                if self.chat_stream:
+                    # TODO: with logger.config(stream=self.chat_stream): and add a `stream_start` flag to add timestamp for first message.
+                    if LLM_SETTINGS.log_llm_chat_content:
+                        logger.info(f"{LogColors.CYAN}Response:{LogColors.END}", tag="llm_messages")
+
+                    stream = _ChatStream(json_mode=json_mode, stop=stop)
+                    try:
+                        for chunk in response:
+                            if stream.feed(*self._parse_stream_chunk(chunk)):
+                                break
+                    finally:
+                        response.close()  # abort the generation if the stream ends early
+
+                    if LLM_SETTINGS.log_llm_chat_content:
+                        logger.info("\n", raw=True, tag="llm_messages")
+                    stream.validate()
+                    resp, finish_reason = stream.resp, stream.finish_reason
+                    if stream.stopped:
+                        return resp, finish_reason
+                else:
+                    resp = response.choices[0].message.content
+                    finish_reason = response.choices[0].finish_reason
+                    self._log_chat_response(response, resp, tag, model)
+                    if json_mode:
+                        json.loads(resp)
+            if self.dump_chat_cache:
+                self.cache.chat_set(input_content_json, resp)
+            return resp, finish_reason
+
+    def stream_chat_completion(
+        self,
+        user_prompt: str,
+        system_prompt: str | None = None,
+        former_messages: list | None = None,
+        chat_cache_prefix: str = "",
+        temperature: float | None = None,
+        max_tokens: int | None = None,
+        frequency_penalty: float | None = None,
+        presence_penalty: float | None = None,
+        *,
+        json_mode: bool = False,
+        stop: Callable[[str], bool] | None = None,
+        shrink_multiple_break: bool = False,
+        seed: Optional[int] = None,
+        tag: str | None = None,
+    ) -> Iterator[str]:
+        """
+        Create a chat completion and yield its content chunk by chunk as it is generated (regardless of `chat_stream`).
+
+        .. code-block:: python
+
+            code = "".join(APIBackend().stream_chat_completion(user_prompt, stop=lambda resp: resp.count("```") >= 2))
+
+        stop : Callable[[str], bool] | None
+            The stream is aborted once `stop(response received so far)` is True.
+        json_mode : bool
+            The response is parsed incrementally. json.JSONDecodeError is raised as soon as the response can't be a
+            json document, and the stream ends once the document is complete.
+
+        Unlike `build_messages_and_create_chat_completion`, the failures are not retried (the yielded chunks are
+        already consumed) and the responses truncated by the length limit are not continued.
+        The response is cached (when `dump_chat_cache` is enabled) unless it is aborted by `stop` or by the caller.
+        """
+        if former_messages is None:
+            former_messages = []
+        messages = self.build_messages(
+            user_prompt, system_prompt, former_messages, shrink_multiple_break=shrink_multiple_break
+        )
+        tag, model = self._get_chat_model(tag, depth=2)
+        if self.use_llama2 or self.use_gcr_endpoint:
+            # the local/endpoint backends can't stream, so the response is yielded as a whole.
+            resp, _ = self._create_chat_completion_inner_function(
+                messages,
+                temperature,
+                max_tokens,
+                chat_cache_prefix,
+                frequency_penalty,
+                presence_penalty,
+                json_mode=json_mode,
+                seed=seed,
+                tag=tag,
             )
+            yield resp
+            return
+
+        input_content_json, cache_result = self._prepare_chat_completion(messages, chat_cache_prefix, seed)
+        if cache_result is not None:
+            yield cache_result
+            return
+
+        kwargs = self._build_chat_completion_kwargs(
+            model,
+            messages,
+            temperature,
+            max_tokens,
+            frequency_penalty,
+            presence_penalty,
+            json_mode=json_mode,
+            add_json_in_prompt=False,
+        )
+        kwargs["stream"] = True
+        response = self.chat_client.chat.completions.create(**kwargs)
+        if LLM_SETTINGS.log_llm_chat_content:
+            logger.info(f"{LogColors.CYAN}Response:{LogColors.END}", tag="llm_messages")
 
-            req = urllib.request.Request(self.gcr_endpoint, body, self.headers)  # noqa: S310
-            response = urllib.request.urlopen(req)  # noqa: S310
-            resp = json.loads(response.read().decode())["output"]
+        stream = _ChatStream(json_mode=json_mode, stop=stop)
+        try:
+            for chunk in response:
+                content, finish_reason = self._parse_stream_chunk(chunk)
+                end_of_stream = stream.feed(content, finish_reason)
+                if content:
+                    yield content
+                if end_of_stream:
+                    break
+        finally:
+            response.close()
             if LLM_SETTINGS.log_llm_chat_content:
-                logger.info(f"{LogColors.CYAN}Response:{resp}{LogColors.END}", tag="llm_messages")
-        else:
-            kwargs = dict(
-                model=model,
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                stream=self.chat_stream,
-                seed=self.chat_seed,
-                frequency_penalty=frequency_penalty,
-                presence_penalty=presence_penalty,
+                logger.info("\n", raw=True, tag="llm_messages")
+        stream.validate()
+        if self.dump_chat_cache and not stream.stopped:
+            self.cache.chat_set(input_content_json, stream.resp)
+
+    async def _async_create_chat_completion_inner_function(
+        self,
+        messages: list[dict],
+        temperature: float | None = None,
+        max_tokens: int | None = None,
+        chat_cache_prefix: str = "",
+        frequency_penalty: float | None = None,
+        presence_penalty: float | None = None,
+        *,
+        json_mode: bool = False,
+        add_json_in_prompt: bool = False,
+        seed: Optional[int] = None,
+        tag: str | None = None,
+        stop: Callable[[str], bool] | None = None,
+    ) -> tuple[str, str | None]:
+        # The frames of the awaiting coroutines are chained as well, so the same depth reaches the caller.
+        tag, model = self._get_chat_model(tag)
+        if self.use_llama2 or self.use_gcr_endpoint:
+            # The local/endpoint backends have no async client; they are called synchronously.
+            return self._create_chat_completion_inner_function(
+                messages,
+                temperature,
+                max_tokens,
+                chat_cache_prefix,
+                frequency_penalty,
+                presence_penalty,
+                json_mode=json_mode,
+                add_json_in_prompt=add_json_in_prompt,
+                seed=seed,
+                tag=tag,
+                stop=stop,
             )
-            if json_mode:
-                if add_json_in_prompt:
-                    for message in messages[::-1]:
-                        message["content"] = message["content"] + "\nPlease respond in json format."
-                        if message["role"] == "system":
-                            break
-                kwargs["response_format"] = {"type": "json_object"}
-            response = self.chat_client.chat.completions.create(**kwargs)
-
-            if self.chat_stream:
-                resp = ""
-                # TODO: with logger.config(stream=self.chat_stream): and add a `stream_start` flag to add timestamp for first message.
-                if LLM_SETTINGS.log_llm_chat_content:
-                    logger.info(f"{LogColors.CYAN}Response:{LogColors.END}", tag="llm_messages")
 
-                for chunk in response:
-                    content = (
-                        chunk.choices[0].delta.content
-                        if len(chunk.choices) > 0 and chunk.choices[0].delta.content is not None
-                        else ""
-                    )
-                    if LLM_SETTINGS.log_llm_chat_content:
-                        logger.info(LogColors.CYAN + content + LogColors.END, raw=True, tag="llm_messages")
-                    resp += content
-                    if len(chunk.choices) > 0 and chunk.choices[0].finish_reason is not None:
-                        finish_reason = chunk.choices[0].finish_reason
+        input_content_json, cache_result = self._prepare_chat_completion(messages, chat_cache_prefix, seed)
+        if cache_result is not None:
+            return cache_result, None
 
-                if LLM_SETTINGS.log_llm_chat_content:
-                    logger.info("\n", raw=True, tag="llm_messages")
+        async with self._async_chat_single_flight(input_content_json) as cache_result:
+            if cache_result is not None:
+                return cache_result, None
 
-            else:
-                resp = response.choices[0].message.content
-                finish_reason = response.choices[0].finish_reason
-                if LLM_SETTINGS.log_llm_chat_content:
-                    logger.info(f"{LogColors.CYAN}Response:{resp}{LogColors.END}", tag="llm_messages")
-                    logger.info(
-                        json.dumps(
-                            {
-                                "tag": tag,
-                                "total_tokens": response.usage.total_tokens,
-                                "prompt_tokens": response.usage.prompt_tokens,
-                                "completion_tokens": response.usage.completion_tokens,
-                                "model": model,
-                            }
-                        ),
-                        tag="llm_messages",
-                    )
-            if json_mode:
-                json.loads(resp)
-        if self.dump_chat_cache:
-            self.cache.chat_set(input_content_json, resp)
-        return resp, finish_reason
+            kwargs = self._build_chat_completion_kwargs(
+                model,
+                messages,
+                temperature,
+                max_tokens,
+                frequency_penalty,
+                presence_penalty,
+                json_mode=json_mode,
+                add_json_in_prompt=add_json_in_prompt,
+            )
+            runtime = _AsyncLLMRuntime.get()
+            client = runtime.get_client(
+                self._async_client_key("chat", self.chat_client_kwargs),
+                lambda: self._build_async_client(self.chat_client_kwargs),
+            )
+            finish_reason = None
+            async with runtime.slot(model):
+                response = await client.chat.completions.create(**kwargs)
+                if self.chat_stream:
+                    # The chunks of concurrent requests are interleaved, so the response is logged as a whole.
+                    stream = _ChatStream(json_mode=json_mode, stop=stop)
+                    try:
+                        async for chunk in response:
+                            content = (
+                                chunk.choices[0].delta.content
+                                if len(chunk.choices) > 0 and chunk.choices[0].delta.content is not None
+                                else ""
+                            )
+                            if stream.feed(content, chunk.choices[0].finish_reason if len(chunk.choices) > 0 else None):
+                                break
+                    finally:
+                        await response.close()
+                    if LLM_SETTINGS.log_llm_chat_content:
+                        logger.info(f"{LogColors.CYAN}Response:{stream.resp}{LogColors.END}", tag="llm_messages")
+                    stream.validate()
+                    resp, finish_reason = stream.resp, stream.finish_reason
+                    if stream.stopped:
+                        return resp, finish_reason
+                else:
+                    resp = response.choices[0].message.content
+                    finish_reason = response.choices[0].finish_reason
+                    self._log_chat_response(response, resp, tag, model)
+                    if json_mode:
+                        json.loads(resp)
+            if self.dump_chat_cache:
+                self.cache.chat_set(input_content_json, resp)
+            return resp, finish_reason
 
     def calculate_token_from_messages(self, messages: list[dict]) -> int:
         if self.use_llama2 or self.use_gcr_endpoint:
@@ -777,7 +1953,7 @@ class APIBackend:
         for message in messages:
             num_tokens += tokens_per_message
             for key, value in message.items():
-                num_tokens += len(self.encoder.encode(value))
+                num_tokens += _TOKENIZER_CACHE.count(self.encoder, value)
                 if key == "name":
                     num_tokens += tokens_per_name
         num_tokens += 3  # every reply is primed with <start>assistant<message>
@@ -798,6 +1974,75 @@ class APIBackend:
         )
         return self.calculate_token_from_messages(messages)
 
+    def build_messages_and_truncate_to_token_limit(
+        self,
+        content: str,
+        build_user_prompt: Callable[[str], str],
+        system_prompt: str | None = None,
+        former_messages: list[dict] | None = None,
+        token_limit: int | None = None,
+    ) -> tuple[str, str]:
+        """
+        Truncate the head of `content` (e.g. an execution log, whose tail is the most relevant part) so that the
+        messages built with `build_user_prompt(content)` fit in `token_limit` (`chat_token_limit` by default).
+
+        The content is tokenized once and the truncation point is searched on its token offsets: it is estimated
+        from the tokens left for the content and stepped forward by the overflow until the prompt fits, then the
+        first fitting token (i.e. the longest fitting tail) is found by a binary search after the last overflowing
+        one. As the tokens are nearly additive, the prompt is rendered and counted a few times instead of once per
+        halving of the content.
+
+        Returns the truncated content and the user prompt rendered with it.
+        """
+        token_limit = LLM_SETTINGS.chat_token_limit if token_limit is None else token_limit
+        if former_messages is None:
+            former_messages = []
+
+        def _calculate_token(user_prompt: str) -> int:
+            return self.build_messages_and_calculate_token(user_prompt, system_prompt, former_messages)
+
+        user_prompt = build_user_prompt(content)
+        if self.encoder is None or _calculate_token(user_prompt) <= token_limit:
+            return content, user_prompt
+
+        tokens = self.encoder.encode(content)
+        _, offsets = self.encoder.decode_with_offsets(tokens)
+
+        def _render(start: int) -> tuple[str, str, int]:
+            # the content from the token `start`, its prompt, and by how many tokens the prompt overflows
+            truncated_content = content[offsets[start] :] if start < len(tokens) else ""
+            user_prompt = build_user_prompt(truncated_content)
+            return truncated_content, user_prompt, _calculate_token(user_prompt) - token_limit
+
+        # the content from the token `lo` overflows (the whole content does); the one from `hi` fits, or is the empty
+        # content returned when nothing fits
+        lo, hi = 0, len(tokens)
+        result = ("", build_user_prompt(""))
+        start = max(len(tokens) - (token_limit - _calculate_token(build_user_prompt(""))), 1)
+        while start < hi:
+            truncated_content, user_prompt, overflow = _render(start)
+            if overflow <= 0:
+                hi, result = start, (truncated_content, user_prompt)
+                break
+            lo, start = start, start + overflow
+        # when the estimate fits at once, `lo` is found by galloping back from it, as it is usually a few tokens away
+        step = 1
+        while lo == 0 and hi - step > lo:
+            truncated_content, user_prompt, overflow = _render(hi - step)
+            if overflow > 0:
+                lo = hi - step
+            else:
+                hi, result = hi - step, (truncated_content, user_prompt)
+                step *= 2
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            truncated_content, user_prompt, overflow = _render(mid)
+            if overflow <= 0:
+                hi, result = mid, (truncated_content, user_prompt)
+            else:
+                lo = mid
+        return result
+
 
 def calculate_embedding_distance_between_str_list(
     source_str_list: list[str],
@@ -806,13 +2051,10 @@ def calculate_embedding_distance_between_str_list(
     if not source_str_list or not target_str_list:
         return [[]]
 
-    embeddings = APIBackend().create_embedding(source_str_list + target_str_list)
-
-    source_embeddings = embeddings[: len(source_str_list)]
-    target_embeddings = embeddings[len(source_str_list) :]
+    embeddings = APIBackend().create_embedding_array(source_str_list + target_str_list)
 
-    source_embeddings_np = np.array(source_embeddings)
-    target_embeddings_np = np.array(target_embeddings)
+    source_embeddings_np = embeddings[: len(source_str_list)]
+    target_embeddings_np = embeddings[len(source_str_list) :]
 
     source_embeddings_np = source_embeddings_np / np.linalg.norm(source_embeddings_np, axis=1, keepdims=True)
     target_embeddings_np = target_embeddings_np / np.linalg.norm(target_embeddings_np, axis=1, keepdims=True)
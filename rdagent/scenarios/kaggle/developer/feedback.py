@@ -187,10 +187,9 @@ class KGHypothesisExperiment2Feedback(HypothesisExperiment2Feedback):
                     exp_code_nodes.append(UndirectedNode(content=code, label="code"))
             conclusion_node = UndirectedNode(content=response, label="conclusion")
             all_nodes = [competition_node, hypothesis_node, *exp_code_nodes, conclusion_node]
-            all_nodes = trace.knowledge_base.batch_embedding(all_nodes)
-            for node in all_nodes:
-                if node is not competition_node:
-                    trace.knowledge_base.add_node(node, competition_node)
+            trace.knowledge_base.add_nodes_with_edges(
+                [(node, competition_node) for node in all_nodes if node is not competition_node]
+            )
 
         if self.scen.if_action_choosing_based_on_UCB:
             self.scen.action_counts[hypothesis.action] += 1
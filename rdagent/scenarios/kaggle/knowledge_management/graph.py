@@ -79,7 +79,6 @@ class KGKnowledgeGraph(UndirectedGraph):
             n=RD_AGENT_SETTINGS.multi_proc_n,
         )
         node_pairs = []
-        node_list = []
         for knowledge_list in tqdm(knowledge_list_list):
             for knowledge in knowledge_list:
                 if knowledge == {}:
@@ -94,7 +93,6 @@ class KGKnowledgeGraph(UndirectedGraph):
                     ),
                     label="competition",
                 )
-                node_list.append(competition_node)
 
                 for action in ["hypothesis", "experiments", "code", "conclusion"]:
                     if action == "hypothesis":
@@ -110,12 +108,9 @@ class KGKnowledgeGraph(UndirectedGraph):
                     if content == "" or content == "N/A":
                         continue
                     node = UndirectedNode(content=content, label=label)
-                    node_list.append(node)
                     node_pairs.append((node, competition_node))
 
-        node_list = self.batch_embedding(node_list)
-        for node_pair in node_pairs:
-            self.add_node(node_pair[0], node_pair[1])
+        self.add_nodes_with_edges(node_pairs)
 
 
 if __name__ == "__main__":
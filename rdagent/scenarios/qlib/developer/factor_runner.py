@@ -1,19 +1,25 @@
-import pickle
+import shutil
+import time
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Tuple
 
+import numpy as np
 import pandas as pd
-from pandarallel import pandarallel
-
-from rdagent.core.conf import RD_AGENT_SETTINGS
-from rdagent.core.utils import cache_with_pickle, multiprocessing_wrapper
-
-pandarallel.initialize(verbose=1)
 
+from rdagent.components.coder.factor_coder.config import FACTOR_COSTEER_SETTINGS
+from rdagent.components.coder.factor_coder.factor import FactorFBWorkspace
 from rdagent.components.runner import CachedRunner
+from rdagent.core.conf import RD_AGENT_SETTINGS
 from rdagent.core.exception import FactorEmptyError
+from rdagent.core.utils import cache_with_pickle, multiprocessing_wrapper
 from rdagent.log import rdagent_logger as logger
+from rdagent.scenarios.qlib.developer.factor_store import QlibFactorStore
 from rdagent.scenarios.qlib.experiment.factor_experiment import QlibFactorExperiment
+from rdagent.utils.cross_section import mean_cross_corr_by_group
+from rdagent.utils.frame_store import load_frame
 
 DIRNAME = Path(__file__).absolute().resolve().parent
 DIRNAME_local = Path.cwd()
@@ -32,6 +38,13 @@ DIRNAME_local = Path.cwd()
 # TODO: supporting multiprocessing and keep previous results
 
 
+def _execute_factor(implementation: FactorFBWorkspace) -> Tuple[Path | None, float]:
+    """Execute the factor on all the data (e.g. in a worker process) and return its value store path and run time."""
+    start = time.perf_counter()
+    _, value_path = implementation.execute_to_store("All")
+    return value_path, time.perf_counter() - start
+
+
 class QlibFactorRunner(CachedRunner[QlibFactorExperiment]):
     """
     Docker run
@@ -42,33 +55,20 @@ class QlibFactorRunner(CachedRunner[QlibFactorExperiment]):
     - results in `mlflow`
     """
 
-    def calculate_information_coefficient(
-        self, concat_feature: pd.DataFrame, SOTA_feature_column_size: int, new_feature_columns_size: int
-    ) -> pd.DataFrame:
-        res = pd.Series(index=range(SOTA_feature_column_size * new_feature_columns_size))
-        for col1 in range(SOTA_feature_column_size):
-            for col2 in range(SOTA_feature_column_size, SOTA_feature_column_size + new_feature_columns_size):
-                res.loc[col1 * new_feature_columns_size + col2 - SOTA_feature_column_size] = concat_feature.iloc[
-                    :, col1
-                ].corr(concat_feature.iloc[:, col2])
-        return res
-
     def deduplicate_new_factors(self, SOTA_feature: pd.DataFrame, new_feature: pd.DataFrame) -> pd.DataFrame:
         # calculate the IC between each column of SOTA_feature and new_feature
         # if the IC is larger than a threshold, remove the new_feature column
         # return the new_feature
 
-        concat_feature = pd.concat([SOTA_feature, new_feature], axis=1)
-        IC_max = (
-            concat_feature.groupby("datetime")
-            .parallel_apply(
-                lambda x: self.calculate_information_coefficient(x, SOTA_feature.shape[1], new_feature.shape[1])
-            )
-            .mean()
-        )
-        IC_max.index = pd.MultiIndex.from_product([range(SOTA_feature.shape[1]), range(new_feature.shape[1])])
-        IC_max = IC_max.unstack().max(axis=0)
-        return new_feature.iloc[:, IC_max[IC_max < 0.99].index]
+        aligned_SOTA_feature, aligned_new_feature = SOTA_feature, new_feature
+        if not SOTA_feature.index.equals(new_feature.index):
+            concat_feature = pd.concat([SOTA_feature, new_feature], axis=1)
+            aligned_SOTA_feature = concat_feature.iloc[:, : SOTA_feature.shape[1]]
+            aligned_new_feature = concat_feature.iloc[:, SOTA_feature.shape[1] :]
+        # the (SOTA factor, new factor) matrix of the ICs averaged over the dates, computed in one pass
+        IC = mean_cross_corr_by_group(aligned_SOTA_feature, aligned_new_feature)
+        IC_max = IC.max(axis=0).to_numpy()
+        return new_feature.iloc[:, np.flatnonzero(IC_max < 0.99)]
 
     @cache_with_pickle(CachedRunner.get_cache_key, CachedRunner.assign_cached_result)
     def develop(self, exp: QlibFactorExperiment) -> QlibFactorExperiment:
@@ -80,34 +80,42 @@ class QlibFactorRunner(CachedRunner[QlibFactorExperiment]):
             exp.based_experiments[-1] = self.develop(exp.based_experiments[-1])
 
         if exp.based_experiments:
-            SOTA_factor = None
+            # The factors of the SOTA experiments which are not stored yet and the new factors are executed in one
+            # plan, so that they share one process pool.
+            SOTA_implementations = (
+                self._get_factor_implementations(exp.based_experiments) if len(exp.based_experiments) > 1 else {}
+            )
+            new_SOTA_keys = [key for key in SOTA_implementations if key not in self.factor_store]
+            new_implementations = [implementation for implementation in exp.sub_workspace_list if implementation]
+            factor_dfs = self.execute_factors(
+                [SOTA_implementations[key] for key in new_SOTA_keys] + new_implementations
+            )
+            for key, df in zip(new_SOTA_keys, factor_dfs):
+                self.factor_store.add(key, df)
+
+            SOTA_factor_keys = None
             if len(exp.based_experiments) > 1:
-                SOTA_factor = self.process_factor_data(exp.based_experiments)
+                SOTA_factor_keys = [key for key in SOTA_implementations if self.factor_store.manifest["factors"][key]]
+                if not SOTA_factor_keys:
+                    raise FactorEmptyError("No valid factor data found to merge.")
 
             # Process the new factors data
-            new_factors = self.process_factor_data(exp)
-
-            if new_factors.empty:
+            new_factor_dfs = [df for df in factor_dfs[len(new_SOTA_keys) :] if df is not None]
+            if not new_factor_dfs:
                 raise FactorEmptyError("No valid factor data found to merge.")
+            new_factors = pd.concat(new_factor_dfs, axis=1)
 
-            # Combine the SOTA factor and new factors if SOTA factor exists
+            # Combine the SOTA factor and new factors if SOTA factor exists. Only the new factors are written to the
+            # workspace, the stored SOTA factors are linked; qlib reads them with `combined_factors_loader.py`.
+            combined_factors_path = exp.experiment_workspace.workspace_path / "combined_factors"
+            SOTA_factor = self.factor_store.load(SOTA_factor_keys) if SOTA_factor_keys is not None else None
             if SOTA_factor is not None and not SOTA_factor.empty:
-                new_factors = self.deduplicate_new_factors(SOTA_factor, new_factors)
+                new_factors = self.deduplicate_new_factors(SOTA_factor, new_factors.reindex(SOTA_factor.index))
                 if new_factors.empty:
                     raise FactorEmptyError("No valid factor data found to merge.")
-                combined_factors = pd.concat([SOTA_factor, new_factors], axis=1).dropna()
+                self.factor_store.export(combined_factors_path, SOTA_factor_keys, new_factors)
             else:
-                combined_factors = new_factors
-
-            # Sort and nest the combined factors under 'feature'
-            combined_factors = combined_factors.sort_index()
-            combined_factors = combined_factors.loc[:, ~combined_factors.columns.duplicated(keep="last")]
-            new_columns = pd.MultiIndex.from_product([["feature"], combined_factors.columns])
-            combined_factors.columns = new_columns
-
-            # Save the combined factors to the workspace
-            with open(exp.experiment_workspace.workspace_path / "combined_factors_df.pkl", "wb") as f:
-                pickle.dump(combined_factors, f)
+                QlibFactorStore.create(combined_factors_path, dropna=False).add("new", new_factors)
 
         result = exp.experiment_workspace.execute(
             qlib_config_name=f"conf.yaml" if len(exp.based_experiments) == 0 else "conf_combined.yaml"
@@ -117,6 +125,88 @@ class QlibFactorRunner(CachedRunner[QlibFactorExperiment]):
 
         return exp
 
+    @property
+    def factor_store(self) -> QlibFactorStore:
+        """
+        The values of the SOTA factors, kept across the loops so that each factor is only stored once.
+
+        The store lives as long as the runner in the process creating it and is removed afterwards (the workspaces
+        keep their hard links to its files). A runner restored in another process (e.g. from a session dump) starts
+        a new store, whose factors are executed again (or loaded from the execution cache).
+        """
+        store = getattr(self, "_factor_store", None)
+        if store is None or (store.manifest["factors"] and not store.exists()):
+            store = QlibFactorStore.create(RD_AGENT_SETTINGS.workspace_path / "factor_store" / uuid.uuid4().hex)
+            weakref.finalize(store, shutil.rmtree, store.path, ignore_errors=True)
+            self._factor_store = store
+        return store
+
+    @staticmethod
+    def _get_valid_factor_df(df: pd.DataFrame | None) -> pd.DataFrame | None:
+        # Check if factor generation was successful
+        if df is not None and "datetime" in df.index.names:
+            time_diff = df.index.get_level_values("datetime").to_series().diff().dropna().unique()
+            if pd.Timedelta(minutes=1) not in time_diff:
+                # the factor values are combined and compared as floats
+                numeric_df = df.select_dtypes(include=["number", "bool"])
+                if numeric_df.shape[1] < df.shape[1]:
+                    logger.warning(
+                        f"The factor columns {df.columns.difference(numeric_df.columns).tolist()} are not numeric, "
+                        "they are skipped."
+                    )
+                return numeric_df if numeric_df.shape[1] > 0 else None
+        return None
+
+    @staticmethod
+    def _get_factor_implementations(exp_list: List[QlibFactorExperiment]) -> Dict[str, FactorFBWorkspace]:
+        """The implementations of the factors of the experiments, keyed by their code (so each factor is kept once)."""
+        implementations = {}
+        for exp in exp_list:
+            for implementation in exp.sub_workspace_list:
+                if implementation and (key := implementation.hash_func("All")) is not None:
+                    implementations[key] = implementation
+        return implementations
+
+    def execute_factors(self, implementations: List[FactorFBWorkspace]) -> List[pd.DataFrame | None]:
+        """
+        Execute the factors on all the data as one plan and return their valid values (None if not valid), in order.
+
+        The implementations sharing the same code are executed once, and all the executions share one process pool;
+        the workers pass the values back by the path of their store, which is memory-mapped here. In the
+        "worker_pool" execution mode, the executions are issued from threads instead, as the daemonic processes of
+        `multiprocessing_wrapper` can't use the worker pool. The run time of each factor is logged.
+        """
+        plan: Dict[str, FactorFBWorkspace] = {}
+        plan_keys = []
+        for i, implementation in enumerate(implementations):
+            key = implementation.hash_func("All")
+            key = f"unhashable_{i}" if key is None else key
+            plan.setdefault(key, implementation)
+            plan_keys.append(key)
+
+        start = time.perf_counter()
+        if FACTOR_COSTEER_SETTINGS.execution_mode == "worker_pool":
+            with ThreadPoolExecutor(max_workers=FACTOR_COSTEER_SETTINGS.worker_pool_size) as executor:
+                results = list(executor.map(_execute_factor, plan.values()))
+        else:
+            results = multiprocessing_wrapper(
+                [(_execute_factor, (implementation,)) for implementation in plan.values()],
+                n=RD_AGENT_SETTINGS.multi_proc_n,
+            )
+        for implementation, (_, duration) in zip(plan.values(), results):
+            logger.info(f"Factor {implementation.target_task.factor_name} executed in {duration:.2f} sec")
+        logger.info(
+            f"{len(plan)} factors executed in {time.perf_counter() - start:.2f} sec "
+            f"({sum(duration for _, duration in results):.2f} sec in total, "
+            f"{len(implementations) - len(plan)} duplicated factors skipped)"
+        )
+
+        factor_dfs = {
+            key: None if value_path is None else self._get_valid_factor_df(load_frame(value_path))
+            for key, (value_path, _) in zip(plan, results)
+        }
+        return [factor_dfs[key] for key in plan_keys]
+
     def process_factor_data(self, exp_or_list: List[QlibFactorExperiment] | QlibFactorExperiment) -> pd.DataFrame:
         """
         Process and combine factor data from experiment implementations.
@@ -129,21 +219,10 @@ class QlibFactorRunner(CachedRunner[QlibFactorExperiment]):
         """
         if isinstance(exp_or_list, QlibFactorExperiment):
             exp_or_list = [exp_or_list]
-        factor_dfs = []
-
-        # Collect all exp's dataframes
-        for exp in exp_or_list:
-            # Iterate over sub-implementations and execute them to get each factor data
-            message_and_df_list = multiprocessing_wrapper(
-                [(implementation.execute, ("All",)) for implementation in exp.sub_workspace_list if implementation],
-                n=RD_AGENT_SETTINGS.multi_proc_n,
-            )
-            for message, df in message_and_df_list:
-                # Check if factor generation was successful
-                if df is not None and "datetime" in df.index.names:
-                    time_diff = df.index.get_level_values("datetime").to_series().diff().dropna().unique()
-                    if pd.Timedelta(minutes=1) not in time_diff:
-                        factor_dfs.append(df)
+        factor_dfs = self.execute_factors(
+            [implementation for exp in exp_or_list for implementation in exp.sub_workspace_list if implementation]
+        )
+        factor_dfs = [df for df in factor_dfs if df is not None]
 
         # Combine all successful factor data
         if factor_dfs:
@@ -0,0 +1,159 @@
+"""
+A column store of the values of the factors combined in the qlib backtests.
+
+Each column of a factor value is stored once, in its own `.npy` file, aligned with an index shared by all the
+columns; so adding a factor only writes its own columns. The store is a directory of:
+
+- `index_level_<i>.npy` and `index_codes_<i>.npy`: the levels (e.g. the dates and the instruments) and the codes of
+  the shared index;
+- `column_<n>.npy`: the values of a column;
+- `manifest.json`: the names of the index levels, the columns of each factor (by key) in order, and whether the
+  rows with missing values are dropped when reading the store.
+
+Only numpy arrays and json are used, so the store is read the same way by any version of pandas, e.g. by the
+qlib data loader in `combined_factors_loader.py` of the workspace template.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from rdagent.log import rdagent_logger as logger
+
+MANIFEST_FILE = "manifest.json"
+# Each memory-mapped column keeps a file descriptor open, so loading more columns than this (e.g. thousands of
+# factors) reads them into memory instead of mapping them, to stay within the limit of open files.
+MAX_MAPPED_COLUMNS = 256
+
+
+class QlibFactorStore:
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self.manifest: dict = {"index_names": None, "factors": {}, "dropna": True, "n_columns": 0}
+        if (self.path / MANIFEST_FILE).exists():
+            self.manifest = json.loads((self.path / MANIFEST_FILE).read_text())
+        self._index: pd.MultiIndex | None = None
+
+    @classmethod
+    def create(cls, path: str | Path, dropna: bool = True) -> QlibFactorStore:
+        """An empty store at `path`, replacing what was there (e.g. the store of a previous run of a workspace)."""
+        path = Path(path)
+        if path.exists():
+            shutil.rmtree(path)
+        path.mkdir(parents=True)
+        store = cls(path)
+        store.manifest["dropna"] = dropna
+        store._dump_manifest()
+        return store
+
+    def __getstate__(self) -> dict:
+        # the index is loaded again from the files rather than pickled with the store (e.g. with the runner)
+        return {**self.__dict__, "_index": None}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.manifest["factors"]
+
+    def exists(self) -> bool:
+        return (self.path / MANIFEST_FILE).exists()
+
+    def _dump_manifest(self) -> None:
+        # written aside and renamed, so that the manifest only lists the columns written completely
+        tmp_path = self.path / f".{MANIFEST_FILE}"
+        tmp_path.write_text(json.dumps(self.manifest))
+        tmp_path.replace(self.path / MANIFEST_FILE)
+
+    @property
+    def index(self) -> pd.MultiIndex | None:
+        if self._index is None and self.manifest["index_names"] is not None:
+            names = self.manifest["index_names"]
+            self._index = pd.MultiIndex(
+                levels=[np.load(self.path / f"index_level_{i}.npy") for i in range(len(names))],
+                codes=[np.load(self.path / f"index_codes_{i}.npy", mmap_mode="r") for i in range(len(names))],
+                names=names,
+                verify_integrity=False,
+            )
+        return self._index
+
+    def _init_index(self, index: pd.Index) -> None:
+        index = pd.MultiIndex.from_arrays([index]) if not isinstance(index, pd.MultiIndex) else index
+        index = index.remove_unused_levels()
+        self.path.mkdir(parents=True, exist_ok=True)
+        for i, (level, codes) in enumerate(zip(index.levels, index.codes)):
+            level_values = level.to_numpy()
+            if level_values.dtype == object:  # e.g. the instruments
+                level_values = level_values.astype(str)
+            np.save(self.path / f"index_level_{i}.npy", level_values, allow_pickle=False)
+            np.save(self.path / f"index_codes_{i}.npy", np.asarray(codes), allow_pickle=False)
+        self.manifest["index_names"] = list(index.names)
+        self._index = None
+
+    def add(self, key: str, df: pd.DataFrame | None) -> None:
+        """
+        Store the columns of the factor value `df` under `key`; `None` records a factor without a valid value.
+
+        The first factor added sets the shared index (sorted); the next ones are aligned with it. The values are
+        stored as floats; the columns which are not numeric are skipped (and reported).
+        """
+        columns = []
+        if df is not None:
+            if self.index is None:
+                self._init_index(df.index.unique().sort_values())
+            df = df.reindex(self.index) if not df.index.equals(self.index) else df
+            for i in range(df.shape[1]):
+                try:
+                    values = df.iloc[:, i].to_numpy(dtype=float)
+                except (TypeError, ValueError):
+                    logger.warning(f"The column {df.columns[i]} of the factor {key} is not numeric, it is not stored.")
+                    continue
+                file_name = f"column_{self.manifest['n_columns']}.npy"
+                np.save(self.path / file_name, values, allow_pickle=False)
+                self.manifest["n_columns"] += 1
+                columns.append({"name": str(df.columns[i]), "file": file_name})
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.manifest["factors"][key] = columns
+        self._dump_manifest()
+
+    def load(self, keys: list[str]) -> pd.DataFrame:
+        """
+        The columns of the factors `keys`, in order, memory-mapped read-only (read into memory when there are more
+        than `MAX_MAPPED_COLUMNS`).
+        """
+        columns = [column for key in keys for column in self.manifest["factors"][key]]
+        mmap_mode = "r" if len(columns) <= MAX_MAPPED_COLUMNS else None
+        return pd.DataFrame(
+            {i: np.load(self.path / column["file"], mmap_mode=mmap_mode) for i, column in enumerate(columns)},
+            index=self.index,
+            copy=False,
+        ).set_axis([column["name"] for column in columns], axis=1)
+
+    def export(self, path: str | Path, keys: list[str], new_df: pd.DataFrame | None = None) -> QlibFactorStore:
+        """
+        Create at `path` (e.g. in a workspace) the store of the factors `keys` followed by the columns of `new_df`.
+
+        The files of the stored factors are hard-linked (copied if not possible), only `new_df` is written.
+        """
+        exported = QlibFactorStore.create(path, dropna=self.manifest["dropna"])
+        for file_path in self.path.glob("index_*.npy"):
+            _link_or_copy(file_path, exported.path / file_path.name)
+        exported.manifest.update(index_names=self.manifest["index_names"], n_columns=self.manifest["n_columns"])
+        for key in keys:
+            exported.manifest["factors"][key] = self.manifest["factors"][key]
+            for column in self.manifest["factors"][key]:
+                _link_or_copy(self.path / column["file"], exported.path / column["file"])
+        exported._dump_manifest()
+        if new_df is not None:
+            exported.add("new", new_df)
+        return exported
+
+
+def _link_or_copy(source: Path, target: Path) -> None:
+    try:
+        os.link(source, target)
+    except OSError:  # e.g. on another file system
+        shutil.copyfile(source, target)
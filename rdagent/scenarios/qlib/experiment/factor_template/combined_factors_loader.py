@@ -0,0 +1,25 @@
+"""
+The qlib data loader of the combined factors, stored by `rdagent.scenarios.qlib.developer.factor_store` in the
+`combined_factors` folder of the workspace.
+"""
+
+from pathlib import Path
+
+from qlib.data.dataset.loader import StaticDataLoader
+from qlib.utils import get_module_by_module_path
+
+# loaded by path, like this module is loaded by qlib (the workspace is not on `sys.path`)
+read_combined_factors = get_module_by_module_path(
+    str(Path(__file__).parent / "combined_factors_reader.py")
+).read_combined_factors
+
+
+class CombinedFactorsLoader(StaticDataLoader):
+    """Load the combined factors from the store at `path`, on the first use."""
+
+    def __init__(self, path: str = "combined_factors", join: str = "outer") -> None:
+        super().__init__(config=path, join=join)
+
+    def _maybe_load_raw_data(self):
+        if self._data is None:
+            self._data = read_combined_factors(self._config)
@@ -0,0 +1,45 @@
+"""
+Read the combined factors, stored by `rdagent.scenarios.qlib.developer.factor_store` in the `combined_factors`
+folder of the workspace, as the frame expected by qlib.
+
+Only numpy, json and pandas are used (not qlib), so the store is read the same way in and out of the qlib
+environment; `combined_factors_loader.py` is the qlib data loader built on it.
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# like `MAX_MAPPED_COLUMNS` of the store: more columns are read into memory, as each map keeps a file descriptor open
+MAX_MAPPED_COLUMNS = 256
+
+
+def read_combined_factors(path) -> pd.DataFrame:
+    """
+    Read the columns of the store, memory-mapped (read into memory when there are more than `MAX_MAPPED_COLUMNS`),
+    with the ("feature", <factor name>) columns expected by qlib.
+    """
+    path = Path(path)
+    manifest = json.loads((path / "manifest.json").read_text())
+    names = manifest["index_names"]
+    index = pd.MultiIndex(
+        levels=[np.load(path / f"index_level_{i}.npy") for i in range(len(names))],
+        codes=[np.load(path / f"index_codes_{i}.npy", mmap_mode="r") for i in range(len(names))],
+        names=names,
+        verify_integrity=False,
+    )
+    columns = [column for factor_columns in manifest["factors"].values() for column in factor_columns]
+    mmap_mode = "r" if len(columns) <= MAX_MAPPED_COLUMNS else None
+    df = pd.DataFrame(
+        {i: np.load(path / column["file"], mmap_mode=mmap_mode) for i, column in enumerate(columns)},
+        index=index,
+        copy=False,
+    )
+    df.columns = [column["name"] for column in columns]
+    if manifest["dropna"]:
+        df = df.dropna()
+    df = df.loc[:, ~df.columns.duplicated(keep="last")]
+    df.columns = pd.MultiIndex.from_product([["feature"], df.columns])
+    return df
@@ -10,6 +10,12 @@ from jinja2 import Environment, StrictUndefined
 
 from rdagent.components.coder.factor_coder.config import FACTOR_COSTEER_SETTINGS
 from rdagent.utils.env import QTDockerEnv
+from rdagent.utils.frame_store import (
+    dump_frame,
+    is_frame_store,
+    load_frame,
+    read_frame_meta,
+)
 
 
 def generate_data_folder_from_qlib():
@@ -30,27 +36,27 @@ def generate_data_folder_from_qlib():
         Path(__file__).parent / "factor_data_template" / "daily_pv_debug.h5"
     ).exists(), "daily_pv_debug.h5 is not generated."
 
-    Path(FACTOR_COSTEER_SETTINGS.data_folder).mkdir(parents=True, exist_ok=True)
-    shutil.copy(
-        Path(__file__).parent / "factor_data_template" / "daily_pv_all.h5",
-        Path(FACTOR_COSTEER_SETTINGS.data_folder) / "daily_pv.h5",
+    _prepare_data_folder(
+        Path(__file__).parent / "factor_data_template" / "daily_pv_all.h5", Path(FACTOR_COSTEER_SETTINGS.data_folder)
     )
-    shutil.copy(
-        Path(__file__).parent / "factor_data_template" / "README.md",
-        Path(FACTOR_COSTEER_SETTINGS.data_folder) / "README.md",
-    )
-
-    Path(FACTOR_COSTEER_SETTINGS.data_folder_debug).mkdir(parents=True, exist_ok=True)
-    shutil.copy(
+    _prepare_data_folder(
         Path(__file__).parent / "factor_data_template" / "daily_pv_debug.h5",
-        Path(FACTOR_COSTEER_SETTINGS.data_folder_debug) / "daily_pv.h5",
-    )
-    shutil.copy(
-        Path(__file__).parent / "factor_data_template" / "README.md",
-        Path(FACTOR_COSTEER_SETTINGS.data_folder_debug) / "README.md",
+        Path(FACTOR_COSTEER_SETTINGS.data_folder_debug),
     )
 
 
+def _prepare_data_folder(daily_pv_path: Path, data_folder: Path) -> None:
+    """Place the price and volume data and its README in the data folder, in `FACTOR_COSTEER_SETTINGS.data_format`."""
+    template_path = Path(__file__).parent / "factor_data_template"
+    data_folder.mkdir(parents=True, exist_ok=True)
+    if FACTOR_COSTEER_SETTINGS.data_format == "columnar":
+        dump_frame(pd.read_hdf(daily_pv_path, key="data"), data_folder / "daily_pv")
+        shutil.copy(template_path / "README_columnar.md", data_folder / "README.md")
+    else:
+        shutil.copy(daily_pv_path, data_folder / "daily_pv.h5")
+        shutil.copy(template_path / "README.md", data_folder / "README.md")
+
+
 def get_file_desc(p: Path, variable_list=[]) -> str:
     """
     Get the description of a file based on its type.
@@ -76,18 +82,24 @@ def get_file_desc(p: Path, variable_list=[]) -> str:
 """
     )
 
-    if p.name.endswith(".h5"):
-        df = pd.read_hdf(p)
+    if p.name.endswith(".h5") or is_frame_store(p):
+        # the columnar data is described from its metadata, without reading the values
+        if is_frame_store(p):
+            meta = read_frame_meta(p)
+            index_names, dtypes = meta["index_names"], meta["dtypes"]
+        else:
+            df = pd.read_hdf(p)
+            index_names, dtypes = df.index.names, df.dtypes
         # get df.head() as string with full width
         pd.set_option("display.max_columns", None)  # or 1000
         pd.set_option("display.max_rows", None)  # or 1000
         pd.set_option("display.max_colwidth", None)  # or 199
 
-        if isinstance(df.index, pd.MultiIndex):
-            df_info = f"MultiIndex names:, {df.index.names})\n"
+        if len(index_names) > 1:
+            df_info = f"MultiIndex names:, {index_names})\n"
         else:
-            df_info = f"Index name: {df.index.name}\n"
-        columns = df.dtypes.to_dict()
+            df_info = f"Index name: {index_names[0]}\n"
+        columns = dtypes.to_dict()
         filtered_columns = [f"{i, j}" for i, j in columns.items() if i in variable_list]
         if filtered_columns:
             df_info += "Related Data columns: \n"
@@ -96,7 +108,9 @@ def get_file_desc(p: Path, variable_list=[]) -> str:
             df_info += "Data columns: \n"
             df_info += ",".join(columns)
         df_info += "\n"
-        if "REPORT_PERIOD" in df.columns:
+        if "REPORT_PERIOD" in columns:
+            if is_frame_store(p):
+                df = load_frame(p, columns=["REPORT_PERIOD"])
             one_instrument = df.index.get_level_values("instrument")[0]
             df_on_one_instrument = df.loc[pd.IndexSlice[:, one_instrument], ["REPORT_PERIOD"]]
             df_info += f"""
@@ -105,7 +119,7 @@ A snapshot of one instrument, from which you can tell the distribution of the da
 """
         return JJ_TPL.render(
             file_name=p.name,
-            type_desc="h5 info",
+            type_desc="h5 info" if p.name.endswith(".h5") else "columnar data info",
             content=df_info,
         )
     elif p.name.endswith(".md"):
@@ -0,0 +1,173 @@
+"""
+Cross-sectional statistics of factor values, e.g. the daily IC (Pearson correlation) and RankIC (Spearman
+correlation) between a factor and a target.
+
+Instead of calling a Python function per group (e.g. `groupby("datetime").apply(lambda df: df.corr())`), the rows
+are labelled with the code of their group and the statistics are computed with grouped NumPy reductions (segment
+sums) over all the groups and all the columns at once.
+
+The correlations follow `pandas.Series.corr`: the rows where either value is missing are ignored, and the
+correlation of a group with less than two such rows or without variance is NaN.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+
+def group_codes(index: pd.Index, level: str = "datetime") -> tuple[np.ndarray, pd.Index]:
+    """
+    The code of the group of each row, i.e. the position of its `level` value in the sorted unique values
+    (-1 for the missing values), and the unique values.
+    """
+    values = index.get_level_values(level) if isinstance(index, pd.MultiIndex) else index
+    codes, uniques = pd.factorize(values, sort=True)
+    return codes, pd.Index(uniques, name=level)
+
+
+def _segment_sum(values: np.ndarray, codes: np.ndarray, n_groups: int) -> np.ndarray:
+    """The sums of the (n, k) `values` in each group, as a (n_groups, k) array. The codes must not be negative."""
+    k = values.shape[1]
+    flat_codes = (codes[:, None] + n_groups * np.arange(k)).ravel()
+    return np.bincount(flat_codes, weights=values.ravel(), minlength=n_groups * k).reshape(k, n_groups).T
+
+
+def group_rank(values: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """
+    The rank of the (n, k) `values` within their group, column by column, like `groupby(...).rank()`:
+    the ties get their average rank (starting from 1) and the missing values stay missing.
+    """
+    n, k = values.shape
+    ranks = np.full((n, k), np.nan)
+    positions = np.arange(n)
+    # the stable sort of small integers is a fast radix sort
+    small_codes = codes.astype(np.int16 if codes.max(initial=0) < np.iinfo(np.int16).max else np.int32)
+    for j in range(k):
+        # sorted by value then (stably) by group; the missing values are last in their group, so they do not shift
+        # the ranks
+        order = np.argsort(values[:, j])
+        order = order[np.argsort(small_codes[order], kind="stable")]
+        sorted_codes, sorted_values = codes[order], values[order, j]
+        group_start = np.r_[True, sorted_codes[1:] != sorted_codes[:-1]]
+        run_start = group_start | np.r_[True, sorted_values[1:] != sorted_values[:-1]]
+        # the position of each row in its group, and the first and last position of each run of ties
+        position_in_group = positions - np.maximum.accumulate(np.where(group_start, positions, 0))
+        run_first = np.flatnonzero(run_start)
+        run_last = np.r_[run_first[1:], n] - 1
+        run_rank = (position_in_group[run_first] + position_in_group[run_last]) / 2 + 1
+        sorted_ranks = run_rank[np.cumsum(run_start) - 1]
+        sorted_ranks[np.isnan(sorted_values)] = np.nan
+        ranks[order, j] = sorted_ranks
+    return ranks
+
+
+def group_corr(x: np.ndarray, y: np.ndarray, codes: np.ndarray, n_groups: int, method: str = "pearson") -> np.ndarray:
+    """
+    The correlation between each column of the (n, k) `x` and the same column of `y` within each group, as a
+    (n_groups, k) array.
+
+    `method` is "pearson" or "spearman" (the Pearson correlation of the ranks within the group).
+    """
+    if method not in ("pearson", "spearman"):
+        raise ValueError(f"Unknown correlation method: {method}")
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    if (codes < 0).any():  # the rows out of any group
+        x, y, codes = x[codes >= 0], y[codes >= 0], codes[codes >= 0]
+    valid = ~np.isnan(x) & ~np.isnan(y)
+    x, y = np.where(valid, x, np.nan), np.where(valid, y, np.nan)
+    if method == "spearman":
+        x, y = group_rank(x, codes), group_rank(y, codes)
+
+    count = _segment_sum(valid.astype(float), codes, n_groups)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # demeaned within the group (two passes), which is numerically safer than the raw sums of products
+        x_mean = _segment_sum(np.where(valid, x, 0.0), codes, n_groups) / count
+        y_mean = _segment_sum(np.where(valid, y, 0.0), codes, n_groups) / count
+        dx = np.where(valid, x - x_mean[codes], 0.0)
+        dy = np.where(valid, y - y_mean[codes], 0.0)
+        cov = _segment_sum(dx * dy, codes, n_groups)
+        var = _segment_sum(dx * dx, codes, n_groups) * _segment_sum(dy * dy, codes, n_groups)
+        corr = cov / np.sqrt(var)
+    corr[(count < 2) | (var <= 0)] = np.nan
+    return corr
+
+
+def corr_by_group(
+    x: pd.DataFrame | pd.Series, y: pd.DataFrame | pd.Series, level: str = "datetime", method: str = "pearson"
+) -> pd.DataFrame:
+    """
+    The correlation between each column of `x` and the same column of `y` (paired by position) within each group
+    of the `level` of their index, e.g. the daily IC when `method` is "pearson" and the daily RankIC when `method`
+    is "spearman".
+
+    `x` and `y` must share the same index; the result is indexed by the groups and has the columns of `x`.
+    """
+    if not x.index.equals(y.index):
+        raise ValueError("The correlated values must share the same index")
+    x_frame = x.to_frame() if isinstance(x, pd.Series) else x
+    y_frame = y.to_frame() if isinstance(y, pd.Series) else y
+    codes, groups = group_codes(x_frame.index, level)
+    corr = group_corr(x_frame.to_numpy(dtype=float), y_frame.to_numpy(dtype=float), codes, len(groups), method)
+    return pd.DataFrame(corr, index=groups, columns=x_frame.columns)
+
+
+def _block_corr(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    The correlation between each column of the (n, kx) `x` and each column of the (n, ky) `y`, as a (kx, ky) array.
+    """
+    x_valid, y_valid = ~np.isnan(x), ~np.isnan(y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # demeaned by the mean of each column (on its own values), then normalized
+        x = np.where(x_valid, x, 0.0)
+        y = np.where(y_valid, y, 0.0)
+        x = np.where(x_valid, x - x.sum(axis=0) / x_valid.sum(axis=0), 0.0)
+        y = np.where(y_valid, y - y.sum(axis=0) / y_valid.sum(axis=0), 0.0)
+        if x_valid.all() and y_valid.all():
+            count = np.full((x.shape[1], y.shape[1]), float(len(x)))
+            x_norm, y_norm = np.sqrt((x * x).sum(axis=0)), np.sqrt((y * y).sum(axis=0))
+            corr = (x / x_norm).T @ (y / y_norm)
+            degenerate = (x_norm <= 0)[:, None] | (y_norm <= 0)[None, :]
+        else:
+            # each pair ignores the rows where either value is missing: the sums over these rows are products of the
+            # values and of the masks of the other side
+            x_mask, y_mask = x_valid.astype(float), y_valid.astype(float)
+            count = x_mask.T @ y_mask
+            x_sum, y_sum = x.T @ y_mask, x_mask.T @ y
+            cov = x.T @ y - x_sum * y_sum / count
+            x_var = (x * x).T @ y_mask - x_sum**2 / count
+            y_var = x_mask.T @ (y * y) - y_sum**2 / count
+            corr = cov / np.sqrt(x_var * y_var)
+            degenerate = (x_var <= 0) | (y_var <= 0)
+    corr[(count < 2) | degenerate] = np.nan
+    return corr
+
+
+def mean_cross_corr_by_group(x: pd.DataFrame, y: pd.DataFrame, level: str = "datetime") -> pd.DataFrame:
+    """
+    The mean over the groups of the `level` of the index of the correlation between each column of `x` and each
+    column of `y`, e.g. the IC between a set of factors and another one. The groups without correlation (e.g. a
+    column without values on a date) are ignored.
+
+    The rows are sorted by group (unless they already are, e.g. a factor value sorted by date); then the
+    correlations of each group are the product of its demeaned and normalized blocks, so the cost grows with the
+    number of dates rather than the number of pairs of columns.
+    `x` and `y` must share the same index; the result is indexed by the columns of `x` and has the columns of `y`.
+    """
+    if not x.index.equals(y.index):
+        raise ValueError("The correlated values must share the same index")
+    codes, groups = group_codes(x.index, level)
+    if (np.diff(codes) < 0).any():
+        order = np.argsort(codes, kind="stable")
+        codes, x, y = codes[order], x.iloc[order], y.iloc[order]
+    # the rows of each group are a block; only the blocks are copied to arrays, one at a time
+    bounds = np.searchsorted(codes, np.arange(len(groups) + 1))
+
+    corr_sum, corr_count = np.zeros((x.shape[1], y.shape[1])), np.zeros((x.shape[1], y.shape[1]))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        corr = _block_corr(x.iloc[start:end].to_numpy(dtype=float), y.iloc[start:end].to_numpy(dtype=float))
+        valid = ~np.isnan(corr)
+        corr_sum += np.where(valid, corr, 0.0)
+        corr_count += valid
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return pd.DataFrame(corr_sum / corr_count, index=x.columns, columns=y.columns)
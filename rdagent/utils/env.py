@@ -7,14 +7,22 @@ Tries to create uniform environment for the agent to run;
 
 # TODO: move the scenario specific docker env into other folders.
 
+import atexit
 import json
 import os
 import pickle
+import socket
 import subprocess
+import threading
+import time
 import uuid
 from abc import abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Generic, Optional, TypeVar
+from typing import Callable, ClassVar, Generic, Iterator, Optional, TypeVar
 
 import docker
 import docker.models
@@ -26,11 +34,20 @@ from rich.progress import Progress, SpinnerColumn, TextColumn
 from rich.rule import Rule
 from rich.table import Table
 
-from rdagent.core.conf import ExtendedBaseSettings, ExtendedSettingsConfigDict
+from rdagent.core.conf import (
+    RD_AGENT_SETTINGS,
+    ExtendedBaseSettings,
+    ExtendedSettingsConfigDict,
+)
+from rdagent.core.utils import register_subprocess_call_hook
 from rdagent.log import rdagent_logger as logger
 
 ASpecificBaseModel = TypeVar("ASpecificBaseModel", bound=BaseModel)
 
+_ENV_LOG_HANDLER: ContextVar[Callable[[str], None] | None] = ContextVar("env_log_handler", default=None)
+# When it is set (e.g. by `EnvScheduler` for the concurrent jobs), the logs of the runs are passed to it line by line
+# instead of being printed to the console.
+
 
 class Env(Generic[ASpecificBaseModel]):
     """
@@ -73,6 +90,13 @@ class Env(Generic[ASpecificBaseModel]):
             the stdout
         """
 
+    def resource_demand(self) -> tuple[float, int]:
+        """
+        The (CPUs, bytes of memory) taken by a run; `EnvScheduler` uses it to keep the concurrent runs within
+        its budgets. By default a run takes one CPU and an unknown (0) memory.
+        """
+        return 1.0, 0
+
 
 ## Local Environment -----
 
@@ -112,6 +136,9 @@ class LocalEnv(Env[LocalConf]):
         if result.returncode != 0:
             raise RuntimeError(f"Error while running the command: {result.stderr}")
 
+        if (log_handler := _ENV_LOG_HANDLER.get()) is not None:
+            for line in result.stdout.splitlines():
+                log_handler(line)
         return result.stdout
 
 
@@ -138,6 +165,12 @@ class DockerConf(ExtendedBaseSettings):
 
     running_timeout_period: int = 3600  # 1 hour
 
+    container_pool_size: int = 0
+    # The number of long-lived containers kept (per image and mounted volumes) to run the entries by `exec_run`,
+    # so the short runs don't pay for starting and removing a container. 0 means every run uses a new container.
+    # NOTE: a pooled container mounts the parent folder of `local_path` to `mount_path`,
+    # and the entry runs in the sub folder of `local_path`.
+
 
 class QlibDockerConf(DockerConf):
     model_config = ExtendedSettingsConfigDict(env_prefix="QLIB_DOCKER_")
@@ -206,6 +239,122 @@ class MLEBDockerConf(DockerConf):
     )
 
 
+class DockerContainerPool:
+    """
+    A pool of long-lived containers started with the same arguments (image, volumes, resources...).
+    A container runs one entry at a time (by `exec_run`) and is reused by the following runs.
+
+    The pools belong to the process creating them; the containers are removed when the process exits
+    (or after each task of a `multiprocessing_wrapper` worker, which exits without running `atexit`).
+    The containers left by killed processes are removed when a pool is first used on the same host.
+    """
+
+    LABEL: ClassVar[str] = "rdagent.container_pool"
+    _pools: ClassVar[dict[str, "DockerContainerPool"]] = {}
+    _pools_pid: ClassVar[int | None] = None
+    _pools_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    def __init__(self, client: docker.DockerClient, run_kwargs: dict, size: int) -> None:
+        self.client = client
+        self.run_kwargs = run_kwargs
+        self.size = size
+        self._idle: list[docker.models.containers.Container] = []
+        self._n_containers = 0
+        self._cond = threading.Condition()
+
+    @classmethod
+    def get(cls, run_kwargs: dict, size: int) -> "DockerContainerPool":
+        key = json.dumps(run_kwargs, sort_keys=True, default=str)
+        with cls._pools_lock:
+            if cls._pools_pid != os.getpid():
+                # the pools of the parent process are inherited by the forked process; don't share its containers.
+                if cls._pools_pid is None:
+                    atexit.register(cls.shutdown_all)
+                    register_subprocess_call_hook(cls.shutdown_all)
+                cls._pools, cls._pools_pid = {}, os.getpid()
+                cls._remove_stale_containers(docker.from_env())
+            if key not in cls._pools:
+                cls._pools[key] = cls(docker.from_env(), run_kwargs, size)
+            return cls._pools[key]
+
+    @classmethod
+    def _remove_stale_containers(cls, client: docker.DockerClient) -> None:
+        for container in client.containers.list(
+            all=True, filters={"label": f"{cls.LABEL}.host={socket.gethostname()}"}
+        ):
+            try:
+                os.kill(int(container.labels[f"{cls.LABEL}.pid"]), 0)
+            except ProcessLookupError:
+                logger.info(f"Removing the container {container.name} left by an exited process.")
+                container.remove(force=True)
+            except (KeyError, ValueError, PermissionError):
+                continue
+
+    @classmethod
+    def shutdown_all(cls) -> None:
+        with cls._pools_lock:
+            if cls._pools_pid != os.getpid():
+                return
+            pools, cls._pools = cls._pools, {}
+        for pool in pools.values():
+            pool.shutdown()
+
+    def shutdown(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._n_containers -= len(idle)
+        for container in idle:
+            self._remove(container)
+
+    @staticmethod
+    def _remove(container: docker.models.containers.Container) -> None:
+        try:
+            container.remove(force=True)
+        except docker.errors.APIError as e:
+            logger.warning(f"Failed to remove the container {container.name}: {e}")
+
+    def _start(self) -> docker.models.containers.Container:
+        return self.client.containers.run(
+            entrypoint=["tail", "-f", "/dev/null"],  # keep the container alive; the entries are run by `exec_run`
+            detach=True,
+            labels={f"{self.LABEL}.host": socket.gethostname(), f"{self.LABEL}.pid": str(os.getpid())},
+            **self.run_kwargs,
+        )
+
+    @contextmanager
+    def lease(self) -> Iterator[docker.models.containers.Container]:
+        """
+        Borrow a running container of the pool. A new one is started if the pool is not full,
+        otherwise it waits until a container is returned.
+        """
+        with self._cond:
+            while not self._idle and self._n_containers >= self.size:
+                self._cond.wait()
+            container = self._idle.pop() if self._idle else None
+            if container is None:
+                self._n_containers += 1
+        try:
+            if container is not None:
+                container.reload()
+                if container.status != "running":  # e.g. killed by the OOM killer
+                    self._remove(container)
+                    container = None
+            if container is None:
+                container = self._start()
+            yield container
+        except BaseException:
+            # the state of the container is unknown; don't reuse it
+            if container is not None:
+                self._remove(container)
+            with self._cond:
+                self._n_containers -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._idle.append(container)
+            self._cond.notify()
+
+
 # physionet.org/files/mimic-eicu-fiddle-feature/1.0.0/FIDDLE_mimic3
 class DockerEnv(Env[DockerConf]):
     # TODO: Save the output into a specific file
@@ -272,8 +421,10 @@ class DockerEnv(Env[DockerConf]):
         except docker.errors.APIError as e:
             raise RuntimeError(f"Error while pulling the image: {e}")
 
+    _gpu_available: ClassVar[dict[str, bool]] = {}  # image -> whether the GPUs are available in its containers
+
     def _gpu_kwargs(self, client):
-        """get gpu kwargs based on its availability"""
+        """get gpu kwargs based on its availability (probed once per image)"""
         if not self.conf.enable_gpu:
             return {}
         gpu_kwargs = {
@@ -281,12 +432,83 @@ class DockerEnv(Env[DockerConf]):
                 [docker.types.DeviceRequest(count=-1, capabilities=[["gpu"]])] if self.conf.enable_gpu else None
             ),
         }
-        try:
-            client.containers.run(self.conf.image, "nvidia-smi", **gpu_kwargs)
-            logger.info("GPU Devices are available.")
-        except docker.errors.APIError:
-            return {}
-        return gpu_kwargs
+        if self.conf.image not in self._gpu_available:
+            try:
+                client.containers.run(self.conf.image, "nvidia-smi", remove=True, **gpu_kwargs)
+                logger.info("GPU Devices are available.")
+                self._gpu_available[self.conf.image] = True
+            except docker.errors.APIError:
+                self._gpu_available[self.conf.image] = False
+        return gpu_kwargs if self._gpu_available[self.conf.image] else {}
+
+    def resource_demand(self) -> tuple[float, int]:
+        """The memory of a run is its memory limit plus the shared memory (which is backed by the host memory)."""
+        return 1.0, sum(docker.utils.parse_bytes(size) for size in (self.conf.mem_limit, self.conf.shm_size) if size)
+
+    def _print_run_info(
+        self, container: docker.models.containers.Container, entry: str | None, env: dict, volumns: dict
+    ) -> None:
+        if (log_handler := _ENV_LOG_HANDLER.get()) is not None:
+            log_handler(f"Running `{entry}` in the container {container.name} of {self.conf.image}")
+            return
+        print(Rule("[bold green]Docker Logs Begin[/bold green]", style="dark_orange"))
+        table = Table(title="Run Info", show_header=False)
+        table.add_column("Key", style="bold cyan")
+        table.add_column("Value", style="bold magenta")
+        table.add_row("Image", self.conf.image)
+        table.add_row("Container ID", container.id)
+        table.add_row("Container Name", container.name)
+        table.add_row("Entry", entry)
+        table.add_row("Env", "\n".join(f"{k}:{v}" for k, v in env.items()))
+        table.add_row("Volumns", "\n".join(f"{k}:{v}" for k, v in volumns.items()))
+        print(table)
+
+    @staticmethod
+    def _collect_logs(logs: Iterator[bytes]) -> str:
+        log_handler = _ENV_LOG_HANDLER.get()
+        log_output = ""
+        for log in logs:
+            decoded_log = log.strip().decode()
+            if log_handler is None:
+                Console().print(decoded_log, markup=False)
+            else:
+                log_handler(decoded_log)
+            log_output += decoded_log + "\n"
+        if log_handler is None:
+            print(Rule("[bold green]Docker Logs End[/bold green]", style="dark_orange"))
+        return log_output
+
+    def _pooled_run(
+        self,
+        client: docker.DockerClient,
+        entry: str | None,
+        local_path: str | None,
+        env: dict,
+        volumns: dict,
+    ) -> str:
+        """Run the entry in a long-lived container of the pool. The working dir is the mounted `local_path`."""
+        working_dir = self.conf.mount_path
+        if local_path is not None:
+            # mount the parent folder, so the containers can be shared by all the workspaces under it.
+            volumns = {**volumns, os.path.dirname(local_path): {"bind": self.conf.mount_path, "mode": "rw"}}
+            del volumns[local_path]
+            working_dir = f"{self.conf.mount_path.rstrip('/')}/{os.path.basename(local_path)}"
+        pool = DockerContainerPool.get(
+            run_kwargs=dict(
+                image=self.conf.image,
+                volumes={str(lp): rp for lp, rp in volumns.items()},
+                working_dir=self.conf.mount_path,
+                network=self.conf.network,
+                shm_size=self.conf.shm_size,
+                mem_limit=self.conf.mem_limit,
+                **self._gpu_kwargs(client),
+            ),
+            size=self.conf.container_pool_size,
+        )
+        with pool.lease() as container:
+            self._print_run_info(container, entry, env, volumns)
+            _, logs = container.exec_run(cmd=entry, workdir=working_dir, environment=env, stream=True)
+            return self._collect_logs(logs)
 
     def __run(
         self,
@@ -310,9 +532,9 @@ class DockerEnv(Env[DockerConf]):
             for lp, rp in running_extra_volume.items():
                 volumns[lp] = {"bind": rp, "mode": "rw"}
 
-        log_output = ""
-
         try:
+            if self.conf.container_pool_size > 0:
+                return self._pooled_run(client, entry, local_path, env, volumns)
             container: docker.models.containers.Container = client.containers.run(
                 image=self.conf.image,
                 command=entry,
@@ -327,22 +549,8 @@ class DockerEnv(Env[DockerConf]):
                 **self._gpu_kwargs(client),
             )
             logs = container.logs(stream=True)
-            print(Rule("[bold green]Docker Logs Begin[/bold green]", style="dark_orange"))
-            table = Table(title="Run Info", show_header=False)
-            table.add_column("Key", style="bold cyan")
-            table.add_column("Value", style="bold magenta")
-            table.add_row("Image", self.conf.image)
-            table.add_row("Container ID", container.id)
-            table.add_row("Container Name", container.name)
-            table.add_row("Entry", entry)
-            table.add_row("Env", "\n".join(f"{k}:{v}" for k, v in env.items()))
-            table.add_row("Volumns", "\n".join(f"{k}:{v}" for k, v in volumns.items()))
-            print(table)
-            for log in logs:
-                decoded_log = log.strip().decode()
-                Console().print(decoded_log, markup=False)
-                log_output += decoded_log + "\n"
-            print(Rule("[bold green]Docker Logs End[/bold green]", style="dark_orange"))
+            self._print_run_info(container, entry, env, volumns)
+            log_output = self._collect_logs(logs)
             container.wait()
             container.stop()
             container.remove()
@@ -448,3 +656,148 @@ class MLEBDockerEnv(DockerEnv):
 
     def __init__(self, conf: DockerConf = MLEBDockerConf()):
         super().__init__(conf)
+
+
+## Scheduler of the runs -----
+
+
+@dataclass
+class EnvJob:
+    """A run of `Env.run` scheduled by `EnvScheduler`."""
+
+    entry: str | None = None
+    local_path: str | None = None
+    env: dict | None = None
+    run_kwargs: dict = field(default_factory=dict)  # the extra arguments of the env, e.g. `running_extra_volume`
+    cpu: float | None = None  # None means `Env.resource_demand`
+    memory: int | None = None  # bytes; None means `Env.resource_demand`
+    name: str | None = None  # the name in the logs; `local_path` by default
+
+
+class EnvScheduler:
+    """
+    Run the jobs of the environments (e.g. all the candidate workspaces of a loop) concurrently, while keeping the
+    jobs running at the same time within the budgets of the number of jobs, CPUs and memory.
+
+    - The resources of a job are `Env.resource_demand` (e.g. the `mem_limit` + `shm_size` of a docker env) unless
+      they are given by the job. A job exceeding a budget by itself runs alone.
+    - The jobs start in the order they are submitted; `submit` returns a future of the stdout.
+    - The logs of a job are passed to its `log_handler` line by line (prefixed by the job name to the logger by
+      default), so the logs of the concurrent jobs don't interleave on the console.
+
+    .. code-block:: python
+
+        with EnvScheduler() as scheduler:
+            futures = scheduler.submit_batch(QTDockerEnv(), [EnvJob(local_path=str(ws)) for ws in workspaces])
+            results = [future.result() for future in futures]
+    """
+
+    def __init__(
+        self,
+        max_jobs: int | None = None,
+        cpu_budget: float | None = None,
+        memory_budget: int | str | None = None,
+    ) -> None:
+        self.max_jobs = RD_AGENT_SETTINGS.env_scheduler_max_jobs if max_jobs is None else max_jobs
+        self.cpu_budget = cpu_budget or RD_AGENT_SETTINGS.env_scheduler_cpu_budget or float(os.cpu_count() or 1)
+        memory_budget = memory_budget or RD_AGENT_SETTINGS.env_scheduler_memory_budget
+        self.memory_budget = (
+            self._physical_memory() if memory_budget is None else docker.utils.parse_bytes(memory_budget)
+        )
+        self._executor = ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix="EnvScheduler")
+        self._cond = threading.Condition()
+        self._queue: list[int] = []  # the tickets of the jobs waiting for resources, in the submitted order
+        self._next_ticket = 0
+        self._running_n = 0
+        self._cpu_used = 0.0
+        self._memory_used = 0
+
+    @staticmethod
+    def _physical_memory() -> int | None:
+        try:
+            return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+        except (AttributeError, ValueError, OSError):  # not available on the platform; the memory is not limited
+            return None
+
+    def _fits(self, cpu: float, memory: int) -> bool:
+        if self._running_n == 0:
+            return True  # a job exceeding the budgets runs alone
+        return self._cpu_used + cpu <= self.cpu_budget and (
+            self.memory_budget is None or self._memory_used + memory <= self.memory_budget
+        )
+
+    @contextmanager
+    def _reserve(self, ticket: int, cpu: float, memory: int) -> Iterator[None]:
+        with self._cond:
+            # first come first served, so a large job isn't starved by the small ones submitted after it
+            self._cond.wait_for(lambda: self._queue[0] == ticket and self._fits(cpu, memory))
+            self._queue.pop(0)
+            self._running_n += 1
+            self._cpu_used += cpu
+            self._memory_used += memory
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running_n -= 1
+                self._cpu_used -= cpu
+                self._memory_used -= memory
+                self._cond.notify_all()
+
+    def _run(
+        self, ticket: int, env: Env, job: EnvJob, cpu: float, memory: int, log_handler: Callable[[str], None]
+    ) -> str:
+        with self._reserve(ticket, cpu, memory):
+            token = _ENV_LOG_HANDLER.set(log_handler)
+            start = time.time()
+            try:
+                return env.run(entry=job.entry, local_path=job.local_path, env=job.env, **job.run_kwargs)
+            finally:
+                _ENV_LOG_HANDLER.reset(token)
+                logger.info(f"[{job.name}] finished in {time.time() - start:.2f}s")
+
+    def submit(self, env: Env, job: EnvJob, log_handler: Callable[[str], None] | None = None) -> Future:
+        default_cpu, default_memory = env.resource_demand()
+        cpu = default_cpu if job.cpu is None else job.cpu
+        memory = default_memory if job.memory is None else job.memory
+        if job.name is None:
+            job.name = job.local_path or job.entry or f"job {self._next_ticket}"
+        if log_handler is None:
+
+            def log_handler(line: str) -> None:
+                logger.info(f"[{job.name}] {line}")
+
+        # the tickets are given to the executor in their order: otherwise, with concurrent submissions, a worker may
+        # wait for a ticket whose job is queued behind its own in the executor (e.g. with a single worker)
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            self._queue.append(ticket)
+            future = self._executor.submit(self._run, ticket, env, job, cpu, memory, log_handler)
+        future.add_done_callback(lambda f: f.cancelled() and self._drop(ticket))
+        return future
+
+    def _drop(self, ticket: int) -> None:
+        """Remove the ticket of a cancelled job, so the jobs after it are not blocked."""
+        with self._cond:
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+    def submit_batch(
+        self, env: Env, jobs: list[EnvJob], log_handler: Callable[[EnvJob, str], None] | None = None
+    ) -> list[Future]:
+        return [
+            self.submit(env, job, None if log_handler is None else (lambda line, job=job: log_handler(job, line)))
+            for job in jobs
+        ]
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self) -> "EnvScheduler":
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.shutdown()
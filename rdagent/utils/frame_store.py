@@ -0,0 +1,215 @@
+"""
+A columnar, memory-mappable store of pandas objects (e.g. the factor values).
+
+A frame is stored as a directory of:
+
+- `column_<i>.npy`: the values of the i-th column, one `.npy` file per column;
+- `index_<i>.npy`: the codes of the i-th level of a `MultiIndex` (or the values of a plain index);
+- `meta.pkl`: the side-car with the column labels, the index names and levels, and the few columns or indexes
+  whose dtype is not a plain numpy one (e.g. `object`), which are pickled there instead.
+
+`load_frame` maps the `.npy` files, so loading does not read the values; selecting some columns or a range of
+dates only touches the values selected. Each call maps the columns privately (copy-on-write, `mmap_mode="c"`): the
+frames loaded from the same store share the pages of the files in the OS page cache, while modifying a loaded frame
+copies the pages it modifies, so it neither writes to the files nor changes the other loaded frames.
+"""
+
+from __future__ import annotations
+
+import functools
+import pickle
+import shutil
+import uuid
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+META_FILE = "meta.pkl"
+
+
+def _map_array(path: Path, mode: str = "r") -> np.ndarray:
+    # a plain ndarray view of the memory map; it keeps the map open
+    return np.load(path, mmap_mode=mode).view(np.ndarray)
+
+
+def _dump_array(values: pd.Series | pd.Index, path: Path) -> bool:
+    """Save the values to `path` if they can be memory-mapped (i.e. of a plain numpy dtype) and tell whether saved."""
+    if not isinstance(values.dtype, np.dtype) or values.dtype == object:
+        return False
+    np.save(path, np.ascontiguousarray(values.to_numpy(copy=False)), allow_pickle=False)
+    return True
+
+
+def dump_frame(data: pd.DataFrame | pd.Series, path: str | Path) -> None:
+    """
+    Store the frame (or series) in the directory `path`, replacing the previous content.
+
+    The directory is written aside and renamed, so the readers never see a partially written store.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+    tmp_path.mkdir()
+
+    is_series = isinstance(data, pd.Series)
+    frame = data.to_frame() if is_series else data
+    meta: dict[str, Any] = {
+        "series": is_series,
+        "series_name": data.name if is_series else None,
+        "columns": frame.columns,
+        "pickled_columns": {},
+    }
+    for i in range(frame.shape[1]):
+        column = frame.iloc[:, i]
+        if not _dump_array(column, tmp_path / f"column_{i}.npy"):
+            meta["pickled_columns"][i] = column.array
+
+    index = frame.index
+    meta["index_names"] = list(index.names)
+    if isinstance(index, pd.MultiIndex):
+        meta["index_levels"] = list(index.levels)
+        for i, codes in enumerate(index.codes):
+            np.save(tmp_path / f"index_{i}.npy", codes, allow_pickle=False)
+    else:
+        meta["index_levels"] = None
+        meta["pickled_index"] = None if _dump_array(index, tmp_path / "index_0.npy") else index
+
+    # the side-car is written last: a directory without it is not a store
+    with (tmp_path / META_FILE).open("wb") as f:
+        pickle.dump(meta, f)
+
+    if path.exists():
+        shutil.rmtree(path)
+    tmp_path.rename(path)
+
+
+def is_frame_store(path: str | Path) -> bool:
+    return (Path(path) / META_FILE).exists()
+
+
+@functools.lru_cache(maxsize=64)
+def _load_layout(path: Path, version: int) -> tuple[dict[str, Any], pd.Index]:
+    """
+    The side-car and the index of the store; the index is immutable, so it is mapped read-only and cached.
+    `version` (the modification time of the side-car) invalidates them when the store is rewritten.
+    """
+    with (path / META_FILE).open("rb") as f:
+        meta = pickle.load(f)
+
+    if meta["index_levels"] is not None:
+        index = pd.MultiIndex(
+            levels=meta["index_levels"],
+            codes=[_map_array(path / f"index_{i}.npy") for i in range(len(meta["index_levels"]))],
+            names=meta["index_names"],
+            verify_integrity=False,
+        )
+    elif meta["pickled_index"] is not None:
+        index = meta["pickled_index"]
+    else:
+        index = pd.Index(_map_array(path / "index_0.npy"), name=meta["index_names"][0], copy=False)
+    return meta, index
+
+
+def _load_column(path: Path, meta: dict[str, Any], i: int) -> Any:
+    # the columns are private to the caller: the mapped ones are copy-on-write, the pickled ones are copied
+    if i in meta["pickled_columns"]:
+        return meta["pickled_columns"][i].copy()
+    return _map_array(path / f"column_{i}.npy", mode="c")
+
+
+def _row_selector(index: pd.Index, start: Any, end: Any) -> slice | np.ndarray:
+    """The rows of `index` whose first level (e.g. the datetime) is between `start` and `end` (both included)."""
+    level = index.levels[0] if isinstance(index, pd.MultiIndex) else index
+    if level.is_monotonic_increasing:
+        first, last = level.slice_locs(start, end)
+        if not isinstance(index, pd.MultiIndex):
+            return slice(first, last)
+        codes = index.codes[0]
+        if (np.diff(codes) >= 0).all():  # e.g. sorted by date: the rows of the range are contiguous
+            return slice(*np.searchsorted(codes, [first, last]))
+        return (codes >= first) & (codes < last)
+    values = index.get_level_values(0)
+    mask = np.ones(len(index), dtype=bool)
+    if start is not None:
+        mask &= values >= start
+    if end is not None:
+        mask &= values <= end
+    return mask
+
+
+def select_frame(
+    frame: pd.DataFrame | pd.Series, columns: list | None = None, start: Any = None, end: Any = None
+) -> pd.DataFrame | pd.Series:
+    """The `columns` of the frame, in its rows whose first index level (e.g. the datetime) is in [`start`, `end`]."""
+    if columns is not None:
+        frame = frame[list(columns)]
+    if start is not None or end is not None:
+        frame = frame.iloc[_row_selector(frame.index, start, end)]
+    return frame
+
+
+def load_frame(
+    path: str | Path, columns: list | None = None, start: Any = None, end: Any = None
+) -> pd.DataFrame | pd.Series:
+    """
+    Load the frame (or series) stored in the directory `path`.
+
+    The values are memory-mapped copy-on-write by each call, so the returned frame can be modified freely.
+    Only the `columns` and the rows between `start` and `end` (see `select_frame`) are read when they are given.
+    """
+    path = Path(path).absolute()
+    meta, index = _load_layout(path, (path / META_FILE).stat().st_mtime_ns)
+    if columns is None:
+        positions = np.arange(len(meta["columns"]))
+    else:
+        positions = meta["columns"].get_indexer_for(list(columns))
+        if (positions < 0).any():
+            raise KeyError(f"{[c for c in columns if c not in meta['columns']]} not in index")
+    frame = pd.DataFrame(
+        {j: _load_column(path, meta, i) for j, i in enumerate(positions)}, index=index.copy(), copy=False
+    )
+    frame.columns = meta["columns"][positions]
+    if meta["series"]:
+        frame = frame.iloc[:, 0].rename(meta["series_name"])
+    return select_frame(frame, None, start, end)
+
+
+def read_frame_meta(path: str | Path) -> dict[str, Any]:
+    """
+    The description of the stored frame without reading its values: the `index_names`, the `dtypes` of the
+    columns (like `DataFrame.dtypes`) and the number of rows (`length`).
+    """
+    path = Path(path)
+    with (path / META_FILE).open("rb") as f:
+        meta = pickle.load(f)
+    dtypes = [
+        (
+            meta["pickled_columns"][i].dtype
+            if i in meta["pickled_columns"]
+            else _map_array(path / f"column_{i}.npy").dtype
+        )
+        for i in range(len(meta["columns"]))
+    ]
+    if meta["index_levels"] is None and meta["pickled_index"] is not None:
+        length = len(meta["pickled_index"])
+    else:
+        length = len(_map_array(path / "index_0.npy"))
+    return {
+        "index_names": meta["index_names"],
+        "dtypes": pd.Series(dtypes, index=meta["columns"], dtype=object),
+        "length": length,
+    }
+
+
+def read_frame(
+    path: str | Path, columns: list | None = None, start: Any = None, end: Any = None
+) -> pd.DataFrame | pd.Series:
+    """
+    Read a frame from a store (see `load_frame`) or, for compatibility, from an HDF5 file (e.g. `daily_pv.h5`),
+    with the same selection of the `columns` and of the rows between `start` and `end`.
+    """
+    if is_frame_store(path):
+        return load_frame(path, columns, start, end)
+    return select_frame(pd.read_hdf(path), columns, start, end)
@@ -0,0 +1,125 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from rdagent.core.utils import multiprocessing_wrapper
+from rdagent.oai.llm_conf import LLM_SETTINGS
+from rdagent.oai.llm_utils import FileLazyCache, SQliteLazyCache, md5_hash
+
+
+def _set_chat(cache_cls: type, cache_location: str, i: int) -> None:
+    cache_cls(cache_location=cache_location).chat_set(f"question {i}", f"answer {i}")
+
+
+def _single_flight_chat(cache_cls: type, cache_location: str, calls_path: str) -> str:
+    cache = cache_cls(cache_location=cache_location)
+    with cache.single_flight("question"):
+        answer = cache.chat_get("question")
+        if answer is None:
+            with open(calls_path, "a") as f:
+                f.write("called\n")
+            time.sleep(0.5)  # the duplicated requests arrive while it is in flight
+            answer = "answer"
+            cache.chat_set("question", answer)
+    return answer
+
+
+@pytest.mark.offline
+class TestLLMCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.origin_value = (LLM_SETTINGS.prompt_cache_commit_batch_size, LLM_SETTINGS.prompt_cache_commit_interval)
+        # make sure the writes are buffered
+        LLM_SETTINGS.prompt_cache_commit_batch_size, LLM_SETTINGS.prompt_cache_commit_interval = 1000, 1000
+
+    def tearDown(self) -> None:
+        LLM_SETTINGS.prompt_cache_commit_batch_size, LLM_SETTINGS.prompt_cache_commit_interval = self.origin_value
+        self.tmp_dir.cleanup()
+
+    def _check_cache(self, cache_cls: type, cache_location: str) -> None:
+        cache = cache_cls(cache_location=cache_location)
+        assert cache.chat_get("question") is None
+        cache.chat_set("question", "answer")
+        cache.embedding_set({"hello": [0.1, 0.2], "world": [0.3, 0.4]})
+        cache.message_set("conv", [{"role": "user", "content": "hi"}])
+        assert cache.chat_get("question") == "answer"
+        assert cache.embedding_get("world") == pytest.approx([0.3, 0.4])
+        hit_mask, embeddings = cache.embedding_get_many(["world", "missing", "hello"])
+        assert hit_mask.tolist() == [True, False, True]
+        assert embeddings.dtype == np.float32
+        np.testing.assert_allclose(embeddings, [[0.3, 0.4], [0.1, 0.2]], rtol=1e-6)
+        assert cache.message_get("conv") == [{"role": "user", "content": "hi"}]
+
+        multiprocessing_wrapper([(_set_chat, (cache_cls, cache_location, i)) for i in range(8)], n=4)
+        cache.flush()
+        for i in range(8):
+            assert cache.chat_get(f"question {i}") == f"answer {i}"
+
+    def test_sqlite_cache(self) -> None:
+        cache_location = str(Path(self.tmp_dir.name) / "prompt_cache.db")
+        self._check_cache(SQliteLazyCache, cache_location)
+        SQliteLazyCache(cache_location=cache_location).flush()
+        # the buffered writes are committed to the database
+        assert SQliteLazyCache(cache_location=cache_location).conn.execute(
+            "SELECT COUNT(*) FROM chat_cache"
+        ).fetchone() == (9,)
+
+    def test_sqlite_legacy_json_embedding(self) -> None:
+        cache = SQliteLazyCache(cache_location=str(Path(self.tmp_dir.name) / "legacy_cache.db"))
+        with cache.conn:
+            cache.conn.execute(
+                "INSERT INTO embedding_cache (md5_key, embedding) VALUES (?, ?)", (md5_hash("legacy"), "[0.5, 0.25]")
+            )
+        cache.embedding_set({"new": [1.0, 2.0]})
+        cache.flush()
+        hit_mask, embeddings = cache.embedding_get_many(["new", "legacy"])
+        assert hit_mask.tolist() == [True, True]
+        np.testing.assert_array_equal(embeddings, np.array([[1.0, 2.0], [0.5, 0.25]], dtype=np.float32))
+
+    def test_single_flight(self) -> None:
+        calls_path = Path(self.tmp_dir.name) / "calls"
+        for cache_cls, name in [(SQliteLazyCache, "single_flight.db"), (FileLazyCache, "single_flight")]:
+            calls_path.unlink(missing_ok=True)
+            cache_location = str(Path(self.tmp_dir.name) / name)
+            answers = multiprocessing_wrapper(
+                [(_single_flight_chat, (cache_cls, cache_location, str(calls_path))) for _ in range(4)], n=4
+            )
+            assert answers == ["answer"] * 4
+            assert calls_path.read_text().count("called") == 1
+
+    def test_file_cache(self) -> None:
+        self._check_cache(FileLazyCache, str(Path(self.tmp_dir.name) / "prompt_cache"))
+
+    def test_message_append_and_prune(self) -> None:
+        LLM_SETTINGS.prompt_cache_commit_interval = 0  # commit every write to get distinct access time
+        for cache in [
+            SQliteLazyCache(cache_location=str(Path(self.tmp_dir.name) / "evict_cache.db")),
+            FileLazyCache(cache_location=str(Path(self.tmp_dir.name) / "evict_cache")),
+        ]:
+            cache.message_append("conv", [{"role": "system", "content": "s"}])
+            cache.message_append("conv", [{"role": "user", "content": "u"}, {"role": "assistant", "content": "a"}])
+            assert [m["role"] for m in cache.message_get("conv")] == ["system", "user", "assistant"]
+
+            for i in range(10):
+                cache.chat_set(f"question {i}", "a" * 100)
+                time.sleep(0.01)
+            cache.chat_get("question 0")  # question 0 becomes the most recently used one
+            cache.flush()
+            cache.prune(max_bytes=500)
+            assert cache.chat_get("question 0") is not None
+            assert cache.chat_get("question 1") is None
+            assert cache.stats()["chat_cache"]["bytes"] <= 500
+
+            time.sleep(0.1)
+            cache.prune(ttl_seconds=0.05)
+            cache.vacuum()
+            assert cache.stats()["chat_cache"]["count"] == 0
+            assert cache.message_get("conv") == []
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import random
 import unittest
@@ -36,6 +37,50 @@ class TestChatCompletion(unittest.TestCase):
         assert isinstance(response, str)
         json.loads(response)
 
+    def test_stream_chat_completion(self) -> None:
+        system_prompt = "You are a helpful assistant. answer in Json format."
+        user_prompt = "What is your name?"
+        chunks = list(
+            APIBackend().stream_chat_completion(
+                system_prompt=system_prompt,
+                user_prompt=user_prompt,
+                json_mode=True,
+            )
+        )
+        assert len(chunks) > 0
+        json.loads("".join(chunks))
+
+        user_prompt = "Write a python function to add two numbers in a markdown code block, then explain it."
+        response = "".join(
+            APIBackend().stream_chat_completion(
+                user_prompt=user_prompt,
+                stop=lambda resp: resp.count("```") >= 2,
+            )
+        )
+        assert response.count("```") == 2
+
+    def test_async_chat_completion(self) -> None:
+        system_prompt = "You are a helpful assistant."
+        user_prompts = [f"What is {i} + {i}? Answer with the number only." for i in range(4)]
+
+        async def _gather() -> list[str]:
+            api = APIBackend()
+            return await asyncio.gather(
+                *[
+                    api.async_build_messages_and_create_chat_completion(
+                        system_prompt=system_prompt,
+                        user_prompt=user_prompt,
+                    )
+                    for user_prompt in user_prompts
+                ]
+            )
+
+        responses = asyncio.run(_gather())
+        assert len(responses) == len(user_prompts)
+        for response in responses:
+            assert response is not None
+            assert isinstance(response, str)
+
     def test_chat_multi_round(self) -> None:
         system_prompt = "You are a helpful assistant."
         fruit_name = random.SystemRandom().choice(["apple", "banana", "orange", "grape", "watermelon"])
@@ -1,3 +1,4 @@
+import asyncio
 import unittest
 
 from rdagent.oai.llm_utils import (
@@ -13,6 +14,12 @@ class TestEmbedding(unittest.TestCase):
         assert isinstance(emb, list)
         assert len(emb) > 0
 
+    def test_async_embedding(self) -> None:
+        embs = asyncio.run(APIBackend().async_create_embedding(["hello", "world"]))
+        assert isinstance(embs, list)
+        assert len(embs) == 2
+        assert all(len(emb) > 0 for emb in embs)
+
     def test_embedding_similarity(self) -> None:
         similarity = calculate_embedding_distance_between_str_list(["Hello"], ["Hi"])[0][0]
         assert similarity is not None
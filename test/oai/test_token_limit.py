@@ -0,0 +1,58 @@
+import re
+import unittest
+from unittest import mock
+
+import pytest
+
+from rdagent.oai.llm_utils import APIBackend
+
+
+class WordEncoder:
+    """
+    A tokenizer standing for tiktoken (which downloads its encodings): each token is a run of up to 3 letters or
+    another character, so the tokens of a rendered prompt are not always those of its parts.
+    """
+
+    name = "test_word_encoder"
+
+    def encode(self, text: str) -> list[str]:
+        return re.findall(r"[a-z]{1,3}|.", text, re.S)
+
+    def decode_with_offsets(self, tokens: list[str]) -> tuple[str, list[int]]:
+        offsets, offset = [], 0
+        for token in tokens:
+            offsets.append(offset)
+            offset += len(token)
+        return "".join(tokens), offsets
+
+
+@pytest.mark.offline
+@mock.patch.object(APIBackend, "_get_encoder", return_value=WordEncoder())
+class TruncateToTokenLimitTest(unittest.TestCase):
+    def test_longest_suffix(self, _):
+        api = APIBackend(chat_api_key="test", embedding_api_key="test")  # no request is sent
+        content = "\n".join(f"line {i}: step{i} finished with code{i % 7}, see traceback" for i in range(40))
+
+        def build_user_prompt(content: str) -> str:
+            return f"Here is the execution log{content}, please check it"
+
+        def calculate_token(content: str) -> int:
+            return api.build_messages_and_calculate_token(build_user_prompt(content), "You are a reviewer.")
+
+        encoder = WordEncoder()
+        _, offsets = encoder.decode_with_offsets(encoder.encode(content))
+        suffixes = [content[offset:] for offset in offsets] + [""]
+        for token_limit in range(calculate_token(""), calculate_token(content) + 2, 7):
+            with self.subTest(token_limit=token_limit):
+                truncated_content, user_prompt = api.build_messages_and_truncate_to_token_limit(
+                    content, build_user_prompt, "You are a reviewer.", token_limit=token_limit
+                )
+                self.assertEqual(user_prompt, build_user_prompt(truncated_content))
+                self.assertLessEqual(calculate_token(truncated_content), token_limit)
+                # the longest suffix (starting at a token of the content) fitting in the limit
+                expected = next(suffix for suffix in suffixes if calculate_token(suffix) <= token_limit)
+                self.assertEqual(truncated_content, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+"""
+Micro-benchmark of the per-call overhead of routing a chat completion to a model in `chat_model_map`.
+
+- before: the caller was looked up with `inspect.stack()[4]` (twice when the caller is not a method).
+- after: the tag is given explicitly (`tag=` / `chat_model_tag`) or looked up with `sys._getframe`.
+
+Usage:
+    python test/scripts/benchmark_chat_model_routing.py --stack_depth 60 --number 200
+"""
+
+import inspect
+import timeit
+
+import fire
+
+from rdagent.oai.llm_utils import _CHAT_MODEL_TAG, _get_caller_tag, chat_model_tag
+
+
+def _inspect_stack_tag() -> str:
+    caller_locals = inspect.stack()[4].frame.f_locals
+    if "self" in caller_locals:
+        return caller_locals["self"].__class__.__name__
+    return inspect.stack()[4].function
+
+
+def _getframe_tag() -> str | None:
+    return _get_caller_tag(depth=4)
+
+
+def _context_tag() -> str | None:
+    tag = _CHAT_MODEL_TAG.get()
+    return _get_caller_tag(depth=4) if tag is None else tag
+
+
+class Evaluator:
+    """The caller of the completion API; the lookup is 4 frames below it like in `APIBackend`."""
+
+    def evaluate(self, lookup: callable, number: int) -> tuple[str | None, float]:
+        return self._api(lookup, number)
+
+    def _api(self, lookup: callable, number: int) -> tuple[str | None, float]:
+        return self._try(lookup, number)
+
+    def _try(self, lookup: callable, number: int) -> tuple[str | None, float]:
+        return self._auto_continue(lookup, number)
+
+    def _auto_continue(self, lookup: callable, number: int) -> tuple[str | None, float]:
+        return lookup(), timeit.timeit(lookup, number=number) / number
+
+
+def _run_in_deep_stack(depth: int, func: callable) -> tuple[str | None, float]:
+    if depth == 0:
+        return func()
+    return _run_in_deep_stack(depth - 1, func)
+
+
+def main(stack_depth: int = 60, number: int = 200) -> None:
+    for name, lookup in [
+        ("inspect.stack()", _inspect_stack_tag),
+        ("sys._getframe", _getframe_tag),
+        ("chat_model_tag", _context_tag),
+    ]:
+        if name == "chat_model_tag":
+            with chat_model_tag("Evaluator"):
+                tag, seconds = _run_in_deep_stack(stack_depth, lambda: Evaluator().evaluate(lookup, number))
+        else:
+            tag, seconds = _run_in_deep_stack(stack_depth, lambda: Evaluator().evaluate(lookup, number))
+        print(f"{name:<16} {seconds * 1e6:>12.2f} us/call  tag={tag} (stack depth ~{stack_depth})")
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,111 @@
+"""
+Benchmark of the value checks of `FactorValueEvaluator` on synthetic factor values, with and without a shared
+`FactorEvaluationContext`.
+
+Without a context, each check loads (e.g. unpickles from the execution cache) and sorts both factor values again;
+with a context, they are loaded, sorted and aligned once for all the checks. The checks calling the LLM
+(e.g. `FactorOutputFormatEvaluator`) are left out.
+
+Usage:
+    python test/scripts/benchmark_factor_evaluation.py --n_dates 2500 --n_instruments 800 --repeat 3
+"""
+
+import pickle
+import tempfile
+import time
+from pathlib import Path
+
+import fire
+import numpy as np
+import pandas as pd
+
+from rdagent.components.coder.factor_coder.eva_utils import (
+    FactorCorrelationEvaluator,
+    FactorDatetimeDailyEvaluator,
+    FactorEqualValueRatioEvaluator,
+    FactorEvaluationContext,
+    FactorIndexEvaluator,
+    FactorInfEvaluator,
+    FactorMissingValuesEvaluator,
+    FactorRowCountEvaluator,
+    FactorSingleColumnEvaluator,
+)
+from rdagent.utils.frame_store import dump_frame, load_frame
+
+
+class _PickledWorkspace:
+    """A workspace whose execution is unpickled from the cache on each call."""
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        self.cached = pickle.dumps(("Execution succeeded without error.", df))
+
+    def execute(self, data_type: str = "Debug") -> tuple[str, pd.DataFrame]:
+        return pickle.loads(self.cached)
+
+
+class _StoredWorkspace:
+    """A workspace whose execution is loaded from its factor value store on each call."""
+
+    def __init__(self, df: pd.DataFrame, path: Path) -> None:
+        dump_frame(df.sort_index(), path)
+        self.path = path
+
+    def execute(self, data_type: str = "Debug") -> tuple[str, pd.DataFrame]:
+        return "Execution succeeded without error.", load_frame(self.path)
+
+
+def _synthetic_factors(n_dates: int, n_instruments: int, rng: np.random.Generator) -> tuple[pd.DataFrame, ...]:
+    index = pd.MultiIndex.from_product(
+        [pd.date_range("2010-01-01", periods=n_dates), [f"SH{i:06d}" for i in range(n_instruments)]],
+        names=["datetime", "instrument"],
+    )
+    gt_df = pd.DataFrame({"factor": rng.standard_normal(len(index))}, index=index)
+    # a close but not equal implementation, so that every check (including the correlation) runs
+    gen_df = gt_df + 0.1 * rng.standard_normal((len(index), 1))
+    return gen_df.sample(frac=1, random_state=0), gt_df
+
+
+def _evaluate(implementation, gt_implementation, context: FactorEvaluationContext | None) -> list:
+    evaluators = [
+        FactorSingleColumnEvaluator(),
+        FactorInfEvaluator(),
+        FactorDatetimeDailyEvaluator(),
+        FactorRowCountEvaluator(),
+        FactorIndexEvaluator(),
+        FactorMissingValuesEvaluator(),
+        FactorEqualValueRatioEvaluator(),
+        FactorCorrelationEvaluator(hard_check=True),
+    ]
+    return [evaluator.evaluate(implementation, gt_implementation, context=context) for evaluator in evaluators]
+
+
+def _timed(func, repeat: int) -> float:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def main(n_dates: int = 2500, n_instruments: int = 800, repeat: int = 3):
+    gen_df, gt_df = _synthetic_factors(n_dates, n_instruments, np.random.default_rng(0))
+    print(f"{len(gt_df)} rows per factor")
+
+    separate = _timed(lambda: _evaluate(_PickledWorkspace(gen_df), _PickledWorkspace(gt_df), None), repeat)
+    print(f"separate loads (pickle cache): {separate:.2f} s/factor")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        implementation = _StoredWorkspace(gen_df, Path(tmp_dir) / "gen")
+        gt_implementation = _StoredWorkspace(gt_df, Path(tmp_dir) / "gt")
+        shared = _timed(
+            lambda: _evaluate(
+                implementation, gt_implementation, FactorEvaluationContext(implementation, gt_implementation)
+            ),
+            repeat,
+        )
+    print(f"shared context (factor value store): {shared:.2f} s/factor ({separate / shared:.1f}x)")
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
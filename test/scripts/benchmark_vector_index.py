@@ -0,0 +1,61 @@
+"""
+Benchmark of the recall and the latency of the approximate `IVFVectorIndex` against the exact `VectorIndex` on
+synthetic clustered embeddings (the embeddings of a knowledge base are clustered by topic, not uniform).
+
+Usage:
+    python test/scripts/benchmark_vector_index.py --n 100000 --dim 256 --nprobes "[4,16,64]"
+"""
+
+import time
+
+import fire
+import numpy as np
+
+from rdagent.components.knowledge_management.vector_base import (
+    IVFVectorIndex,
+    VectorIndex,
+)
+
+
+def _synthetic_embeddings(n: int, dim: int, n_topics: int, rng: np.random.Generator) -> np.ndarray:
+    topics = rng.standard_normal((n_topics, dim)).astype(np.float32)
+    return topics[rng.integers(n_topics, size=n)] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def _timed_search(index: VectorIndex, queries: np.ndarray, topk_k: int) -> tuple[list[np.ndarray], float]:
+    start = time.perf_counter()
+    results = [index.search(query, topk_k=topk_k, similarity_threshold=-1)[0][0] for query in queries]
+    return results, (time.perf_counter() - start) / len(queries)
+
+
+def main(
+    n: int = 100_000,
+    dim: int = 256,
+    n_topics: int = 1000,
+    n_queries: int = 200,
+    query_noise: float = 0.5,
+    topk_k: int = 5,
+    nprobes=(4, 16, 64),
+):
+    rng = np.random.default_rng(0)
+    embeddings = _synthetic_embeddings(n, dim, n_topics, rng)
+    # the queries are close to the stored embeddings, like the lookups of an existing knowledge
+    queries = embeddings[rng.choice(n, n_queries, replace=False)]
+    queries = queries + query_noise * rng.standard_normal(queries.shape).astype(np.float32)
+
+    exact, exact_latency = _timed_search(VectorIndex(embeddings), queries, topk_k)
+    print(f"exact: {exact_latency * 1e3:.2f} ms/query")
+
+    index = IVFVectorIndex(embeddings)
+    start = time.perf_counter()
+    index.train()
+    print(f"ivf training: {time.perf_counter() - start:.2f} s")
+    for nprobe in nprobes:
+        index.nprobe = nprobe
+        results, latency = _timed_search(index, queries, topk_k)
+        recall = np.mean([len(np.intersect1d(r, e)) / len(e) for r, e in zip(results, exact)])
+        print(f"ivf nprobe={nprobe}: recall@{topk_k}={recall:.3f}, {latency * 1e3:.2f} ms/query")
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,102 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from rdagent.components.coder.CoSTEER.evaluators import CoSTEERSingleFeedback
+from rdagent.components.coder.CoSTEER.knowledge_management import (
+    CoSTEERKnowledge,
+    CoSTEERKnowledgeBaseV2,
+)
+from rdagent.components.coder.CoSTEER.knowledge_store import CoSTEERKnowledgeBaseStore
+from rdagent.components.coder.factor_coder.factor import FactorFBWorkspace, FactorTask
+from rdagent.components.knowledge_management.graph import Graph, UndirectedNode
+
+
+def _batch_embedding(nodes: list[UndirectedNode]) -> list[UndirectedNode]:
+    for node in nodes:
+        node.embedding = np.random.rand(8).tolist()
+    return nodes
+
+
+def _node(content: str, label: str) -> UndirectedNode:
+    return _batch_embedding([UndirectedNode(content=content, label=label)])[0]
+
+
+def _knowledge(task: FactorTask, code: str, final_decision: bool) -> CoSTEERKnowledge:
+    workspace = FactorFBWorkspace(target_task=task)
+    workspace.code_dict = {"factor.py": code}
+    return CoSTEERKnowledge(task, workspace, CoSTEERSingleFeedback(final_decision=final_decision))
+
+
+@pytest.mark.offline
+@mock.patch.object(Graph, "batch_embedding", staticmethod(_batch_embedding))
+class CoSTEERKnowledgeBaseStoreTest(unittest.TestCase):
+    def test_append_and_lazy_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store_path = Path(tmp_dir) / "knowledge_base"
+            self.assertTrue(CoSTEERKnowledgeBaseStore.is_store_path(store_path))
+
+            kb = CoSTEERKnowledgeBaseV2()
+            task = FactorTask("factor_a", "description of factor a", "a = b")
+            info = task.get_task_information()
+            failed, succeeded = _knowledge(task, "a = 1", False), _knowledge(task, "a = 2", True)
+            error = _node("division by zero", "error")
+            kb.graph.add_node(error)
+            kb.task_to_component_nodes[info] = [_node("momentum", "component")]
+            kb.working_trace_knowledge[info] = [failed, succeeded]
+            kb.working_trace_error_analysis[info] = [[error]]
+            kb.success_task_to_knowledge_dict[info] = succeeded
+            kb.update_success_task(info)
+
+            store = CoSTEERKnowledgeBaseStore(store_path)
+            store.save(kb)
+            log_size = (store_path / "log.pkl").stat().st_size
+            store.save(kb)  # nothing changed
+            self.assertEqual((store_path / "log.pkl").stat().st_size, log_size)
+
+            loaded = CoSTEERKnowledgeBaseStore(store_path).load()
+            self.assertEqual(set(loaded.graph.nodes), set(kb.graph.nodes))
+            for node_id, node in kb.graph.nodes.items():
+                loaded_node = loaded.graph.get_node(node_id)
+                self.assertEqual({n.id for n in loaded_node.neighbors}, {n.id for n in node.neighbors})
+                np.testing.assert_allclose(loaded_node.embedding, node.embedding, rtol=1e-6)
+            self.assertEqual([r["id"] for r in loaded.graph.vector_base.records], list(kb.graph.nodes))
+            self.assertEqual(
+                loaded.graph.get_all_nodes_by_label_list(["task_trace"])[0].content,
+                failed.get_implementation_and_feedback_str(),
+            )
+
+            # the implementations are only unpickled on access, and shared like in the saved knowledge base
+            self.assertEqual(loaded.success_task_to_knowledge_dict.decoded_items(), [])
+            loaded_succeeded = loaded.success_task_to_knowledge_dict[info]
+            self.assertEqual(loaded_succeeded.implementation.code_dict, {"factor.py": "a = 2"})
+            self.assertIs(loaded.working_trace_knowledge[info][1], loaded_succeeded)
+            self.assertIs(loaded.working_trace_error_analysis[info][0][0], loaded.graph.get_node(error.id))
+
+            # the changes are appended to the store it was loaded from
+            store = CoSTEERKnowledgeBaseStore(store_path)
+            loaded = store.load()
+            other_task = FactorTask("factor_b", "description of factor b", "b = c")
+            loaded.working_trace_knowledge.setdefault(info, []).append(_knowledge(task, "a = 3", False))
+            loaded.success_task_to_knowledge_dict[other_task.get_task_information()] = _knowledge(
+                other_task, "b = 1", True
+            )
+            loaded.graph.add_node(_node("overflow", "error"), _node("volume", "component"))
+            store.save(loaded)
+            self.assertGreater((store_path / "log.pkl").stat().st_size, log_size)
+
+            reloaded = CoSTEERKnowledgeBaseStore(store_path).load()
+            self.assertEqual(reloaded.graph.size(), kb.graph.size() + 2)
+            self.assertEqual(
+                [k.implementation.code_dict["factor.py"] for k in reloaded.working_trace_knowledge[info]],
+                ["a = 1", "a = 2", "a = 3"],
+            )
+            self.assertEqual(list(reloaded.success_task_to_knowledge_dict), [info, other_task.get_task_information()])
+
+
+if __name__ == "__main__":
+    unittest.main()
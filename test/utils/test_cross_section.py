@@ -0,0 +1,58 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from rdagent.utils.cross_section import corr_by_group, mean_cross_corr_by_group
+
+
+@pytest.mark.offline
+class CrossSectionTest(unittest.TestCase):
+    def test_corr_by_group(self):
+        rng = np.random.default_rng(0)
+        index = pd.MultiIndex.from_product(
+            [pd.date_range("2020-01-01", periods=20), [f"SH{i:06d}" for i in range(30)]],
+            names=["datetime", "instrument"],
+        )
+        x = pd.Series(rng.standard_normal(len(index)), index=index).round(1)  # with ties
+        y = x + rng.standard_normal(len(index))
+        x[rng.random(len(index)) < 0.1] = np.nan
+        y[rng.random(len(index)) < 0.1] = np.nan
+        y.loc["2020-01-05"] = 1.0  # without variance
+        x.loc["2020-01-06"] = np.nan  # without values
+
+        df = pd.concat([x, y], axis=1, keys=["x", "y"])
+        for method in ["pearson", "spearman"]:
+            expected = df.groupby("datetime").apply(lambda d: d["x"].corr(d["y"], method=method))
+            result = corr_by_group(x, y, method=method).iloc[:, 0]
+            np.testing.assert_allclose(result.to_numpy(), expected.to_numpy(), equal_nan=True)
+            self.assertTrue(result.index.equals(expected.index))
+
+    def test_mean_cross_corr_by_group(self):
+        rng = np.random.default_rng(0)
+        index = pd.MultiIndex.from_product(
+            [pd.date_range("2020-01-01", periods=20), [f"SH{i:06d}" for i in range(30)]],
+            names=["datetime", "instrument"],
+        )
+        x = pd.DataFrame(rng.standard_normal((len(index), 4)), index=index, columns=list("abcd"))
+        y = pd.DataFrame(rng.standard_normal((len(index), 2)), index=index, columns=["e", "f"])
+        y["f"] = x["b"] + 0.1 * rng.standard_normal(len(index))
+        x = x.mask(rng.random(x.shape) < 0.1)
+        x.loc["2020-01-03", "c"] = np.nan  # without values on a date
+
+        result = mean_cross_corr_by_group(x, y)
+        for x_column in x.columns:
+            for y_column in y.columns:
+                expected = (
+                    pd.concat([x[x_column], y[y_column]], axis=1, keys=["x", "y"])
+                    .groupby("datetime")
+                    .apply(lambda d: d["x"].corr(d["y"]))
+                    .mean()
+                )
+                self.assertAlmostEqual(result.loc[x_column, y_column], expected)
+        self.assertGreater(result.loc["b", "f"], 0.99)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,8 +5,19 @@ from pathlib import Path
 
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 import shutil
+import tempfile
+import threading
 
-from rdagent.utils.env import LocalConf, LocalEnv, QlibDockerConf, QTDockerEnv
+import pytest
+
+from rdagent.utils.env import (
+    EnvJob,
+    EnvScheduler,
+    LocalConf,
+    LocalEnv,
+    QlibDockerConf,
+    QTDockerEnv,
+)
 
 DIRNAME = Path(__file__).absolute().resolve().parent
 
@@ -53,6 +64,17 @@ class EnvUtils(unittest.TestCase):
         result = qtde.run(local_path=str(DIRNAME / "env_tpl"), entry="python read_exp_res.py")
         print(result)
 
+    def test_docker_pool(self):
+        """The runs share the long-lived containers of the pool"""
+        qtde = QTDockerEnv()
+        qtde.conf.container_pool_size = 1
+        qtde.prepare()
+        first = qtde.run(local_path=str(DIRNAME / "env_tpl"), entry="hostname")
+        second = qtde.run(local_path=str(DIRNAME / "env_tpl"), entry="hostname")
+        self.assertEqual(first, second)
+        result = qtde.run(local_path=str(DIRNAME / "env_tpl"), entry="ls")
+        self.assertIn("conf.yaml", result)
+
     def test_docker_mem(self):
         cmd = 'python -c \'print("start"); import numpy as np;  size_mb = 500; size = size_mb * 1024 * 1024 // 8; array = np.random.randn(size).astype(np.float64); print("success")\''
 
@@ -71,5 +93,46 @@ class EnvUtils(unittest.TestCase):
         # docker run  --memory=10g  -it --rm local_qlib:latest python -c 'import numpy as np; print(123);  size_mb = 1; size = size_mb * 1024 * 1024 // 8; array = np.random.randn(size).astype(np.float64); array[0], array[-1] = 1.0, 1.0; print(321)'
 
 
+@pytest.mark.offline
+class EnvSchedulerTest(unittest.TestCase):
+    def test_scheduler_budgets(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            (Path(tmp_dir) / "job.py").write_text("import time\nprint('start')\ntime.sleep(0.5)\nprint('end')\n")
+            env = LocalEnv(LocalConf(py_bin=os.path.dirname(sys.executable), default_entry="python job.py"))
+            # the number of jobs running at once
+            running, peak, lock = 0, 0, threading.Lock()
+            env_run = env.run
+
+            def run(*args, **kwargs):
+                nonlocal running, peak
+                with lock:
+                    running += 1
+                    peak = max(peak, running)
+                try:
+                    return env_run(*args, **kwargs)
+                finally:
+                    with lock:
+                        running -= 1
+
+            env.run = run
+            for scheduler_kwargs, memory in [
+                (dict(max_jobs=2, cpu_budget=8), None),  # limited by the number of jobs
+                (dict(max_jobs=4, cpu_budget=8, memory_budget="1g"), 2**29),  # limited by the memory
+            ]:
+                logs = []
+                peak = 0
+                with EnvScheduler(**scheduler_kwargs) as scheduler:
+                    futures = scheduler.submit_batch(
+                        env,
+                        [EnvJob(entry="python job.py", local_path=tmp_dir, memory=memory) for _ in range(4)],
+                        log_handler=lambda job, line: logs.append(line),
+                    )
+                    results = [future.result() for future in futures]
+                assert all(result.split() == ["start", "end"] for result in results)
+                assert logs.count("end") == 4
+                # two jobs at a time
+                assert peak == 2
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,143 @@
+import json
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from rdagent.components.coder.factor_coder.eva_utils import (
+    FactorCorrelationEvaluator,
+    FactorDatetimeDailyEvaluator,
+    FactorEqualValueRatioEvaluator,
+    FactorIndexEvaluator,
+    FactorInfEvaluator,
+    FactorMissingValuesEvaluator,
+    FactorOutputFormatEvaluator,
+    FactorRowCountEvaluator,
+    FactorSingleColumnEvaluator,
+    FactorValueEvaluator,
+)
+
+
+class ValueWorkspace:
+    """A workspace returning a given factor value, counting its executions."""
+
+    def __init__(self, df: pd.DataFrame | None) -> None:
+        self.df = df
+        self.n_executions = 0
+
+    def execute(self):
+        self.n_executions += 1
+        return "Execution succeeded without error.", self.df
+
+
+def evaluate_per_check(implementation, gt_implementation):
+    """The evaluation of `FactorValueEvaluator` (version 1), with each check loading the values on its own."""
+    conclusions = []
+    row_result, index_result, output_format_result = None, 0, None
+    equal_value_ratio_result, high_correlation_result = 0, False
+
+    conclusions.append(FactorSingleColumnEvaluator().evaluate(implementation, gt_implementation)[0])
+    feedback_str, inf_evaluate_res = FactorInfEvaluator().evaluate(implementation, gt_implementation)
+    conclusions.append(feedback_str)
+    conclusions.append(FactorOutputFormatEvaluator().evaluate(implementation, gt_implementation)[0])
+    feedback_str, daily_check_result = FactorDatetimeDailyEvaluator().evaluate(implementation, gt_implementation)
+    conclusions.append(feedback_str)
+    if gt_implementation is not None:
+        feedback_str, row_result = FactorRowCountEvaluator().evaluate(implementation, gt_implementation)
+        conclusions.append(feedback_str)
+        feedback_str, index_result = FactorIndexEvaluator().evaluate(implementation, gt_implementation)
+        conclusions.append(feedback_str)
+        feedback_str, output_format_result = FactorMissingValuesEvaluator().evaluate(implementation, gt_implementation)
+        conclusions.append(feedback_str)
+        feedback_str, equal_value_ratio_result = FactorEqualValueRatioEvaluator().evaluate(
+            implementation, gt_implementation
+        )
+        conclusions.append(feedback_str)
+        if index_result > 0.99:
+            feedback_str, high_correlation_result = FactorCorrelationEvaluator(hard_check=True).evaluate(
+                implementation, gt_implementation
+            )
+        else:
+            feedback_str = "The source dataframe and the ground truth dataframe have different index. Give up comparing the values and correlation because it's useless"
+        conclusions.append(feedback_str)
+
+    if gt_implementation is not None and (equal_value_ratio_result > 0.99) or high_correlation_result:
+        decision = True
+    elif (
+        row_result is not None
+        and row_result <= 0.99
+        or output_format_result is False
+        or daily_check_result is False
+        or inf_evaluate_res is False
+    ):
+        decision = False
+    else:
+        decision = None
+    return "\n".join(conclusions), decision
+
+
+@pytest.mark.offline
+# the output format is checked by the LLM
+@mock.patch(
+    "rdagent.components.coder.factor_coder.eva_utils.APIBackend",
+    **{
+        "return_value.build_messages_and_create_chat_completion.return_value": json.dumps(
+            {"output_format_decision": True, "output_format_feedback": "The output format is correct."}
+        )
+    },
+)
+class FactorValueEvaluatorTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        index = pd.MultiIndex.from_product(
+            [pd.date_range("2020-01-01", periods=20), [f"SH{i:06d}" for i in range(10)]],
+            names=["datetime", "instrument"],
+        )
+        self.gt_df = pd.DataFrame({"gt_factor": rng.standard_normal(len(index))}, index=index)
+        self.gt_df.iloc[::13] = np.nan
+
+    def assert_same_evaluation(self, gen_df: pd.DataFrame | None, gt_df: pd.DataFrame | None) -> tuple:
+        implementation = ValueWorkspace(gen_df)
+        gt_implementation = None if gt_df is None else ValueWorkspace(gt_df)
+        result = FactorValueEvaluator().evaluate(implementation, gt_implementation)
+        # the values are loaded once for all the checks
+        self.assertEqual(implementation.n_executions, 1)
+        if gt_implementation is not None:
+            self.assertEqual(gt_implementation.n_executions, 1)
+        self.assertEqual(result, evaluate_per_check(implementation, gt_implementation))
+        return result
+
+    def test_identical_values(self, _):
+        gt_df = self.gt_df.fillna(0)  # the missing values are not counted as equal
+        conclusion, decision = self.assert_same_evaluation(gt_df.sample(frac=1, random_state=0), gt_df)
+        self.assertIn("All values in the dataframes are equal", conclusion)
+        self.assertIn("highly correlated", conclusion)
+        self.assertTrue(decision)
+
+    def test_correlated_values(self, _):
+        conclusion, decision = self.assert_same_evaluation(self.gt_df * 2 + 1, self.gt_df)
+        self.assertIn("highly correlated", conclusion)
+        self.assertTrue(decision)
+
+    def test_partially_overlapping_values(self, _):
+        gen_df = (self.gt_df.iloc[30:] * 2).rename(columns={"gt_factor": "factor"})
+        gen_df.iloc[:5] = self.gt_df.iloc[30:35].to_numpy()
+        conclusion, decision = self.assert_same_evaluation(gen_df, self.gt_df.iloc[:-50])
+        self.assertIn("different index", conclusion)
+        self.assertFalse(decision)
+
+        _, index_similarity = FactorIndexEvaluator().evaluate(ValueWorkspace(gen_df), ValueWorkspace(self.gt_df))
+        gen_index_set, gt_index_set = set(gen_df.index), set(self.gt_df.index)
+        self.assertAlmostEqual(index_similarity, len(gen_index_set & gt_index_set) / len(gen_index_set | gt_index_set))
+
+    def test_none_values(self, _):
+        conclusion, decision = self.assert_same_evaluation(None, self.gt_df)
+        self.assertIn("The source dataframe is None", conclusion)
+        self.assertFalse(decision)
+        self.assert_same_evaluation(self.gt_df, None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from rdagent.components.coder.factor_coder import factor_worker_pool
+from rdagent.components.coder.factor_coder.config import FACTOR_COSTEER_SETTINGS
+from rdagent.components.coder.factor_coder.factor import FactorFBWorkspace, FactorTask
+from rdagent.components.coder.factor_coder.factor_worker_pool import FactorWorkerPool
+from rdagent.core.conf import RD_AGENT_SETTINGS
+from rdagent.scenarios.qlib.developer.factor_runner import QlibFactorRunner
+
+FACTOR_CODE = """
+import pandas as pd
+
+df = pd.read_hdf("daily_pv.h5", key="data")
+df["$close"] *= 2  # the source data may be modified
+print("factor computed")
+df[["$close"]].rename(columns={"$close": "factor_a"}).to_hdf("result.h5", key="data")
+"""
+
+# waits until the other factor runs at the same time, so it fails when the factors are executed one by one
+CONCURRENT_FACTOR_CODE = """
+import time
+from pathlib import Path
+
+import pandas as pd
+
+started = Path({started!r})
+(started / {name!r}).touch()
+deadline = time.time() + 30
+while len(list(started.iterdir())) < 2:
+    assert time.time() < deadline, "the other factor did not run at the same time"
+    time.sleep(0.05)
+df = pd.read_hdf("daily_pv.h5", key="data")
+df[["$close"]].rename(columns={{"$close": {name!r}}}).to_hdf("result.h5", key="data")
+"""
+
+
+@pytest.mark.offline
+class FactorWorkerPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name)
+        index = pd.MultiIndex.from_product(
+            [pd.date_range("2020-01-01", periods=3), ["SH600000", "SH600001"]], names=["datetime", "instrument"]
+        )
+        self.source_df = pd.DataFrame({"$close": np.arange(6.0)}, index=index)
+        (self.path / "data").mkdir()
+        self.source_df.to_hdf(self.path / "data" / "daily_pv.h5", key="data")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_run(self):
+        pool = FactorWorkerPool(1, self.path / "cache")
+        try:
+            (self.path / "data" / "factor.py").write_text(FACTOR_CODE)
+            for _ in range(2):  # the second run reads the source data cached by the worker
+                success, output = pool.run(self.path / "data" / "factor.py", self.path / "data")
+                self.assertTrue(success)
+                self.assertEqual(output, "factor computed\n")
+                result = pd.read_hdf(self.path / "data" / "result.h5")
+                np.testing.assert_array_equal(result["factor_a"].to_numpy(), self.source_df["$close"] * 2)
+
+            (self.path / "data" / "error.py").write_text("import pandas as pd\n\n1 / 0\n")
+            success, output = pool.run(self.path / "data" / "error.py", self.path / "data")
+            self.assertFalse(success)
+            self.assertTrue(output.startswith("Traceback (most recent call last):\n  File"))
+            self.assertIn('error.py", line 3', output)
+            self.assertIn("ZeroDivisionError", output)
+
+            (self.path / "data" / "slow.py").write_text("import time\n\ntime.sleep(60)\n")
+            with self.assertRaises(subprocess.TimeoutExpired):
+                pool.run(self.path / "data" / "slow.py", self.path / "data", timeout=1)
+            # the worker is replaced
+            success, _ = pool.run(self.path / "data" / "factor.py", self.path / "data")
+            self.assertTrue(success)
+        finally:
+            pool.close()
+
+    def test_workspace_modules(self):
+        # like the template of the version 2 tasks, which imports the `factor.py` of its workspace
+        pool = FactorWorkerPool(1, self.path / "cache")
+        try:
+            for value in range(2):
+                workspace_path = self.path / f"workspace_{value}"
+                workspace_path.mkdir()
+                (workspace_path / "factor.py").write_text(f"VALUE = {value}\n")
+                (workspace_path / "main.py").write_text("from factor import VALUE\n\nprint(VALUE)\n")
+                success, output = pool.run(workspace_path / "main.py", workspace_path)
+                self.assertTrue(success)
+                self.assertEqual(output, f"{value}\n")
+        finally:
+            pool.close()
+
+    def test_factor_execution(self):
+        with (
+            mock.patch.multiple(
+                FACTOR_COSTEER_SETTINGS, data_folder_debug=str(self.path / "data"), execution_mode="worker_pool"
+            ),
+            mock.patch.multiple(
+                RD_AGENT_SETTINGS,
+                workspace_path=self.path / "workspace",
+                pickle_cache_folder_path_str=str(self.path / "pickle_cache"),
+                cache_with_pickle=False,
+            ),
+        ):
+            workspace = FactorFBWorkspace(target_task=FactorTask("factor_a", "description of factor a", "a = b"))
+            workspace.code_dict = {"factor.py": FACTOR_CODE}
+            feedback, df = workspace.execute()
+            self.assertIn(FactorFBWorkspace.FB_OUTPUT_FILE_FOUND, feedback)
+            np.testing.assert_array_equal(df["factor_a"].to_numpy(), self.source_df["$close"] * 2)
+
+            workspace.code_dict = {"factor.py": "raise ValueError('invalid factor')\n"}
+            feedback, df = workspace.execute()
+            self.assertIsNone(df)
+            self.assertIn("ValueError: invalid factor", feedback)
+
+    def test_concurrent_factor_execution(self):
+        (self.path / "started").mkdir()
+        with (
+            mock.patch.multiple(
+                FACTOR_COSTEER_SETTINGS, data_folder=str(self.path / "data"), execution_mode="worker_pool"
+            ),
+            mock.patch.multiple(
+                RD_AGENT_SETTINGS,
+                workspace_path=self.path / "workspace",
+                pickle_cache_folder_path_str=str(self.path / "pickle_cache"),
+                cache_with_pickle=False,
+                multi_proc_n=1,
+            ),
+            mock.patch.object(factor_worker_pool, "_POOL", None),  # a pool of its own, with the default size
+        ):
+            workspaces = []
+            for name in ["factor_a", "factor_b"]:
+                workspace = FactorFBWorkspace(target_task=FactorTask(name, f"description of {name}", "a = b"))
+                workspace.code_dict = {
+                    "factor.py": CONCURRENT_FACTOR_CODE.format(started=str(self.path / "started"), name=name)
+                }
+                workspaces.append(workspace)
+            try:
+                factor_dfs = QlibFactorRunner(None).execute_factors(workspaces)
+            finally:
+                factor_worker_pool.get_factor_worker_pool().close()
+            for name, df in zip(["factor_a", "factor_b"], factor_dfs):
+                np.testing.assert_array_equal(df[name].to_numpy(), self.source_df["$close"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from rdagent.components.coder.factor_coder.config import FACTOR_COSTEER_SETTINGS
+from rdagent.components.coder.factor_coder.factor import FactorFBWorkspace, FactorTask
+from rdagent.core.conf import RD_AGENT_SETTINGS
+from rdagent.utils.frame_store import (
+    dump_frame,
+    load_frame,
+    read_frame,
+    read_frame_meta,
+)
+
+FACTOR_CODE = """
+import numpy as np
+import pandas as pd
+
+index = pd.MultiIndex.from_product(
+    [pd.date_range("2020-01-01", periods=3), ["SH600000", "SH600001"]], names=["datetime", "instrument"]
+)
+pd.DataFrame({"factor_a": np.arange(6.0)}, index=index).iloc[::-1].to_hdf("result.h5", key="data")
+"""
+
+
+@pytest.mark.offline
+class FrameStoreTest(unittest.TestCase):
+    def test_dump_and_load(self):
+        index = pd.MultiIndex.from_product(
+            [pd.date_range("2020-01-01", periods=4), ["SH600000", "SH600001", "SZ000001"]],
+            names=["datetime", "instrument"],
+        )
+        df = pd.DataFrame({"factor_a": np.random.randn(len(index)), "factor_b": np.arange(len(index))}, index=index)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dump_frame(df, Path(tmp_dir) / "store")
+            loaded, other = load_frame(Path(tmp_dir) / "store"), load_frame(Path(tmp_dir) / "store")
+            pd.testing.assert_frame_equal(loaded, df)
+            # the loaded frames are private: modifying one changes neither the others nor the store
+            loaded.iloc[0, 0] = 100.0
+            loaded.columns = ["a", "b"]
+            self.assertEqual(loaded.iloc[0, 0], 100.0)
+            pd.testing.assert_frame_equal(other, df)
+            pd.testing.assert_frame_equal(load_frame(Path(tmp_dir) / "store"), df)
+
+            series = pd.Series(["a", "b", None], index=pd.Index(["x", "y", "z"], name="key"), name="text")
+            dump_frame(series, Path(tmp_dir) / "series")
+            pd.testing.assert_series_equal(load_frame(Path(tmp_dir) / "series"), series)
+
+    def test_select_and_describe(self):
+        index = pd.MultiIndex.from_product(
+            [pd.date_range("2020-01-01", periods=10), ["SH600000", "SH600001", "SZ000001"]],
+            names=["datetime", "instrument"],
+        )
+        df = pd.DataFrame({"$close": np.random.randn(len(index)), "$volume": np.arange(len(index))}, index=index)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dump_frame(df, Path(tmp_dir) / "daily_pv")
+            df.to_hdf(Path(tmp_dir) / "daily_pv.h5", key="data")
+            expected = df.loc["2020-01-03":"2020-01-05", ["$volume"]]
+            for path in ["daily_pv", "daily_pv.h5"]:  # the columnar store and the compatible HDF5 file
+                selected = read_frame(Path(tmp_dir) / path, columns=["$volume"], start="2020-01-03", end="2020-01-05")
+                pd.testing.assert_frame_equal(selected, expected)
+            # the rows of an unsorted store are selected too
+            dump_frame(df.iloc[::-1], Path(tmp_dir) / "unsorted")
+            pd.testing.assert_frame_equal(
+                load_frame(Path(tmp_dir) / "unsorted", start="2020-01-03", end="2020-01-05").sort_index(),
+                df.loc["2020-01-03":"2020-01-05"],
+            )
+
+            meta = read_frame_meta(Path(tmp_dir) / "daily_pv")
+            self.assertEqual(meta["index_names"], ["datetime", "instrument"])
+            self.assertEqual(meta["dtypes"].to_dict(), df.dtypes.to_dict())
+            self.assertEqual(meta["length"], len(df))
+
+    def test_factor_execution(self):
+        with (
+            tempfile.TemporaryDirectory() as tmp_dir,
+            mock.patch.multiple(
+                FACTOR_COSTEER_SETTINGS, data_folder_debug=str(Path(tmp_dir) / "data"), python_bin=sys.executable
+            ),
+            mock.patch.multiple(
+                RD_AGENT_SETTINGS,
+                workspace_path=Path(tmp_dir) / "workspace",
+                pickle_cache_folder_path_str=str(Path(tmp_dir) / "pickle_cache"),
+            ),
+        ):
+            workspace = FactorFBWorkspace(target_task=FactorTask("factor_a", "description of factor a", "a = b"))
+            workspace.code_dict = {"factor.py": FACTOR_CODE}
+            feedback, df = workspace.execute()
+            self.assertIn(FactorFBWorkspace.FB_OUTPUT_FILE_FOUND, feedback)
+            self.assertTrue(df.index.is_monotonic_increasing)
+            self.assertEqual(df["factor_a"].tolist(), list(np.arange(6.0)))
+            self.assertTrue(workspace.value_store_path().is_relative_to(Path(tmp_dir) / "pickle_cache"))
+
+            # the cached execution loads the stored values, which the changes of a caller do not reach
+            df.iloc[0, 0] = 100.0
+            _, cached_df = workspace.execute()
+            self.assertEqual(cached_df["factor_a"].tolist(), list(np.arange(6.0)))
+
+            # a cached execution whose store was removed runs again
+            shutil.rmtree(Path(tmp_dir) / "pickle_cache" / "factor_values")
+            _, rerun_df = workspace.execute()
+            self.assertEqual(rerun_df["factor_a"].tolist(), list(np.arange(6.0)))
+
+            # the stores are recorded relative to the pickle cache, which can be moved without running again
+            moved_cache = Path(tmp_dir) / "moved_cache"
+            shutil.move(Path(tmp_dir) / "pickle_cache", moved_cache)
+            with (
+                mock.patch.multiple(RD_AGENT_SETTINGS, pickle_cache_folder_path_str=str(moved_cache)),
+                mock.patch.object(FactorFBWorkspace, "link_all_files_in_folder_to_workspace") as link_files,
+            ):
+                _, value_path = workspace.execute_to_store()
+            link_files.assert_not_called()
+            self.assertTrue(value_path.is_relative_to(moved_cache))
+
+
+if __name__ == "__main__":
+    unittest.main()
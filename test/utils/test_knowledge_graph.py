@@ -0,0 +1,91 @@
+import pickle
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from rdagent.components.knowledge_management.graph import (
+    Graph,
+    UndirectedGraph,
+    UndirectedNode,
+)
+from rdagent.components.knowledge_management.vector_base import PDVectorBase
+
+
+def _batch_embedding(nodes: list[UndirectedNode]) -> list[UndirectedNode]:
+    for node in nodes:
+        node.embedding = np.random.rand(8).tolist()
+    return nodes
+
+
+@pytest.mark.offline
+@mock.patch.object(Graph, "batch_embedding", staticmethod(_batch_embedding))
+class UndirectedGraphTest(unittest.TestCase):
+    def test_legacy_pickle(self):
+        graph = UndirectedGraph()
+        graph.add_nodes_with_edges(
+            [
+                (UndirectedNode("task a", "task"), UndirectedNode("error a", "error")),
+                (UndirectedNode("task b", "task"), None),
+            ]
+        )
+        # a graph pickled before the indexes were added, e.g. in a CoSTEER knowledge base
+        legacy_graph = UndirectedGraph.__new__(UndirectedGraph)
+        legacy_graph.__dict__.update({"nodes": graph.nodes, "vector_base": graph.vector_base, "path": None})
+        loaded = pickle.loads(pickle.dumps(legacy_graph))
+
+        self.assertEqual(loaded.find_node("error a", "error").content, "error a")
+        self.assertEqual([node.content for node in loaded.get_all_nodes_by_label_list(["task"])], ["task a", "task b"])
+        self.assertEqual(
+            [node.content for node in loaded.get_nodes_within_steps(loaded.find_node("task a", "task"))],
+            ["error a"],
+        )
+        loaded.add_node(UndirectedNode("task c", "task"), UndirectedNode("error a", "error"))
+        self.assertEqual(loaded.size(), 4)
+
+    def test_add_node_resolves_neighbor_by_its_own_label(self):
+        def node(content: str, label: str, node_id: str) -> UndirectedNode:
+            node = UndirectedNode(content, label)
+            node.id = node_id  # e.g. restored from a dict; the ids are usually derived from the content
+            return node
+
+        graph = UndirectedGraph()
+        graph.add_nodes_with_edges(
+            [(node("same content", "task", "task node"), None), (node("same content", "error", "error node"), None)]
+        )
+        graph.add_node(UndirectedNode("task a", "task"), node("same content", "error", "new error node"))
+        # the neighbor is the existing node with its own label ("error"), not with the label of the node ("task")
+        neighbors = graph.find_node("task a", "task").neighbors
+        self.assertEqual([neighbor.id for neighbor in neighbors], ["error node"])
+        self.assertEqual(graph.size(), 3)
+
+
+@pytest.mark.offline
+class PDVectorBaseTest(unittest.TestCase):
+    def test_dump_loaded_without_append(self):
+        embeddings = np.random.rand(3, 8).astype(np.float32)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "vector_base.pkl"
+            vector_base = PDVectorBase(path)
+            vector_base.add_records(
+                [{"id": str(i), "content": f"doc {i}", "embedding": e} for i, e in enumerate(embeddings)]
+            )
+            vector_base.dump()
+
+            # the embeddings of the loaded base are a memory map of the file they are dumped to again
+            loaded = PDVectorBase(path)
+            loaded.dump()
+            reloaded = PDVectorBase(path)
+
+            self.assertEqual([record["content"] for record in reloaded.records], ["doc 0", "doc 1", "doc 2"])
+            np.testing.assert_allclose(reloaded.index.embeddings, loaded.index.embeddings)
+            np.testing.assert_allclose(
+                reloaded.index.embeddings, embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True), rtol=1e-6
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
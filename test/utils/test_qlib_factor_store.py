@@ -0,0 +1,153 @@
+import gc
+import inspect
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from rdagent.components.coder.factor_coder.factor import FactorFBWorkspace, FactorTask
+from rdagent.core.conf import RD_AGENT_SETTINGS
+from rdagent.scenarios.qlib.developer.factor_runner import QlibFactorRunner
+from rdagent.scenarios.qlib.developer.factor_store import QlibFactorStore
+from rdagent.scenarios.qlib.experiment.factor_experiment import QlibFactorExperiment
+from rdagent.scenarios.qlib.experiment.workspace import QlibFBWorkspace
+from rdagent.utils import get_module_by_module_path
+from rdagent.utils.frame_store import dump_frame
+
+# the reader used by qlib in the workspaces, loaded by path like qlib loads it
+read_combined_factors = get_module_by_module_path(
+    str(Path(inspect.getfile(QlibFactorExperiment)).parent / "factor_template" / "combined_factors_reader.py")
+).read_combined_factors
+
+
+@pytest.mark.offline
+class QlibFactorStoreTest(unittest.TestCase):
+    def test_add_load_export(self):
+        rng = np.random.default_rng(0)
+        index = pd.MultiIndex.from_product(
+            [pd.date_range("2020-01-01", periods=10), [f"SH{i:06d}" for i in range(5)]],
+            names=["datetime", "instrument"],
+        )
+        a = pd.DataFrame({"a": rng.standard_normal(len(index))}, index=index).sample(frac=1, random_state=0)
+        b = pd.DataFrame({"b": rng.standard_normal(20), "c": rng.standard_normal(20)}, index=index[10:30])
+        new = pd.DataFrame({"d": rng.standard_normal(len(index))}, index=index)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = QlibFactorStore(Path(tmp_dir) / "store")
+            store.add("a", a)
+            store.add("b", b)
+            store.add("invalid", None)
+
+            store = QlibFactorStore(Path(tmp_dir) / "store")  # reopened from the manifest
+            self.assertIn("b", store)
+            self.assertNotIn("d", store)
+            expected = pd.concat([a, b], axis=1).sort_index()
+            pd.testing.assert_frame_equal(store.load(["a", "invalid", "b"]), expected, check_freq=False)
+            # too many columns to map them are read
+            with mock.patch("rdagent.scenarios.qlib.developer.factor_store.MAX_MAPPED_COLUMNS", 1):
+                pd.testing.assert_frame_equal(store.load(["a", "invalid", "b"]), expected, check_freq=False)
+
+            exported = store.export(Path(tmp_dir) / "workspace", ["b"], new)
+            pd.testing.assert_frame_equal(
+                exported.load(["b", "new"]), pd.concat([b, new], axis=1).sort_index(), check_freq=False
+            )
+            # the stored columns are shared with the export, not written again
+            column_file = store.manifest["factors"]["b"][0]["file"]
+            self.assertTrue(os.path.samefile(store.path / column_file, exported.path / column_file))
+
+
+@pytest.mark.offline
+class QlibFactorRunnerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name)
+        rng = np.random.default_rng(0)
+        self.index = pd.MultiIndex.from_product(
+            [pd.date_range("2020-01-01", periods=10), [f"SH{i:06d}" for i in range(5)]],
+            names=["datetime", "instrument"],
+        )
+        a = pd.DataFrame({"a": rng.standard_normal(len(self.index))}, index=self.index)
+        a.iloc[::7] = np.nan
+        self.factor_values = {
+            "a": a.sample(frac=1, random_state=0),
+            "b": pd.DataFrame({"b": rng.standard_normal(30)}, index=self.index[10:40]),
+            # a new factor named like a SOTA one, which replaces it
+            "c": pd.DataFrame({"b": rng.standard_normal(45), "c": rng.standard_normal(45)}, index=self.index[5:]),
+            # almost the same as a SOTA factor, so it is deduplicated
+            "d": a.rename(columns={"a": "d"}) * 2 + 1e-6,
+            "e": pd.DataFrame({"e": rng.standard_normal(len(self.index)), "text": "x"}, index=self.index),
+        }
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _execute_to_store(self, implementation: FactorFBWorkspace, data_type: str = "Debug"):
+        value_path = self.path / "values" / implementation.target_task.factor_name
+        dump_frame(self.factor_values[implementation.target_task.factor_name], value_path)
+        return "Execution succeeded without error.", value_path
+
+    def _experiment(self, factor_names: list, based_experiments: list) -> QlibFactorExperiment:
+        tasks = [FactorTask(name, f"description of {name}", f"{name} = 1") for name in factor_names]
+        exp = QlibFactorExperiment(sub_tasks=tasks, based_experiments=based_experiments)
+        exp.sub_workspace_list = [FactorFBWorkspace(target_task=task) for task in tasks]
+        for workspace in exp.sub_workspace_list:
+            workspace.code_dict = {"factor.py": f"# {workspace.target_task.factor_name}"}
+        return exp
+
+    @staticmethod
+    def _expected(df: pd.DataFrame) -> pd.DataFrame:
+        # the combined factors pickled by the workspace before the store
+        df = df.sort_index()
+        df = df.loc[:, ~df.columns.duplicated(keep="last")]
+        df.columns = pd.MultiIndex.from_product([["feature"], df.columns])
+        return df
+
+    def test_develop(self):
+        with (
+            mock.patch.multiple(RD_AGENT_SETTINGS, workspace_path=self.path / "workspace", cache_with_pickle=False),
+            mock.patch.object(FactorFBWorkspace, "execute_to_store", autospec=True, side_effect=self._execute_to_store),
+            mock.patch.object(QlibFBWorkspace, "execute", return_value="result"),
+        ):
+            runner = QlibFactorRunner(None)
+            baseline_exp = QlibFactorExperiment(sub_tasks=[])
+            baseline_exp.result = "baseline result"
+
+            # without SOTA factors, the new factors are not filtered; the columns which are not numeric are skipped
+            exp = self._experiment(["c", "e"], [baseline_exp])
+            combined_factors_path = exp.experiment_workspace.workspace_path / "combined_factors"
+            stale = QlibFactorStore(combined_factors_path)  # e.g. written by a previous run of the workspace
+            stale.add("stale", self.factor_values["b"].iloc[:3])
+            runner.develop(exp)
+            values = self.factor_values
+            pd.testing.assert_frame_equal(
+                read_combined_factors(combined_factors_path),
+                self._expected(pd.concat([values["c"], values["e"][["e"]]], axis=1)),
+                check_freq=False,
+            )
+
+            # with SOTA factors, the deduplicated new factors are combined with them, and the rows with NaN dropped
+            exp = self._experiment(["c", "d"], [baseline_exp, self._experiment(["a", "b"], [])])
+            runner.develop(exp)
+            SOTA_factor = pd.concat([values["a"], values["b"]], axis=1)
+            combined_factors_path = exp.experiment_workspace.workspace_path / "combined_factors"
+            expected = self._expected(pd.concat([SOTA_factor, values["c"]], axis=1).dropna())
+            pd.testing.assert_frame_equal(read_combined_factors(combined_factors_path), expected, check_freq=False)
+            # too many columns to map them are read
+            with mock.patch.dict(read_combined_factors.__globals__, MAX_MAPPED_COLUMNS=1):
+                pd.testing.assert_frame_equal(read_combined_factors(combined_factors_path), expected, check_freq=False)
+
+            # the store of the SOTA factors is removed with the runner
+            store_path = runner.factor_store.path
+            self.assertTrue(store_path.exists())
+            del runner
+            gc.collect()
+            self.assertFalse(store_path.exists())
+
+
+if __name__ == "__main__":
+    unittest.main()